@@ -1,44 +1,432 @@
 from flask import Flask
 from flask import render_template
+from flask import stream_template
+from flask import stream_with_context
+from flask import Response
 from flask import request
 from flask import redirect
 from flask import url_for
 from flask import flash
+from flask import jsonify
+from flask import make_response
+from flask import session
+from flask import send_from_directory
+from datetime import date, datetime
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from mysql.connector.errors import Error as MySQLError
+import base64
+import functools
+import itertools
+import json
+import os
+import click
+import covers
 import db
+import export
+import fragments
+import metrics
+import migrations
+import profiler
 import connect
 
 app = Flask(__name__)
 app.secret_key = "Library Demo 2025 Secret Key"
 
+# Keep compiled templates on disk, so a new worker loads them instead of compiling every
+# template from source again (optional templatecachedir in connect.py; None turns it off)
+TEMPLATE_CACHE_DIR = getattr(connect, "templatecachedir", os.path.join(app.root_path, ".template_cache"))
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
 # Initialize database connection
+# (the pool settings are optional in connect.py; see db.init_db() for what they mean)
 db.init_db(
-    app, connect.dbuser, connect.dbpass, connect.dbhost, connect.dbname, connect.dbport
+    app, connect.dbuser, connect.dbpass, connect.dbhost, connect.dbname, connect.dbport,
+    pool_size=getattr(connect, "dbpoolsize", 5),
+    checkout_timeout=getattr(connect, "dbpooltimeout", 5.0),
+    recycle_after=getattr(connect, "dbpoolrecycle", 3600),
+)
+# The pool opens on the first request; set dbpoolprewarm = True to open it at startup
+if getattr(connect, "dbpoolprewarm", False):
+    db.warm_pool()
+
+# Serve the read-only list pages from a read replica if connect.py names one (dbreplicahost;
+# the other settings are optional, see db.init_replica(). To try it with a second local
+# MySQL server holding a copy of the database, set dbreplicamaxlag = None).
+if getattr(connect, "dbreplicahost", None):
+    db.init_replica(
+        app, connect.dbreplicahost,
+        port=getattr(connect, "dbreplicaport", connect.dbport),
+        pool_size=getattr(connect, "dbreplicapoolsize", 5),
+        max_lag=getattr(connect, "dbreplicamaxlag", 5.0),
+        sticky_seconds=getattr(connect, "dbreplicasticky", 10.0),
+    )
+
+# Time every query and log the slow ones (settings are optional in connect.py;
+# set dbprofileheaders = True to get X-DB-Query-Count/X-DB-Time-Ms on each response)
+profiler.init_profiler(
+    app,
+    threshold=getattr(connect, "dbslowquery", 0.5),
+    log_file=getattr(connect, "dbslowquerylog", None),
+    debug_headers=getattr(connect, "dbprofileheaders", False),
+)
+
+# Count requests and time their pool, DB and template phases for /metrics
+metrics.init_metrics(app)
+
+# Cache rendered book cards/details (settings are optional in connect.py; set
+# fragmentcachedir to a directory shared by all workers so they reuse each other's HTML)
+fragments.init_fragment_cache(
+    max_entries=getattr(connect, "fragmentcachesize", 256),
+    directory=getattr(connect, "fragmentcachedir", None),
 )
 
+# Number of rows shown on each page of the list pages, and the largest page size
+# a client may ask for with ?per_page=...
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+# Borrower name searches use the ngram FULLTEXT indexes on borrowers. MySQL splits names
+# into ngrams of this many characters (its ngram_token_size setting, default 2), so
+# shorter search terms fall back to an indexed prefix match instead.
+NGRAM_TOKEN_SIZE = 2
+# Most suggestions returned by the search-as-you-type endpoint
+SEARCH_SUGGESTIONS = 10
+# Loans not returned this many days after their loan date are overdue
+OVERDUE_DAYS = getattr(connect, "overduedays", 36)
+# Returned loans older than this many days are moved to loans_archive by archive-loans
+ARCHIVE_AFTER_DAYS = getattr(connect, "archiveafterdays", 365)
+# Most copies checked out (or loans returned) by one batch request
+MAX_BATCH_SIZE = 50
+
+
+# ========================================
+# Pagination Helpers
+# ========================================
+def encode_page_token(row, order_by):
+    """Encode the sort key values of `row` as an opaque string for ?after= / ?before= links"""
+    values = []
+    for _column, key, _descending in order_by:
+        value = row[key]
+        if isinstance(value, (date, datetime)):
+            value = value.isoformat()  # MySQL compares ISO date strings with date columns
+        values.append(value)
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_page_token(token, order_by):
+    """Decode a page token back into sort key values, or None if it is missing or invalid"""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != len(order_by):
+        return None
+    # Sort key values are strings, numbers or NULL; anything else would reach the query
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        return None
+    return values
+
+
+def seek_condition(order_by, values, backwards):
+    """Build the WHERE condition selecting rows that sort after (or before, if `backwards`)
+    the given sort key values"""
+    # MySQL won't use an index range for a row comparison or an OR of ANDs, so both
+    # forms start with a plain bound on the first column, e.g. familyname >= %s AND ...
+    first_column, _key, first_descending = order_by[0]
+    bound = "<=" if first_descending != backwards else ">="
+    range_qstr = f"{first_column} {bound} %s"
+
+    # Row comparison, e.g. (familyname, firstname) > (%s, %s), when all keys sort the same way
+    if len({descending for _column, _key, descending in order_by}) == 1:
+        operator = "<" if first_descending != backwards else ">"
+        columns = ", ".join(column for column, _key, _descending in order_by)
+        placeholders = ", ".join(["%s"] * len(order_by))
+        return f"{range_qstr} AND ({columns}) {operator} ({placeholders})", [values[0]] + list(values)
+
+    # Mixed directions: (a > x) OR (a = x AND b < y) OR ...
+    alternatives = []
+    params = [values[0]]
+    for i, (column, _key, descending) in enumerate(order_by):
+        operator = "<" if descending != backwards else ">"
+        terms = [f"{earlier_column} = %s" for earlier_column, _k, _d in order_by[:i]]
+        terms.append(f"{column} {operator} %s")
+        alternatives.append(f"({' AND '.join(terms)})")
+        params.extend(values[:i + 1])
+    return f"{range_qstr} AND ({' OR '.join(alternatives)})", params
+
+
+def order_by_qstr(order_by, reverse=False):
+    """Build an ORDER BY list from (column, row key, descending) tuples, optionally reversed"""
+    return ", ".join(
+        f"{column} {'DESC' if descending != reverse else 'ASC'}"
+        for column, _key, descending in order_by
+    )
+
+
+def build_page_query(args, select_qstr, where_conditions, params, order_by):
+    """Build the SQL and parameters for one page of `select_qstr` (SELECT ... FROM ... JOINs,
+    without WHERE or ORDER BY), using the ?per_page=, ?after= and ?before= values in `args`.
+
+    Uses keyset (seek) pagination rather than OFFSET: a page starts just after (or before)
+    the sort key stored in the ?after= (or ?before=) token, so every page costs the same
+    however far through the table it is. `order_by` is a list of
+    (column, row key, descending) tuples and must end with a unique column.
+    Returns (query, query args, page) where `page` is passed on to finish_page()."""
+    page_size = args.get("per_page", PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    after = decode_page_token(args.get("after"), order_by)
+    before = None if after else decode_page_token(args.get("before"), order_by)
+
+    # Going backwards we read rows in reverse order, then flip them back afterwards
+    backwards = before is not None
+    conditions = list(where_conditions)
+    qargs = list(params)
+    if after or before:
+        seek_qstr, seek_args = seek_condition(order_by, after or before, backwards)
+        conditions.append(seek_qstr)
+        qargs.extend(seek_args)
+
+    where_qstr = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_qstr = order_by_qstr(order_by, reverse=backwards)
+    # Ask for one extra row to find out whether there is another page after this one
+    page_qstr = f"{select_qstr} {where_qstr} ORDER BY {order_qstr} LIMIT %s"
+    page = {"size": page_size, "after": after, "backwards": backwards, "order_by": order_by}
+    return page_qstr, qargs + [page_size + 1], page
+
+
+def finish_page(rows, page, page_url):
+    """Trim the rows fetched with build_page_query() to one page and work out the
+    next/previous page links. `page_url(**args)` builds a link to the current route."""
+    has_more = len(rows) > page["size"]
+    rows = rows[:page["size"]]
+    if page["backwards"]:
+        rows.reverse()
+
+    link_args = {}
+    if page["size"] != PAGE_SIZE:
+        link_args["per_page"] = page["size"]
+    pagination = {"next_url": None, "prev_url": None}
+    if rows:
+        if has_more or page["backwards"]:
+            pagination["next_url"] = page_url(
+                after=encode_page_token(rows[-1], page["order_by"]), **link_args)
+        if page["after"] or (page["backwards"] and has_more):
+            pagination["prev_url"] = page_url(
+                before=encode_page_token(rows[0], page["order_by"]), **link_args)
+
+    return rows, pagination
+
+
+def fetch_page(cursor, select_qstr, where_conditions, params, order_by, link_args=None):
+    """Return one page of rows for the current request plus the URLs of the next/previous
+    pages (see build_page_query()). `link_args` are extra arguments kept in the page links."""
+    page_qstr, qargs, page = build_page_query(
+        request.args, select_qstr, where_conditions, params, order_by)
+    cursor.execute(page_qstr, qargs)
+    rows = cursor.fetchall()
+
+    def page_url(**args):
+        return url_for(request.endpoint, **(link_args or {}), **args)
+
+    return finish_page(rows, page, page_url)
+
+
+# ========================================
+# End of Pagination Helpers
+# ========================================
+
+
+# ========================================
+# Search Helpers
+# ========================================
+def name_search_condition(column, term):
+    """Return a WHERE condition and its parameter matching `term` anywhere in `column`.
+
+    A LIKE '%term%' search can't use an index, so this searches the column's ngram
+    FULLTEXT index for the term as a phrase instead (which also matches anywhere in the
+    name). Terms too short to make an ngram use a prefix LIKE on the normal index."""
+    if len(term) < NGRAM_TOKEN_SIZE:
+        # Escape LIKE wildcards so they are matched literally
+        escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"{column} LIKE %s", f"{escaped}%"
+    # Double quotes would end the phrase early, so drop them from the term
+    phrase = term.replace('"', "")
+    return f"MATCH({column}) AGAINST (%s IN BOOLEAN MODE)", f'"{phrase}"'
+
+
+def name_search_query(text):
+    """Build a boolean-mode FULLTEXT query that requires every word in `text`,
+    e.g. 'di wa' becomes '+"di" +"wa"'. Returns None if there is nothing to search for."""
+    words = [word.replace('"', "") for word in text.split()]
+    words = [word for word in words if len(word) >= NGRAM_TOKEN_SIZE]
+    if not words:
+        return None
+    return " ".join(f'+"{word}"' for word in words)
+
+
+# ========================================
+# End of Search Helpers
+# ========================================
+
+
+# ========================================
+# Overdue Helpers
+# ========================================
+def overdue_condition(alias):
+    """Return the SQL condition that is true for overdue loans (`alias` is the loans table).
+    Comparing loandate with a cutoff date (rather than DATEDIFF(CURDATE(), loandate))
+    lets MySQL find the overdue loans as one range of the openloans_idx index."""
+    return (f"{alias}.returned IS NULL "
+            f"AND {alias}.loandate <= CURDATE() - INTERVAL {int(OVERDUE_DAYS)} DAY")
+
+
+# ========================================
+# End of Overdue Helpers
+# ========================================
+
+
+# ========================================
+# HTTP Caching Helpers
+# ========================================
+def is_not_modified(req, etag, last_modified):
+    """Return True if the client's cached copy of the page (per its If-None-Match or
+    If-Modified-Since header) is still current, so a 304 can be sent instead"""
+    if req.if_none_match:
+        return req.if_none_match.contains_weak(etag)
+    return req.if_modified_since is not None and req.if_modified_since >= last_modified
+
+
+def set_validators(response, etag, last_modified):
+    """Add the ETag/Last-Modified headers to a page response. no-cache makes browsers
+    check with the server (cheaply, see is_not_modified()) before reusing their copy."""
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional_get(*tables):
+    """Decorator for read-only pages built only from `tables`. The page's ETag and
+    Last-Modified come from the tables' version stamps (see db.bump_version()), so
+    a repeat visit is answered with 304 Not Modified without querying or rendering."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # A pending flash message is shown on the next page rendered, so render it
+            if "_flashes" in session:
+                return view(*args, **kwargs)
+            etag, last_modified = db.table_versions(*tables)
+            if is_not_modified(request, etag, last_modified):
+                return set_validators(make_response("", 304), etag, last_modified)
+            response = make_response(view(*args, **kwargs))
+            return finish_conditional_get(
+                response, etag, last_modified, db.read_may_be_stale(*tables))
+        return wrapper
+    return decorator
+
+
+def finish_conditional_get(response, etag, last_modified, may_be_stale):
+    """Add the ETag and Last-Modified headers to a page rendered by a
+    conditional_get() view. A page read from a replica that may not have the latest
+    change yet mustn't be kept by browsers under the new ETag, so it is marked
+    no-store instead."""
+    if may_be_stale:
+        response.cache_control.no_store = True
+        return response
+    return set_validators(response, etag, last_modified)
+
+
+def render_fragment(template, book):
+    """Render `template` for one book, reusing the HTML cached for the current version
+    of the books table (see fragments.py; the same version gives the book pages their
+    ETags). Returns Markup, so the page template includes the HTML without escaping it
+    again."""
+    version, _last_modified = db.table_versions("books")
+    key = fragments.fragment_key(template, "book", book["bookid"], version)
+    html = fragments.get_fragment(key)
+    if html is None:
+        html = render_template(template, book=book)
+        if not db.read_may_be_stale("books"):
+            fragments.set_fragment(key, html)
+    return Markup(html)
+
+
+# ========================================
+# End of HTTP Caching Helpers
+# ========================================
+
+
+# ========================================
+# Cover Image Helpers
+# ========================================
+def cover_sources(image, build_url):
+    """Return the src, srcset and WebP srcset for a book's cover (see covers.py), using
+    `build_url` (the app's url_for) to make the content-hashed /covers URLs"""
+    info = covers.cover_info(image.strip()) if image and image.strip() else None
+    if info is None:
+        info = covers.cover_info(covers.NO_COVER_IMAGE)
+    if info is None:
+        return {"src": build_url("static", filename="book-covers/" + covers.NO_COVER_IMAGE),
+                "srcset": "", "webp_srcset": ""}
+
+    def srcset(thumbnails):
+        return ", ".join(
+            f"{build_url('cover_file', filename='cache/' + name)} {width}w"
+            for name, width in thumbnails)
+
+    if info["jpeg"]:
+        # Browsers without srcset support get the thumbnail closest to the 300px display size
+        name, _width = min(info["jpeg"], key=lambda thumbnail: abs(thumbnail[1] - 300))
+        src = build_url("cover_file", filename="cache/" + name)
+    else:
+        src = build_url("cover_file", filename=info["filename"], v=info["hash"])
+    return {"src": src, "srcset": srcset(info["jpeg"]), "webp_srcset": srcset(info["webp"])}
+
+
+@app.template_global()
+def cover_image(image):
+    """Template function giving the URLs to show a book's cover (see cover_sources())"""
+    return cover_sources(image, url_for)
+
+
+# ========================================
+# End of Cover Image Helpers
+# ========================================
+
 
 # ========================================
 # 1. Home Page Routes
 # ========================================
 @app.route("/")
+@db.replica_reads
+@conditional_get("books", "loans")
 def home():
     """Display top 3 most popular books on home page"""
     cursor = db.get_cursor()
 
-    # Query to get top 3 most borrowed books
+    # Query to get top 3 most borrowed books.
+    # bookloancounts holds a running loan total per book (maintained by loan()), so this
+    # reads the first 3 entries of the loancount index instead of counting every loan.
     qstr = """
     SELECT b.bookid, b.booktitle, b.author, b.bookcategory, b.yearofpublication, 
-           b.image, COUNT(l.loanid) as loan_count
-    FROM books b
-    JOIN bookcopies bc ON b.bookid = bc.bookid  
-    JOIN loans l ON bc.bookcopyid = l.bookcopyid
-    GROUP BY b.bookid, b.booktitle, b.author, b.bookcategory, b.yearofpublication, b.image
-    ORDER BY loan_count DESC
+           b.image, lc.loancount as loan_count
+    FROM bookloancounts lc
+    JOIN books b ON lc.bookid = b.bookid
+    ORDER BY lc.loancount DESC
     LIMIT 3
     """
 
     cursor.execute(qstr)
     popular_books = cursor.fetchall()
     cursor.close()
+    # The loan counts change with every loan, so they are left out of the cached cards
+    for book in popular_books:
+        book["card_html"] = render_fragment("book_card.html", book)
     return render_template("home.html", popular_books=popular_books)
 
 
@@ -50,54 +438,57 @@ def home():
 # ========================================
 # 2. Book Management Routes
 # ========================================
+# Statements run on every page view are prepared once per connection (see db.register_query())
+db.register_query("book_by_id", """
+    SELECT bookid, booktitle, author, bookcategory, yearofpublication, description, image
+    FROM books
+    WHERE bookid = %s
+    """)
+
+
 @app.route("/book_list")
+@db.replica_reads
+@conditional_get("books")
 def book_list():
-    """Return all books, sorted by title"""
+    """Return one page of books, sorted by title"""
     cursor = db.get_cursor()
     books_qstr = """
         SELECT bookid, booktitle, author, bookcategory, yearofpublication
-        FROM books 
-        ORDER BY booktitle
+        FROM books
         """
-    cursor.execute(books_qstr)
-    books = cursor.fetchall()
+    # bookid breaks ties between books with the same title
+    order_by = [("booktitle", "booktitle", False), ("bookid", "bookid", False)]
+    books, pagination = fetch_page(cursor, books_qstr, [], [], order_by)
     cursor.close()
     return render_template(
         "book_list.html",
-        books=books)
+        books=books,
+        pagination=pagination)
 
 
 @app.route("/book", methods=["GET"])
+@db.replica_reads
+@conditional_get("books")
 def book_detail():
     """Display detailed information for a specific book using a query string (?book_id=...)
     and GET method."""
-    cursor = db.get_cursor()
     book_id = request.args.get("book_id")
     # Get book details
-    book_qstr = """
-    SELECT bookid, booktitle, author, bookcategory, yearofpublication, description, image
-    FROM books 
-    WHERE bookid = %s
-    """
-    qargs = (book_id,)
-    cursor.execute(book_qstr, qargs)
-    book = cursor.fetchone()
-
-    cursor.close()
+    book = db.run_query_one("book_by_id", (book_id,))
 
-    return render_template("book_detail.html", book=book)
+    if book is None:
+        book_info_html = Markup(render_template("book_info.html", book=book))
+    else:
+        book_info_html = render_fragment("book_info.html", book)
+    return render_template("book_detail.html", book=book, book_info_html=book_info_html)
 
 
 @app.route("/book_add")
 def book_add():
     """Click to add new book - show new book form"""
-    cursor = db.get_cursor()
-
-    # Get all categories for dropdown
+    # Get all categories for dropdown (cached, as categories rarely change)
     categories_qstr = "SELECT category FROM categories ORDER BY category"
-    cursor.execute(categories_qstr)
-    categories = cursor.fetchall()
-    cursor.close()
+    categories = db.cached_query("categories", categories_qstr)
 
     return render_template(
         "book_manage.html", book=None, is_edit=False, categories=categories
@@ -107,24 +498,14 @@ def book_add():
 @app.route("/book_manage", methods=["GET"])
 def book_edit():
     """Click to edit book - show edit book form with pre-filled data"""
-    cursor = db.get_cursor()
     book_id = request.args.get("book_id")
 
-    # Get all categories for dropdown
+    # Get all categories for dropdown (cached, as categories rarely change)
     categories_qstr = "SELECT category FROM categories ORDER BY category"
-    cursor.execute(categories_qstr)
-    categories = cursor.fetchall()
+    categories = db.cached_query("categories", categories_qstr)
 
     # Get book details
-    book_qstr = """
-    SELECT bookid, booktitle, author, bookcategory, yearofpublication, description, image
-    FROM books 
-    WHERE bookid = %s
-    """
-    qargs = (book_id,)
-    cursor.execute(book_qstr, qargs)
-    book = cursor.fetchone()
-    cursor.close()
+    book = db.run_query_one("book_by_id", (book_id,))
 
     if not book:
         # Flash displays a popup message on the next page loaded. This is set-up in base.html.
@@ -208,9 +589,30 @@ def book_save():
         flash("Book created successfully!", "success")
 
     cursor.close()
+    if image:
+        covers.cover_info(image)  # make the cover's thumbnails now rather than on first view
+    # Titles/authors may have changed, so drop the cached books dropdown list, and give
+    # the book pages new ETags (which also retires the rendered book HTML)
+    db.invalidate_cache("available_books")
+    db.bump_version("books")
     return redirect(url_for("book_detail", book_id=book_id))
 
 
+@app.route("/covers/<path:filename>")
+def cover_file(filename):
+    """Serve a cover thumbnail (cache/...) or original cover (?v=<content hash>). The
+    URLs change whenever the file does, so browsers may keep them for a year."""
+    response = send_from_directory(covers.COVERS_DIR, filename, max_age=covers.COVER_MAX_AGE)
+    info = None if filename.startswith("cache/") else covers.cover_info(filename)
+    if info is not None and request.args.get("v") != info["hash"]:
+        # An old (or missing) hash: this URL may show different content later
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.immutable = True
+    return response
+
+
 # ========================================
 # End of Book Management Routes
 # ========================================
@@ -220,29 +622,191 @@ def book_save():
 # 3. Loan Management Routes
 # ========================================
 
+# A copy is available when it has no open (not yet returned) loan. NOT EXISTS lets MySQL
+# probe the loans (bookcopyid, returned) index once per copy, rather than building the
+# list of every open loan in the library as the old NOT IN subquery did.
+AVAILABLE_COPIES_QSTR = """
+    SELECT bc.bookcopyid, bc.format
+    FROM bookcopies bc
+    WHERE bc.bookid = %s
+    AND NOT EXISTS (
+        SELECT 1
+        FROM loans l
+        WHERE l.bookcopyid = bc.bookcopyid
+        AND l.returned IS NULL
+    )
+    ORDER BY bc.format
+    """
+
+AVAILABLE_BOOKS_QSTR = """
+    SELECT b.bookid, b.booktitle, b.author
+    FROM books b
+    WHERE EXISTS (
+        SELECT 1
+        FROM bookcopies bc
+        WHERE bc.bookid = b.bookid
+        AND NOT EXISTS (
+            SELECT 1
+            FROM loans l
+            WHERE l.bookcopyid = bc.bookcopyid
+            AND l.returned IS NULL
+        )
+    )
+    ORDER BY b.booktitle
+    """
+
+
+db.register_query("available_copies", AVAILABLE_COPIES_QSTR)
+db.register_query("insert_loan", """
+    INSERT INTO loans (bookcopyid, borrowerid, loandate, returned)
+    VALUES (%s, %s, CURDATE(), NULL)
+    """)
+db.register_query("count_loan", """
+    INSERT INTO bookloancounts (bookid, loancount)
+    SELECT bookid, 1 FROM bookcopies WHERE bookcopyid = %s
+    ON DUPLICATE KEY UPDATE loancount = loancount + 1
+    """)
+
+
+# Checkouts lock the copy they loan, skipping copies another checkout has locked: the
+# copy asked for if it's free, otherwise the first free copy of the same book and format.
+# Both reads follow an index (the primary key, bookformat_idx) in order, so InnoDB stops
+# at the first free, unlocked copy instead of locking every candidate and sorting them.
+RESERVE_COPY_QSTR = """
+    SELECT bc.bookcopyid
+    FROM bookcopies bc
+    WHERE bc.bookcopyid = %s
+    AND NOT EXISTS (
+        SELECT 1
+        FROM loans l
+        WHERE l.bookcopyid = bc.bookcopyid
+        AND l.returned IS NULL
+    )
+    FOR UPDATE SKIP LOCKED
+    """
+
+COPY_FORMAT_QSTR = """
+    SELECT bookid, format
+    FROM bookcopies
+    WHERE bookcopyid = %s
+    """
+
+RESERVE_OTHER_COPY_QSTR = """
+    SELECT bc.bookcopyid
+    FROM bookcopies bc
+    WHERE bc.bookid = %s
+    AND bc.format = %s
+    AND NOT EXISTS (
+        SELECT 1
+        FROM loans l
+        WHERE l.bookcopyid = bc.bookcopyid
+        AND l.returned IS NULL
+    )
+    ORDER BY bc.bookcopyid
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+    """
+
+OPEN_LOAN_FOR_COPY_QSTR = """
+    SELECT loanid
+    FROM loans
+    WHERE bookcopyid = %s
+    AND returned IS NULL
+    LIMIT 1
+    """
+
+# How many times a checkout looks for another copy after losing one to a concurrent checkout
+CHECKOUT_ATTEMPTS = 3
+
+db.register_query("reserve_copy", RESERVE_COPY_QSTR)
+db.register_query("copy_format", COPY_FORMAT_QSTR)
+db.register_query("reserve_other_copy", RESERVE_OTHER_COPY_QSTR)
+db.register_query("open_loan_for_copy", OPEN_LOAN_FOR_COPY_QSTR)
+
+
+def reserve_copy(copy_id):
+    """Lock the copy asked for, or another free copy of the same book and format,
+    until the end of the transaction. Returns the locked copy's id, or None."""
+    reserved = db.run_query_one("reserve_copy", (copy_id,))
+    if reserved is None:
+        wanted = db.run_query_one("copy_format", (copy_id,))
+        if wanted is None:
+            return None
+        reserved = db.run_query_one("reserve_other_copy", (wanted["bookid"], wanted["format"]))
+    return reserved["bookcopyid"] if reserved else None
+
+
+def checkout_copy(copy_id, borrower_id):
+    """Loan a copy to a borrower, or another free copy of the same book in the same
+    format if that one has just been borrowed at another desk. Returns the id of the
+    copy loaned, or None if there is no free copy left."""
+    connection = db.get_db()
+    for _attempt in range(CHECKOUT_ATTEMPTS):
+        # READ COMMITTED: every statement sees the latest commits, and the reads of
+        # loans take no gap locks that would make other checkouts wait
+        connection.start_transaction(isolation_level="READ COMMITTED")
+        try:
+            reserved_id = reserve_copy(copy_id)
+            if reserved_id is None:
+                connection.rollback()
+                return None
+            # A checkout of the same copy that committed while we were choosing it had
+            # released the lock before we got it, so this check sees its loan
+            if db.run_query_one("open_loan_for_copy", (reserved_id,)) is None:
+                # Insert the loan and bump the book's loan total together, so the
+                # popularity counts on the home page never drift from the loans table
+                db.run_statement("insert_loan", (reserved_id, borrower_id))
+                db.run_statement("count_loan", (reserved_id,))
+                connection.commit()
+                return reserved_id
+            connection.rollback()
+        except Exception:
+            # e.g. an unknown borrower: don't leave the copy locked
+            connection.rollback()
+            raise
+    return None
+
+
+def get_available_copies(book_id):
+    """Return the copies of a book that are not currently on loan"""
+    return db.run_query("available_copies", (book_id,))
+
+
+def get_available_books():
+    """Return the books that have at least one copy available, sorted by title.
+    Cached in db.py; loan(), return_book() and book_save() invalidate it."""
+    return db.cached_query("available_books", AVAILABLE_BOOKS_QSTR, tables=("books", "loans"))
+
+
+@app.route("/book_availability", methods=["GET"])
+def book_availability():
+    """Return the available copies of a book as JSON (?book_id=...)"""
+    book_id = request.args.get("book_id", type=int)
+    if book_id is None:
+        return jsonify({"error": "book_id is required"}), 400
+
+    available_copies = get_available_copies(book_id)
+
+    return jsonify({
+        "bookid": book_id,
+        "available": len(available_copies) > 0,
+        "copies": available_copies,
+    })
+
+
 @app.route("/loan", methods=["GET", "POST"])
 def loan():
-    cursor = db.get_cursor()
-
     # Get all borrowers and books for the dropdowns
+    # (served from the reference data cache in db.py; the write routes invalidate it)
     borrowers_qstr = """
     SELECT borrowerid, firstname, familyname 
     FROM borrowers 
     ORDER BY familyname, firstname
     """
-    cursor.execute(borrowers_qstr)
-    borrowers = cursor.fetchall()
+    borrowers = db.cached_query("borrowers", borrowers_qstr, tables=("borrowers",))
 
-    # Return all books for the dropdown
-    # (Better to return only books with available copies, 
-    #  but query too complex for this course)
-    books_qstr = """
-    SELECT bookid, booktitle, author
-    FROM books 
-    ORDER BY booktitle;
-    """
-    cursor.execute(books_qstr)
-    books = cursor.fetchall()
+    # Return only books with at least one copy available for the dropdown
+    books = get_available_books()
 
     if request.method == "POST":
         # Handle loan creation only
@@ -252,46 +816,159 @@ def loan():
 
         # Basic validation (frontend handles most validation)
         if borrower_id and book_id and copy_id:
-            loan_qstr = """
-            INSERT INTO loans (bookcopyid, borrowerid, loandate, returned)
-            VALUES (%s, %s, CURDATE(), NULL)
-            """
-            cursor.execute(loan_qstr, (copy_id, borrower_id))
+            # The copy was free when the form was shown, but another desk may have
+            # loaned it since; checkout_copy() then picks another one
+            loaned_copy = checkout_copy(copy_id, borrower_id)
+            if loaned_copy is None:
+                db.invalidate_cache("available_books")
+                flash("The selected copy has just been borrowed and no other copy in that "
+                      "format is available.", "warning")
+                return redirect(url_for("loan"))
+            # The borrowed copy may have been the book's last one on the shelf,
+            # and the loan counts on the home page have changed
+            db.invalidate_cache("available_books")
+            db.bump_version("loans")
+            if str(loaned_copy) != copy_id:
+                flash(f"The selected copy has just been borrowed, so copy {loaned_copy} "
+                      "in the same format was loaned instead.", "info")
             flash("Book borrowed successfully!", "success")
-            cursor.close()
             return redirect(url_for("loan_by_borrower"))
         else:
             flash("Please select all required fields.", "warning")
 
-    cursor.close()
     return render_template("loan.html", 
                            borrowers=borrowers, 
                            books=books)
 
 
-@app.route("/loan_select_book", methods=["POST"])
-def loan_select_book():
+def batch_ids(name):
+    """Return the distinct ids sent to a batch endpoint, from a JSON body ({name: [...]})
+    or from repeated form fields (copy_ids=1&copy_ids=2 or copy_ids=1,2).
+    Returns None if any of them is not a whole number."""
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        values = body.get(name) or []
+        if not isinstance(values, list):
+            return None
+    else:
+        values = [value for field in request.form.getlist(name) for value in field.split(",")]
+    try:
+        ids = [int(value) for value in values if str(value).strip()]
+    except (TypeError, ValueError):
+        return None
+    return list(dict.fromkeys(ids))  # drop repeats, keep order
+
+
+def batch_value(name):
+    """Return a single value sent to a batch endpoint as JSON or a form field"""
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        return body.get(name)
+    return request.form.get(name)
+
+
+@app.route("/loan_batch", methods=["POST"])
+def loan_batch():
+    """Check out many copies to one borrower in a single transaction, e.g. at the
+    circulation desk. Takes borrower_id and copy_ids (see batch_ids()) and returns
+    a JSON summary of the copies borrowed and those that were not available."""
+    borrower_id = batch_value("borrower_id")
+    borrower_id = int(borrower_id) if str(borrower_id).isdigit() else None
+    copy_ids = batch_ids("copy_ids")
+    if borrower_id is None or not copy_ids:
+        return jsonify({"error": "borrower_id and copy_ids are required"}), 400
+    if len(copy_ids) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"at most {MAX_BATCH_SIZE} copies per request"}), 400
+
+    connection = db.get_db()
     cursor = db.get_cursor()
+    # READ COMMITTED so the recheck below sees loans committed while we waited for the locks
+    connection.start_transaction(isolation_level="READ COMMITTED")
+
+    # Roll back if any statement fails, so no copy stays locked and no half-made batch of
+    # loans is left for a later request on this connection to commit
+    try:
+        if db.run_query_one("borrower_by_id", (borrower_id,)) is None:
+            connection.rollback()
+            return jsonify({"error": "borrower not found"}), 404
+
+        # One availability check for the whole batch. FOR UPDATE locks the copies until
+        # commit, so a concurrent checkout of the same copy waits for this one to finish.
+        placeholders = ", ".join(["%s"] * len(copy_ids))
+        available_qstr = f"""
+        SELECT bc.bookcopyid, bc.bookid
+        FROM bookcopies bc
+        WHERE bc.bookcopyid IN ({placeholders})
+        AND NOT EXISTS (
+            SELECT 1
+            FROM loans l
+            WHERE l.bookcopyid = bc.bookcopyid
+            AND l.returned IS NULL
+        )
+        FOR UPDATE
+        """
+        cursor.execute(available_qstr, copy_ids)
+        book_by_copy = {row["bookcopyid"]: row["bookid"] for row in cursor.fetchall()}
+        if book_by_copy:
+            # A checkout that held one of the locks has committed by now; drop its copies
+            locked = list(book_by_copy)
+            open_loans_qstr = f"""
+            SELECT DISTINCT bookcopyid
+            FROM loans
+            WHERE bookcopyid IN ({", ".join(["%s"] * len(locked))})
+            AND returned IS NULL
+            """
+            cursor.execute(open_loans_qstr, locked)
+            for row in cursor.fetchall():
+                book_by_copy.pop(row["bookcopyid"], None)
+        borrowed = [copy_id for copy_id in copy_ids if copy_id in book_by_copy]
+
+        if borrowed:
+            loan_qstr = """
+            INSERT INTO loans (bookcopyid, borrowerid, loandate, returned)
+            VALUES (%s, %s, CURDATE(), NULL)
+            """
+            cursor.executemany(loan_qstr, [(copy_id, borrower_id) for copy_id in borrowed])
+            # Add the new loans to the per-book totals used by the home page (see loan())
+            loans_per_book = {}
+            for copy_id in borrowed:
+                book_id = book_by_copy[copy_id]
+                loans_per_book[book_id] = loans_per_book.get(book_id, 0) + 1
+            count_qstr = """
+            INSERT INTO bookloancounts (bookid, loancount)
+            VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE loancount = loancount + VALUES(loancount)
+            """
+            cursor.executemany(count_qstr, list(loans_per_book.items()))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
 
-    # Return all borrowers for the dropdown
+    if borrowed:
+        db.invalidate_cache("available_books")
+        db.bump_version("loans")
+    return jsonify({
+        "borrowerid": borrower_id,
+        "borrowed": borrowed,
+        "unavailable": [copy_id for copy_id in copy_ids if copy_id not in book_by_copy],
+    })
+
+
+@app.route("/loan_select_book", methods=["POST"])
+def loan_select_book():
+    # Return all borrowers for the dropdown (cached, see loan())
     borrowers_qstr = """
     SELECT borrowerid, firstname, familyname 
     FROM borrowers 
     ORDER BY familyname, firstname
     """
-    cursor.execute(borrowers_qstr)
-    borrowers = cursor.fetchall()
+    borrowers = db.cached_query("borrowers", borrowers_qstr, tables=("borrowers",))
 
-    # Return all books for the dropdown
-    # (Better to return only books with available copies, 
-    #  but query too complex for this course)
-    books_qstr = """
-    SELECT bookid, booktitle, author
-    FROM books 
-    ORDER BY booktitle;
-    """
-    cursor.execute(books_qstr)
-    books = cursor.fetchall()
+    # Return only books with at least one copy available for the dropdown
+    books = get_available_books()
 
     # Get form data
     borrower_id = request.form.get("borrower_id")
@@ -305,35 +982,16 @@ def loan_select_book():
 
     if book_id:
         # Get book details
-        book_qstr = """
-        SELECT bookid, booktitle, author, bookcategory, yearofpublication, description, image
-        FROM books 
-        WHERE bookid = %s
-        """
-        cursor.execute(book_qstr, (book_id,))
-        book_detail = cursor.fetchone()
+        book_detail = db.run_query_one("book_by_id", (book_id,))
 
         # Get available copies for the selected book
-        copies_qstr = """
-        SELECT bc.bookcopyid, bc.format
-        FROM bookcopies bc
-        WHERE bc.bookid = %s
-        AND bc.bookcopyid NOT IN (
-            SELECT l.bookcopyid 
-            FROM loans l 
-            WHERE l.returned IS NULL
-        )
-        ORDER BY bc.format
-        """
-        cursor.execute(copies_qstr, (book_id,))
-        available_copies = cursor.fetchall()
+        available_copies = get_available_copies(book_id)
 
         # If there are no available copies, flash a warning and reload loan page 
         # with only selected borrower (and no book selected)
         if len(available_copies) == 0:
             flash("No available copies for the selected book. Please select a different book.", 
                   "warning")
-            cursor.close()
             return render_template(
                 "loan.html",
                 borrowers=borrowers,
@@ -341,8 +999,6 @@ def loan_select_book():
                 selected_borrower=selected_borrower,
             )
 
-    cursor.close()
-
     return render_template(
         "loan.html",
         borrowers=borrowers,
@@ -363,61 +1019,85 @@ def loan_select_book():
 # 4. Borrower Management Routes
 # ========================================
 @app.route("/borrower_list", methods=["GET", "POST"])
+@db.replica_reads
 def borrower_list():
-    """Display all borrowers with search functionality"""
+    """Display one page of borrowers with search functionality"""
     cursor = db.get_cursor()
 
     where_conditions = []
     params = []
-    firstname_search = None
-    familyname_search = None
 
-    # Method is POST if search form submitted
-    if request.method == "POST":
-        # Handle borrower search
-        firstname_search = request.form.get("firstname", "").strip()
-        familyname_search = request.form.get("familyname", "").strip()
-
-        # Build dynamic query
-        if firstname_search:
-            where_conditions.append("firstname LIKE %s")
-            params.append(f"%{firstname_search}%")
-
-        if familyname_search:
-            where_conditions.append("familyname LIKE %s")
-            params.append(f"%{familyname_search}%")
-
-    # Build query - if no conditions, get all borrowers
-    if where_conditions:
-        # If there are search conditions, build the query with WHERE clause
-        borrowers_qstr = f"""
-        SELECT borrowerid, firstname, familyname, dateofbirth, address, suburb, city, postcode
-        FROM borrowers 
-        WHERE {' AND '.join(where_conditions)}
-        ORDER BY familyname, firstname
-        """
-        # {' AND '.join(where_conditions)} above places 'AND' between multiple conditions as an f-string
-        cursor.execute(borrowers_qstr, params)
-    else:
-        # No search criteria - show all borrowers
-        borrowers_qstr = """
-        SELECT borrowerid, firstname, familyname, dateofbirth, address, suburb, city, postcode
-        FROM borrowers 
-        ORDER BY familyname, firstname
-        """
-        cursor.execute(borrowers_qstr)
+    # Search terms come from the search form (POST) or from the page links (GET)
+    firstname_search = request.values.get("firstname", "").strip()
+    familyname_search = request.values.get("familyname", "").strip()
 
-    borrowers_list = cursor.fetchall()
+    # Build dynamic query (see name_search_condition() for how names are matched)
+    if firstname_search:
+        condition, param = name_search_condition("firstname", firstname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    if familyname_search:
+        condition, param = name_search_condition("familyname", familyname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    # fetch_page() adds the WHERE clause (if there are search conditions), sorting and paging
+    borrowers_qstr = """
+    SELECT borrowerid, firstname, familyname, dateofbirth, address, suburb, city, postcode
+    FROM borrowers
+    """
+    order_by = [
+        ("familyname", "familyname", False),
+        ("firstname", "firstname", False),
+        ("borrowerid", "borrowerid", False),
+    ]
+    # Keep the search terms in the next/previous page links
+    link_args = {"firstname": firstname_search, "familyname": familyname_search}
+    link_args = {name: value for name, value in link_args.items() if value}
+    borrowers_list, pagination = fetch_page(
+        cursor, borrowers_qstr, where_conditions, params, order_by, link_args)
     cursor.close()
 
     return render_template(
         "borrower_list.html",
         borrowers=borrowers_list,
+        pagination=pagination,
         firstname_search=firstname_search,
         familyname_search=familyname_search,
     )
 
 
+@app.route("/borrower_search", methods=["GET"])
+def borrower_search():
+    """Search-as-you-type: return the borrowers best matching ?q=... as JSON, most relevant first"""
+    search_query = name_search_query(request.args.get("q", ""))
+    if search_query is None:
+        return jsonify({"borrowers": []})
+
+    cursor = db.get_cursor()
+    search_qstr = """
+    SELECT borrowerid, firstname, familyname,
+           MATCH(firstname, familyname) AGAINST (%s IN BOOLEAN MODE) AS score
+    FROM borrowers
+    WHERE MATCH(firstname, familyname) AGAINST (%s IN BOOLEAN MODE)
+    ORDER BY score DESC, familyname, firstname
+    LIMIT %s
+    """
+    cursor.execute(search_qstr, (search_query, search_query, SEARCH_SUGGESTIONS))
+    borrowers = cursor.fetchall()
+    cursor.close()
+
+    return jsonify({"borrowers": borrowers})
+
+
+db.register_query("borrower_by_id", """
+    SELECT borrowerid, firstname, familyname, dateofbirth, address, suburb, city, postcode
+    FROM borrowers
+    WHERE borrowerid = %s
+    """)
+
+
 @app.route("/borrower_manage", methods=["GET"])
 def borrower_manage():
     """Display form to create new borrower or edit existing borrower."""
@@ -429,16 +1109,7 @@ def borrower_manage():
         return render_template("borrower_manage.html", borrower=None, is_edit=False)
     else:
         # Display edit borrower form with pre-filled data
-        cursor = db.get_cursor()
-
-        borrower_qstr = """
-        SELECT borrowerid, firstname, familyname, dateofbirth, address, suburb, city, postcode
-        FROM borrowers 
-        WHERE borrowerid = %s
-        """
-        cursor.execute(borrower_qstr, (borrower_id,))
-        borrower = cursor.fetchone()
-        cursor.close()
+        borrower = db.run_query_one("borrower_by_id", (borrower_id,))
 
         if not borrower:
             # Flash displays a popup message on the next page loaded. This is set-up in base.html.
@@ -519,6 +1190,9 @@ def borrower_save():
         flash("Borrower created successfully!", "success")
 
     cursor.close()
+    # Names may have changed, so drop the cached borrowers dropdown list
+    db.invalidate_cache("borrowers")
+    db.bump_version("borrowers")
     return redirect(url_for("borrower_list"))
 
 
@@ -530,12 +1204,11 @@ def borrower_save():
 # ========================================
 # 5. Loans by Borrower Routes
 # ========================================
-@app.route("/loan_by_borrower")
-def loan_by_borrower():
-    """Display all loans grouped by borrower"""
-    cursor = db.get_cursor()
-
-    loans_qstr = """
+def loans_by_borrower_qstr(loans_table):
+    """Loans (read from `loans_table`) joined with their borrower, copy and book details.
+    Shared by the paged and the streamed loans-by-borrower pages (which add their own
+    WHERE/ORDER BY clauses)."""
+    return f"""
     SELECT 
         l.loanid,
         l.loandate,
@@ -553,70 +1226,226 @@ def loan_by_borrower():
             WHEN l.returned IS NULL THEN 'On Loan'
             ELSE 'Returned'
         END as loan_status,
-        DATEDIFF(CURDATE(), l.loandate) AS days_borrowed
-    FROM loans l
+        DATEDIFF(CURDATE(), l.loandate) AS days_borrowed,
+        {overdue_condition("l")} AS is_overdue
+    FROM {loans_table} l
     JOIN borrowers br ON l.borrowerid = br.borrowerid
     JOIN bookcopies bc ON l.bookcopyid = bc.bookcopyid
     JOIN books b ON bc.bookid = b.bookid
-    ORDER BY br.familyname, br.firstname, l.loandate DESC
     """
 
-    cursor.execute(loans_qstr)
-    all_loans = cursor.fetchall()
-    cursor.close()
 
-    # Group loans by borrower
-    loans_by_borrower = {}
-    for loan in all_loans:
-        borrower_key = f"{loan['borrowerid']}"
-        if borrower_key not in loans_by_borrower:
-            loans_by_borrower[borrower_key] = {
-                "borrower": {
+# Returned loans are moved out of the loans table as they age (see archive-loans), so the
+# pages only read recent history unless asked to include the archive, which
+# db.ALL_LOANS_QSTR reads together with the loans table
+LOANS_BY_BORROWER_QSTR = loans_by_borrower_qstr("loans")
+LOANS_WITH_ARCHIVE_BY_BORROWER_QSTR = loans_by_borrower_qstr(db.ALL_LOANS_QSTR)
+
+# Sort order of the full loan history (streamed and exported in one query) as
+# (column, row key, descending) tuples. Rows arrive grouped by borrower; borrowerid keeps
+# borrowers with the same name apart, loanid breaks ties on loandate.
+LOANS_BY_BORROWER_ORDER = [
+    ("br.familyname", "familyname", False),
+    ("br.firstname", "firstname", False),
+    ("br.borrowerid", "borrowerid", False),
+    ("l.loandate", "loandate", True),
+    ("l.loanid", "loanid", True),
+]
+
+# The paged loans-by-borrower page seeks on keys from one table at a time, so neither of
+# its queries sorts more rows than it returns: a page of borrowers is read in the order
+# of borrowername_idx (familyname, firstname, then the primary key), then their loans are
+# read backwards through borrowerloans_idx (borrowerid, loandate, then the primary key)
+LOAN_BORROWERS_QSTR = "SELECT borrowerid, firstname, familyname FROM borrowers"
+LOAN_BORROWERS_ORDER = [
+    ("familyname", "familyname", False),
+    ("firstname", "firstname", False),
+    ("borrowerid", "borrowerid", False),
+]
+
+
+def loans_tables(archived):
+    """The tables the loans pages read: loans, and loans_archive if `archived`. The
+    paged page reads each one on its own so their indexes give the sort order."""
+    return ("loans", "loans_archive") if archived else ("loans",)
+
+
+def has_loans_condition(tables):
+    """WHERE condition on borrowers keeping only those with a loan in one of `tables`"""
+    exists = [f"EXISTS (SELECT 1 FROM {table} l WHERE l.borrowerid = borrowers.borrowerid)"
+              for table in tables]
+    return f"({' OR '.join(exists)})"
+
+
+def borrower_loans_qstr(loans_table, count):
+    """Loans (read from `loans_table`) of `count` borrowers, whose ids are the parameters,
+    newest first for each borrower"""
+    placeholders = ", ".join(["%s"] * count)
+    return (f"{loans_by_borrower_qstr(loans_table)} WHERE l.borrowerid IN ({placeholders}) "
+            "ORDER BY l.borrowerid DESC, l.loandate DESC, l.loanid DESC")
+
+
+def group_page_loans(borrowers, loans):
+    """Group the loans read for one page of borrowers by borrower, in the order of the
+    page and newest loan first (the loans and loans_archive rows arrive separately)"""
+    groups = {borrower["borrowerid"]: {"borrower": borrower, "loans": []}
+              for borrower in borrowers}
+    for loan in loans:
+        groups[loan["borrowerid"]]["loans"].append(loan)
+    for group in groups.values():
+        group["loans"].sort(key=lambda loan: (loan["loandate"], loan["loanid"]), reverse=True)
+    return list(groups.values())
+
+
+def group_loans_by_borrower(loans):
+    """Yield one {"borrower": ..., "loans": [...]} group at a time from loan rows that are
+    already sorted by borrower, so only the current borrower's loans are held in memory"""
+    for _borrower_id, borrower_loans in itertools.groupby(loans, key=lambda loan: loan["borrowerid"]):
+        group = {"borrower": None, "loans": []}
+        for loan in borrower_loans:
+            if group["borrower"] is None:
+                group["borrower"] = {
                     "borrowerid": loan["borrowerid"],
                     "firstname": loan["firstname"],
                     "familyname": loan["familyname"],
-                },
-                "loans": [],
-            }
-        
-        # Add overdue flag for on loan records >= 36 days
-        loan_dict = dict(loan)
-        if loan['loan_status'] == 'On Loan' and loan['days_borrowed'] >= 36:
-            loan_dict['is_overdue'] = True
-        else:
-            loan_dict['is_overdue'] = False
-        
-        loans_by_borrower[borrower_key]["loans"].append(loan_dict)
+                }
+
+            group["loans"].append(loan)
+        yield group
+
+
+def include_archive():
+    """Return True if the loans pages should also show archived loans (?archived=1)"""
+    return request.args.get("archived") == "1"
+
+
+@app.route("/loan_by_borrower")
+@db.replica_reads
+def loan_by_borrower():
+    """Display the loans of one page of borrowers (with archived loans if ?archived=1)"""
+    archived = include_archive()
+    tables = loans_tables(archived)
+    link_args = {"archived": 1} if archived else None
+    cursor = db.get_cursor()
+    borrowers, pagination = fetch_page(
+        cursor, LOAN_BORROWERS_QSTR, [has_loans_condition(tables)], [], LOAN_BORROWERS_ORDER,
+        link_args)
+    borrower_ids = [borrower["borrowerid"] for borrower in borrowers]
+    loans = []
+    if borrower_ids:
+        for table in tables:
+            cursor.execute(borrower_loans_qstr(table, len(borrower_ids)), borrower_ids)
+            loans.extend(cursor.fetchall())
+    cursor.close()
+
+    # Group loans by borrower
+    borrower_groups = group_page_loans(borrowers, loans)
+
+    return render_template("loan_by_borrower.html", 
+                           borrower_groups=borrower_groups, 
+                           pagination=pagination,
+                           archived=archived)
+
+
+@app.route("/loan_by_borrower_all")
+@db.replica_reads
+def loan_by_borrower_all():
+    """Display the full loan history grouped by borrower, streaming the page to the browser
+    as rows arrive from the database instead of loading every loan first"""
+    archived = include_archive()
+    loans_qstr = LOANS_WITH_ARCHIVE_BY_BORROWER_QSTR if archived else LOANS_BY_BORROWER_QSTR
+    order_qstr = order_by_qstr(LOANS_BY_BORROWER_ORDER)
+    loans = db.stream_rows(f"{loans_qstr} ORDER BY {order_qstr}")
+
+    # stream_template() renders the page in chunks with Jinja's generate(), keeping the
+    # request context (and database connection) open until the last chunk is sent
+    return stream_template("loan_by_borrower.html", 
+                           borrower_groups=group_loans_by_borrower(loans), 
+                           pagination=None, 
+                           streaming=True,
+                           archived=archived)
 
-    return render_template("loan_by_borrower.html", loans_by_borrower=loans_by_borrower)
+
+db.register_query("return_loan", """
+    UPDATE loans
+    SET returned = CURDATE()
+    WHERE loanid = %s AND returned IS NULL
+    """)
 
 
 @app.route("/return_book", methods=["GET"])
 def return_book():
     """Handle book return"""
 
-    cursor = db.get_cursor()
     loan_id = request.args.get("loan_id")
 
     # Update loan record with return date to indicate book returned
-    return_qstr = """
-        UPDATE loans 
-        SET returned = CURDATE() 
-        WHERE loanid = %s AND returned IS NULL
-        """
-    return_qargs = (loan_id,)
-    cursor.execute(return_qstr, return_qargs)
+    cursor = db.run_statement("return_loan", (loan_id,))
 
     if cursor.rowcount > 0:
+        # The returned copy may make its book available again
+        db.invalidate_cache("available_books")
+        db.bump_version("loans")
         # Flash displays a popup message on the next page loaded. This is set-up in base.html.
         flash("Book returned successfully!", "success")
     else:
         flash("Error: Book was already returned or loan not found.", "warning")
 
-    cursor.close()
     return redirect(url_for("loan_by_borrower"))
 
 
+@app.route("/return_batch", methods=["POST"])
+def return_batch():
+    """Return many loans in a single transaction. Takes loan_ids (see batch_ids())
+    and returns a JSON summary instead of reloading the loans page."""
+    loan_ids = batch_ids("loan_ids")
+    if not loan_ids:
+        return jsonify({"error": "loan_ids are required"}), 400
+    if len(loan_ids) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"at most {MAX_BATCH_SIZE} loans per request"}), 400
+
+    connection = db.get_db()
+    cursor = db.get_cursor()
+    connection.start_transaction()
+
+    # Roll back if any statement fails (see loan_batch())
+    try:
+        # Find (and lock) the loans that are still open, then close them all in one UPDATE
+        placeholders = ", ".join(["%s"] * len(loan_ids))
+        open_qstr = f"""
+        SELECT loanid
+        FROM loans
+        WHERE loanid IN ({placeholders}) AND returned IS NULL
+        FOR UPDATE
+        """
+        cursor.execute(open_qstr, loan_ids)
+        open_ids = {row["loanid"] for row in cursor.fetchall()}
+        returned = [loan_id for loan_id in loan_ids if loan_id in open_ids]
+
+        if returned:
+            return_qstr = f"""
+            UPDATE loans
+            SET returned = CURDATE()
+            WHERE loanid IN ({", ".join(["%s"] * len(returned))})
+            """
+            cursor.execute(return_qstr, returned)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    if returned:
+        # The returned copies may make their books available again
+        db.invalidate_cache("available_books")
+        db.bump_version("loans")
+    return jsonify({
+        "returned": returned,
+        "not_returned": [loan_id for loan_id in loan_ids if loan_id not in open_ids],
+    })
+
+
 # ========================================
 # End of Loans by Borrower Routes
 # ========================================
@@ -625,34 +1454,9 @@ def return_book():
 # ========================================
 # 6. Current Loans Routes
 # ========================================
-@app.route("/loan_current", methods=["GET", "POST"])
-def loan_current():
-    """Display all current loans (not returned) with search functionality"""
-    
-    cursor = db.get_cursor()
-
-    firstname_search = ""
-    lastname_search = ""
-
-    # Handle search parameters
-    if request.method == "POST":
-        firstname_search = request.form.get("firstname", "").strip()
-        lastname_search = request.form.get("lastname", "").strip()
-
-    # Build dynamic query for current loans (not returned)
-    where_conditions = ["loans.returned IS NULL"]  # Only current loans
-    params = []
-
-    if firstname_search:
-        where_conditions.append("borrowers.firstname LIKE %s")
-        params.append(f"%{firstname_search}%")
-
-    if lastname_search:
-        where_conditions.append("borrowers.familyname LIKE %s")
-        params.append(f"%{lastname_search}%")
-
-    # SQL query to get current loans with all required fields
-    current_loans_qstr = f"""
+# Current loans (not returned) with all the fields shown on the page; loan_current()
+# adds its search conditions, and fetch_page() the WHERE clause, sorting and paging
+CURRENT_LOANS_QSTR = f"""
     SELECT 
         loans.loanid,
         loans.loandate,
@@ -666,29 +1470,452 @@ def loan_current():
         bookcopies.format,
         DATEDIFF(CURDATE(), loans.loandate) AS days_borrowed,
         CASE 
-            WHEN DATEDIFF(CURDATE(), loans.loandate) >= 36 THEN 'Overdue'
+            WHEN {overdue_condition("loans")} THEN 'Overdue'
             ELSE 'On Loan'
         END AS loan_status
     FROM loans
     JOIN bookcopies ON loans.bookcopyid = bookcopies.bookcopyid
     JOIN books ON bookcopies.bookid = books.bookid
     JOIN borrowers ON loans.borrowerid = borrowers.borrowerid
-    WHERE {' AND '.join(where_conditions)}
-    ORDER BY borrowers.familyname, borrowers.firstname, loans.loandate
     """
 
-    cursor.execute(current_loans_qstr, params)
-    loans = cursor.fetchall()
+# Sort order as (column, row key, descending) tuples: oldest loans first. The keys all
+# come from loans, in the order of openloans_idx (returned, loandate, then the primary
+# key), so a page reads its rows straight from the index instead of sorting the join.
+CURRENT_LOANS_ORDER = [
+    ("loans.loandate", "loandate", False),
+    ("loans.loanid", "loanid", False),
+]
+
+
+@app.route("/loan_current", methods=["GET", "POST"])
+@db.replica_reads
+def loan_current():
+    """Display one page of current loans (not returned) with search functionality"""
+    
+    cursor = db.get_cursor()
+
+    # Search terms come from the search form (POST) or from the page links (GET)
+    firstname_search = request.values.get("firstname", "").strip()
+    lastname_search = request.values.get("lastname", "").strip()
+
+    # Build dynamic query for current loans (not returned)
+    where_conditions = ["loans.returned IS NULL"]  # Only current loans
+    params = []
+
+    if firstname_search:
+        condition, param = name_search_condition("borrowers.firstname", firstname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    if lastname_search:
+        condition, param = name_search_condition("borrowers.familyname", lastname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    # Keep the search terms in the next/previous page links
+    link_args = {"firstname": firstname_search, "lastname": lastname_search}
+    link_args = {name: value for name, value in link_args.items() if value}
+    loans, pagination = fetch_page(
+        cursor, CURRENT_LOANS_QSTR, where_conditions, params, CURRENT_LOANS_ORDER, link_args)
     cursor.close()
 
     return render_template(
         "loan_current.html",
         loans=loans,
+        pagination=pagination,
         firstname_search=firstname_search,
         lastname_search=lastname_search,
     )
 
 
+# Oldest loans first, like the current loans page
+OVERDUE_LOANS_ORDER = CURRENT_LOANS_ORDER
+
+
+@app.route("/loan_overdue")
+@db.replica_reads
+def loan_overdue():
+    """Display one page of overdue loans, oldest first"""
+    cursor = db.get_cursor()
+    loans, pagination = fetch_page(
+        cursor, CURRENT_LOANS_QSTR, [overdue_condition("loans")], [], OVERDUE_LOANS_ORDER)
+    cursor.close()
+
+    return render_template(
+        "loan_overdue.html",
+        loans=loans,
+        pagination=pagination,
+        overdue_days=OVERDUE_DAYS,
+    )
+
+
+@app.route("/loan_overdue_count")
+@db.replica_reads
+def loan_overdue_count():
+    """Return the number of overdue loans as JSON"""
+    cursor = db.get_cursor()
+    cursor.execute(f"SELECT COUNT(*) AS overdue FROM loans WHERE {overdue_condition('loans')}")
+    overdue = cursor.fetchone()["overdue"]
+    cursor.close()
+
+    return jsonify({"overdue": overdue, "overdue_days": OVERDUE_DAYS})
+
+
 # ========================================
 # End of Current Loans Routes
 # ========================================
+
+
+# ========================================
+# 7. Export Routes
+# ========================================
+BORROWERS_EXPORT_QSTR = """
+    SELECT borrowerid, firstname, familyname, dateofbirth, address, suburb, city, postcode
+    FROM borrowers
+    ORDER BY borrowerid
+    """
+
+# Data sets that can be exported, as the full query for each (same joins as the pages)
+EXPORT_QUERIES = {
+    "loans": f"{LOANS_BY_BORROWER_QSTR} ORDER BY {order_by_qstr(LOANS_BY_BORROWER_ORDER)}",
+    "loan_history": f"{LOANS_WITH_ARCHIVE_BY_BORROWER_QSTR} "
+                    f"ORDER BY {order_by_qstr(LOANS_BY_BORROWER_ORDER)}",
+    "current_loans": f"{CURRENT_LOANS_QSTR} WHERE loans.returned IS NULL "
+                     f"ORDER BY {order_by_qstr(CURRENT_LOANS_ORDER)}",
+    "borrowers": BORROWERS_EXPORT_QSTR,
+}
+
+
+def export_chunks(dataset, output_format, compress):
+    """Stream every row of an export data set, encoded by export.py. The rows are read
+    from the server in batches (db.stream_rows()), so memory use stays constant."""
+    rows = db.stream_rows(EXPORT_QUERIES[dataset])
+    return export.export_rows(rows, output_format, compress)
+
+
+@app.route("/export/<dataset>")
+@db.replica_reads
+def export_data(dataset):
+    """Download a whole data set for reporting (?format=csv|ndjson, ?gzip=1), written
+    to the response as the rows arrive instead of rendering an HTML page"""
+    output_format = request.args.get("format", "csv")
+    compress = request.args.get("gzip", "0") not in ("", "0", "false")
+    if dataset not in EXPORT_QUERIES or output_format not in export.FORMATS:
+        return jsonify({
+            "error": "unknown data set or format",
+            "datasets": sorted(EXPORT_QUERIES),
+            "formats": sorted(export.FORMATS),
+        }), 404
+
+    extension, content_type = export.FORMATS[output_format]
+    filename = f"{dataset}.{extension}"
+    if compress:
+        filename += ".gz"
+        content_type = "application/gzip"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    # stream_with_context keeps the request (and its database connection) open until
+    # the last chunk has been sent
+    chunks = stream_with_context(export_chunks(dataset, output_format, compress))
+    return Response(chunks, content_type=content_type, headers=headers)
+
+
+# ========================================
+# End of Export Routes
+# ========================================
+
+
+# ========================================
+# 8. JSON API Routes
+# ========================================
+API_PREFIX = "/api/v1"
+
+# Lists served by the JSON API: the tables to select from, the fields a client may ask
+# for (name -> SQL expression), fixed WHERE conditions, and the fields to sort by (the
+# last one must be unique). Rows are sent as arrays in the order of the fields.
+API_RESOURCES = {
+    "books": {
+        "from": "FROM books",
+        "fields": {
+            "bookid": "bookid",
+            "booktitle": "booktitle",
+            "author": "author",
+            "bookcategory": "bookcategory",
+            "yearofpublication": "yearofpublication",
+        },
+        "where": [],
+        "order": ["booktitle", "bookid"],
+    },
+    "borrowers": {
+        "from": "FROM borrowers",
+        "fields": {
+            "borrowerid": "borrowerid",
+            "firstname": "firstname",
+            "familyname": "familyname",
+            "dateofbirth": "dateofbirth",
+            "address": "address",
+            "suburb": "suburb",
+            "city": "city",
+            "postcode": "postcode",
+        },
+        "where": [],
+        "order": ["familyname", "firstname", "borrowerid"],
+    },
+    "current_loans": {
+        "from": """
+            FROM loans
+            JOIN bookcopies ON loans.bookcopyid = bookcopies.bookcopyid
+            JOIN books ON bookcopies.bookid = books.bookid
+            JOIN borrowers ON loans.borrowerid = borrowers.borrowerid
+            """,
+        "fields": {
+            "loanid": "loans.loanid",
+            "loandate": "loans.loandate",
+            "borrowerid": "borrowers.borrowerid",
+            "firstname": "borrowers.firstname",
+            "familyname": "borrowers.familyname",
+            "bookid": "books.bookid",
+            "booktitle": "books.booktitle",
+            "bookcopyid": "bookcopies.bookcopyid",
+            "format": "bookcopies.format",
+            "days_borrowed": "DATEDIFF(CURDATE(), loans.loandate)",
+            "is_overdue": overdue_condition("loans"),
+        },
+        "where": ["loans.returned IS NULL"],
+        "order": ["loandate", "loanid"],
+    },
+}
+
+
+def api_value(value):
+    """Convert a column value for JSON (dates as ISO strings rather than HTTP dates)"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def api_rows(fields, rows):
+    """Compact JSON body for rows: the field names once, then each row as an array"""
+    return {"fields": fields, "rows": [[api_value(value) for value in row] for row in rows]}
+
+
+@app.route(f"{API_PREFIX}/<resource>")
+@db.replica_reads
+def api_list(resource):
+    """Return one page of books, borrowers or current loans as JSON. ?fields=a,b picks
+    the fields (default all); ?per_page=, ?after= and ?before= page as on the HTML pages."""
+    spec = API_RESOURCES.get(resource)
+    if spec is None:
+        return jsonify({"error": "unknown resource", "resources": sorted(API_RESOURCES)}), 404
+    fields_arg = request.args.get("fields")
+    fields = fields_arg.split(",") if fields_arg else list(spec["fields"])
+    unknown = [name for name in fields if name not in spec["fields"]]
+    if unknown or len(set(fields)) != len(fields):
+        return jsonify({"error": "unknown or repeated fields", "fields": list(spec["fields"])}), 400
+
+    # The sort fields are also selected (after the requested ones) to make the page tokens
+    selected = fields + [name for name in spec["order"] if name not in fields]
+    select_qstr = "SELECT {} {}".format(
+        ", ".join(f"{spec['fields'][name]} AS {name}" for name in selected), spec["from"])
+    # Rows are tuples here, so the sort keys are looked up by position
+    order_by = [(spec["fields"][name], selected.index(name), False) for name in spec["order"]]
+    page_qstr, qargs, page = build_page_query(request.args, select_qstr, spec["where"], [], order_by)
+    cursor = db.get_cursor(dictionary=False)
+    cursor.execute(page_qstr, qargs)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    def page_url(**args):
+        return url_for("api_list", resource=resource, fields=fields_arg, **args)
+
+    rows, pagination = finish_page(rows, page, page_url)
+    body = api_rows(fields, (row[:len(fields)] for row in rows))
+    body.update(next=pagination["next_url"], prev=pagination["prev_url"])
+    return jsonify(body)
+
+
+@app.route(f"{API_PREFIX}/books/<int:book_id>")
+@db.replica_reads
+def api_book(book_id):
+    """Return one book, including its description and cover image, as JSON"""
+    book = db.run_query_one("book_by_id", (book_id,))
+    if book is None:
+        return jsonify({"error": "book not found"}), 404
+    return jsonify({"fields": list(book), "row": [api_value(value) for value in book.values()]})
+
+
+@app.route(f"{API_PREFIX}/books/<int:book_id>/copies")
+def api_book_copies(book_id):
+    """Return the available copies of a book as JSON (used by the borrow form)"""
+    copies = get_available_copies(book_id)
+    return jsonify(api_rows(["bookcopyid", "format"],
+                            ((copy["bookcopyid"], copy["format"]) for copy in copies)))
+
+
+# ========================================
+# End of JSON API Routes
+# ========================================
+
+
+# ========================================
+# 9. Health and Metrics Routes
+# ========================================
+@app.route("/ready")
+def ready():
+    """Readiness probe for the load balancer: 200 if a database connection can be taken
+    from the pool (within a second) and answers a ping, otherwise 503"""
+    try:
+        connection = db.checkout_connection(timeout=1.0)
+    except MySQLError as error:
+        return jsonify({"status": "unavailable", "error": str(error)}), 503
+    try:
+        connection.ping()
+    except MySQLError as error:
+        return jsonify({"status": "unavailable", "error": str(error)}), 503
+    finally:
+        db.release_connection(connection)
+
+    stats = db.pool_stats()
+    return jsonify({"status": "ready", "pool_size": stats["pool_size"], "in_use": stats["in_use"]})
+
+
+@app.route("/metrics")
+def metrics_text():
+    """Request, latency, pool and prepared statement metrics in Prometheus text format"""
+    return Response(metrics.render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ========================================
+# End of Health and Metrics Routes
+# ========================================
+
+
+# ========================================
+# 10. Maintenance Commands
+# ========================================
+@app.cli.command("rebuild-loan-counts")
+def rebuild_loan_counts():
+    """Recalculate the per-book loan totals used by the home page from the loans (and
+    archived loans) tables.
+    Run with:  flask --app app rebuild-loan-counts"""
+    connection = db.get_db()
+    cursor = db.get_cursor()
+
+    # Replace all totals in one transaction so the home page never sees a half-built table
+    connection.start_transaction()
+    cursor.execute("DELETE FROM bookloancounts")
+    cursor.execute(db.REBUILD_LOAN_COUNTS_QSTR)
+    rebuilt = cursor.rowcount
+    connection.commit()
+    cursor.close()
+    # The home page lists the most borrowed books from these totals
+    db.bump_version("loans")
+
+    click.echo(f"Rebuilt loan counts for {rebuilt} book(s).")
+
+
+@app.cli.command("archive-loans")
+@click.option("--older-than", "older_than", type=int, default=None,
+              help=f"Archive loans returned more than this many days ago "
+                   f"(default: {ARCHIVE_AFTER_DAYS}).")
+@click.option("--batch-size", type=int, default=1000, show_default=True,
+              help="Loans moved per transaction.")
+def archive_loans(older_than, batch_size):
+    """Move returned loans older than the archive age from loans to loans_archive.
+    Each batch is moved in its own transaction, so the command can be stopped at any
+    time and run again to carry on. Run with:  flask --app app archive-loans"""
+    older_than = ARCHIVE_AFTER_DAYS if older_than is None else older_than
+    connection = db.get_db()
+    cursor = db.get_cursor()
+
+    # The oldest returned loans first; openloans_idx (returned, loandate) finds them
+    select_qstr = """
+    SELECT loanid
+    FROM loans
+    WHERE returned < CURDATE() - INTERVAL %s DAY
+    ORDER BY returned, loanid
+    LIMIT %s
+    FOR UPDATE
+    """
+    moved = 0
+    while True:
+        connection.start_transaction()
+        cursor.execute(select_qstr, (older_than, batch_size))
+        loan_ids = [row["loanid"] for row in cursor.fetchall()]
+        if not loan_ids:
+            connection.rollback()
+            break
+        placeholders = ", ".join(["%s"] * len(loan_ids))
+        cursor.execute(f"""
+            INSERT INTO loans_archive (loanid, bookcopyid, borrowerid, loandate, returned)
+            SELECT loanid, bookcopyid, borrowerid, loandate, returned
+            FROM loans
+            WHERE loanid IN ({placeholders})
+            """, loan_ids)
+        cursor.execute(f"DELETE FROM loans WHERE loanid IN ({placeholders})", loan_ids)
+        connection.commit()
+        moved += len(loan_ids)
+        click.echo(f"Archived {moved} loan(s)...")
+    cursor.close()
+    if moved:
+        db.bump_version("loans")
+
+    click.echo(f"Archived {moved} loan(s) returned more than {older_than} days ago.")
+
+
+@app.cli.command("export")
+@click.argument("dataset", type=click.Choice(sorted(EXPORT_QUERIES)))
+@click.option("--format", "output_format", type=click.Choice(sorted(export.FORMATS)),
+              default="csv", show_default=True)
+@click.option("--gzip", "compress", is_flag=True, help="Gzip compress the output.")
+@click.option("--output", "-o", type=click.Path(dir_okay=False),
+              help="File to write (default: standard output).")
+def export_command(dataset, output_format, compress, output):
+    """Write a whole data set as CSV or NDJSON, in constant memory.
+    Run with:  flask --app app export loans --format ndjson --gzip -o loans.ndjson.gz"""
+    with click.open_file(output or "-", "wb") as file:
+        for chunk in export_chunks(dataset, output_format, compress):
+            file.write(chunk)
+
+
+@app.cli.command("build-covers")
+def build_covers():
+    """Make the thumbnails of every cover in static/book-covers/ ahead of time.
+    Run with:  flask --app app build-covers"""
+    built = 0
+    for filename in sorted(os.listdir(covers.COVERS_DIR)):
+        info = covers.cover_info(filename)
+        if info is not None:
+            built += 1
+            click.echo(f"{filename}: {len(info['jpeg'])} JPEG, {len(info['webp'])} WebP thumbnail(s)")
+    click.echo(f"Processed {built} cover(s).")
+
+
+@app.cli.command("migrate")
+@click.option("--status", is_flag=True, help="List the migrations without applying any.")
+def migrate(status):
+    """Apply the schema migrations in migrations/ that this database doesn't have yet.
+    Run with:  flask --app app migrate"""
+    cursor = db.get_cursor()
+    pending = migrations.pending_migrations(cursor)
+    if status:
+        pending_versions = {version for version, _name, _path in pending}
+        for version, name, _path in migrations.available_migrations():
+            state = "pending" if version in pending_versions else "applied"
+            click.echo(f"{version:04d} {name:<32} {state}")
+    else:
+        for version, name, path in pending:
+            skipped = migrations.apply_migration(cursor, version, name, path)
+            note = f" ({skipped} statement(s) already applied)" if skipped else ""
+            click.echo(f"Applied {version:04d} {name}{note}")
+        click.echo(f"Applied {len(pending)} migration(s).")
+    cursor.close()
+    # A schema change may change what any page shows
+    if pending and not status:
+        db.bump_version(*db.VERSIONED_TABLES)
+
+
+# ========================================
+# End of Maintenance Commands
+# ========================================
@@ -0,0 +1,561 @@
+"""Async (ASGI) version of the library web app.
+
+The busiest read pages and the borrow form are served by async Quart routes
+that use the non-blocking connection pool in db_async.py, so a worker is not
+tied up while it waits for MySQL and one process can serve many more users.
+Every other request (the add/edit forms, saves, returns, ...) is passed on to
+the normal Flask app in app.py, so both versions always behave the same.
+
+Run with an ASGI server, e.g.:  hypercorn async_app:application
+"""
+import asyncio
+import functools
+
+from quart import Quart
+from quart import render_template
+from quart import stream_template
+from quart import request
+from quart import redirect
+from quart import url_for
+from quart import flash
+from quart import jsonify
+from quart import make_response
+from quart import session
+from markupsafe import Markup
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+import db
+import fragments
+import db_async
+import connect
+import app as sync_app
+from app import (
+    AVAILABLE_BOOKS_QSTR,
+    AVAILABLE_COPIES_QSTR,
+    CHECKOUT_ATTEMPTS,
+    COPY_FORMAT_QSTR,
+    CURRENT_LOANS_ORDER,
+    CURRENT_LOANS_QSTR,
+    LOANS_BY_BORROWER_ORDER,
+    LOANS_BY_BORROWER_QSTR,
+    LOANS_WITH_ARCHIVE_BY_BORROWER_QSTR,
+    LOAN_BORROWERS_ORDER,
+    LOAN_BORROWERS_QSTR,
+    OPEN_LOAN_FOR_COPY_QSTR,
+    RESERVE_COPY_QSTR,
+    RESERVE_OTHER_COPY_QSTR,
+    SEARCH_SUGGESTIONS,
+    borrower_loans_qstr,
+    build_page_query,
+    cover_sources,
+    finish_conditional_get,
+    finish_page,
+    group_page_loans,
+    has_loans_condition,
+    is_not_modified,
+    loans_tables,
+    name_search_condition,
+    name_search_query,
+    order_by_qstr,
+    set_validators,
+)
+
+app = Quart(__name__)
+app.secret_key = sync_app.app.secret_key  # Same key, so flash messages work across both apps
+# Share the Flask app's compiled template cache (see app.TEMPLATE_CACHE_DIR)
+app.jinja_env.bytecode_cache = sync_app.app.jinja_env.bytecode_cache
+
+# Initialize database connection
+# (with the Flask app's pool settings from connect.py, see app.py)
+db_async.init_db(
+    app, connect.dbuser, connect.dbpass, connect.dbhost, connect.dbname, connect.dbport,
+    pool_size=getattr(connect, "dbpoolsize", 5),
+    recycle_after=getattr(connect, "dbpoolrecycle", 3600),
+)
+
+
+def build_sync_url(error, endpoint, values):
+    """Templates link to pages that only exist in the Flask app (e.g. book_edit),
+    so build those URLs from the Flask app's routes instead"""
+    return sync_app.app.url_map.bind("").build(endpoint, values)
+
+
+app.url_build_error_handlers.append(build_sync_url)
+
+
+async def fetch_page(cursor, select_qstr, where_conditions, params, order_by, link_args=None):
+    """Async version of app.fetch_page()"""
+    page_qstr, qargs, page = build_page_query(
+        request.args, select_qstr, where_conditions, params, order_by)
+    await cursor.execute(page_qstr, qargs)
+    rows = list(await cursor.fetchall())
+
+    def page_url(**args):
+        return url_for(request.endpoint, **(link_args or {}), **args)
+
+    return finish_page(rows, page, page_url)
+
+
+def conditional_get(*tables):
+    """Async version of app.conditional_get(). The version stamps live in the
+    table_versions table, so the write routes in the Flask app change these pages'
+    ETags too."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if "_flashes" in session:
+                return await view(*args, **kwargs)
+            etag, last_modified = await db_async.table_versions(*tables)
+            if is_not_modified(request, etag, last_modified):
+                return set_validators(await make_response("", 304), etag, last_modified)
+            response = await make_response(await view(*args, **kwargs))
+            return finish_conditional_get(
+                response, etag, last_modified, await db_async.read_may_be_stale(*tables))
+        return wrapper
+    return decorator
+
+
+@app.template_global()
+def cover_image(image):
+    """Template function giving the URLs to show a book's cover (see app.cover_sources())"""
+    return cover_sources(image, url_for)
+
+
+async def render_fragment(template, book):
+    """Async version of app.render_fragment(), sharing the same fragment cache."""
+    version, _last_modified = await db_async.table_versions("books")
+    key = fragments.fragment_key(template, "book", book["bookid"], version)
+    html = fragments.get_fragment(key)
+    if html is None:
+        html = await render_template(template, book=book)
+        if not await db_async.read_may_be_stale("books"):
+            fragments.set_fragment(key, html)
+    return Markup(html)
+
+
+# ========================================
+# 1. Home Page Routes
+# ========================================
+@app.route("/")
+@conditional_get("books", "loans")
+async def home():
+    """Display top 3 most popular books on home page"""
+    cursor = await db_async.get_cursor()
+
+    # Query to get top 3 most borrowed books (see app.home())
+    qstr = """
+    SELECT b.bookid, b.booktitle, b.author, b.bookcategory, b.yearofpublication,
+           b.image, lc.loancount as loan_count
+    FROM bookloancounts lc
+    JOIN books b ON lc.bookid = b.bookid
+    ORDER BY lc.loancount DESC
+    LIMIT 3
+    """
+
+    await cursor.execute(qstr)
+    popular_books = await cursor.fetchall()
+    await cursor.close()
+    for book in popular_books:
+        book["card_html"] = await render_fragment("book_card.html", book)
+    return await render_template("home.html", popular_books=popular_books)
+
+
+# ========================================
+# 2. Book Management Routes
+# ========================================
+@app.route("/book_list")
+@conditional_get("books")
+async def book_list():
+    """Return one page of books, sorted by title"""
+    cursor = await db_async.get_cursor()
+    books_qstr = """
+        SELECT bookid, booktitle, author, bookcategory, yearofpublication
+        FROM books
+        """
+    order_by = [("booktitle", "booktitle", False), ("bookid", "bookid", False)]
+    books, pagination = await fetch_page(cursor, books_qstr, [], [], order_by)
+    await cursor.close()
+    return await render_template(
+        "book_list.html",
+        books=books,
+        pagination=pagination)
+
+
+@app.route("/book", methods=["GET"])
+@conditional_get("books")
+async def book_detail():
+    """Display detailed information for a specific book (?book_id=...)"""
+    cursor = await db_async.get_cursor()
+    book_id = request.args.get("book_id")
+    book_qstr = """
+    SELECT bookid, booktitle, author, bookcategory, yearofpublication, description, image
+    FROM books
+    WHERE bookid = %s
+    """
+    await cursor.execute(book_qstr, (book_id,))
+    book = await cursor.fetchone()
+    await cursor.close()
+
+    if book is None:
+        book_info_html = Markup(await render_template("book_info.html", book=book))
+    else:
+        book_info_html = await render_fragment("book_info.html", book)
+    return await render_template("book_detail.html", book=book, book_info_html=book_info_html)
+
+
+# ========================================
+# 3. Loan Management Routes
+# ========================================
+BORROWER_OPTIONS_QSTR = """
+    SELECT borrowerid, firstname, familyname
+    FROM borrowers
+    ORDER BY familyname, firstname
+    """
+
+
+async def reserve_copy(cursor, copy_id):
+    """Lock the copy asked for, or another free copy of the same book and format
+    (see app.reserve_copy()). Returns the locked copy's id, or None."""
+    await cursor.execute(RESERVE_COPY_QSTR, (copy_id,))
+    reserved = await cursor.fetchone()
+    if reserved is None:
+        await cursor.execute(COPY_FORMAT_QSTR, (copy_id,))
+        wanted = await cursor.fetchone()
+        if wanted is None:
+            return None
+        await cursor.execute(RESERVE_OTHER_COPY_QSTR, (wanted["bookid"], wanted["format"]))
+        reserved = await cursor.fetchone()
+    return reserved["bookcopyid"] if reserved else None
+
+
+async def checkout_copy(copy_id, borrower_id):
+    """Loan a copy, or another free copy of the same book and format if that one
+    was just borrowed (see app.checkout_copy()). Returns the id of the copy loaned,
+    or None if there is no free copy left."""
+    connection = await db_async.get_db()
+    cursor = await db_async.get_cursor()
+    try:
+        for _attempt in range(CHECKOUT_ATTEMPTS):
+            await cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            await connection.begin()
+            try:
+                reserved_id = await reserve_copy(cursor, copy_id)
+                if reserved_id is None:
+                    await connection.rollback()
+                    return None
+                await cursor.execute(OPEN_LOAN_FOR_COPY_QSTR, (reserved_id,))
+                if await cursor.fetchone() is None:
+                    # Insert the loan and bump the book's loan total together (see app.loan())
+                    loan_qstr = """
+                    INSERT INTO loans (bookcopyid, borrowerid, loandate, returned)
+                    VALUES (%s, %s, CURDATE(), NULL)
+                    """
+                    await cursor.execute(loan_qstr, (reserved_id, borrower_id))
+                    count_qstr = """
+                    INSERT INTO bookloancounts (bookid, loancount)
+                    SELECT bookid, 1 FROM bookcopies WHERE bookcopyid = %s
+                    ON DUPLICATE KEY UPDATE loancount = loancount + 1
+                    """
+                    await cursor.execute(count_qstr, (reserved_id,))
+                    await connection.commit()
+                    return reserved_id
+                await connection.rollback()
+            except Exception:
+                # e.g. an unknown borrower: don't leave the copy locked
+                await connection.rollback()
+                raise
+        return None
+    finally:
+        await cursor.close()
+
+
+@app.route("/loan", methods=["GET", "POST"])
+async def loan():
+    # Look up the borrowers and books for the dropdowns at the same time
+    borrowers, books = await asyncio.gather(
+        db_async.cached_query("borrowers", BORROWER_OPTIONS_QSTR, tables=("borrowers",)),
+        db_async.cached_query("available_books", AVAILABLE_BOOKS_QSTR,
+                              tables=("books", "loans")),
+    )
+
+    if request.method == "POST":
+        # Handle loan creation only
+        form = await request.form
+        borrower_id = form.get("borrower_id")
+        book_id = form.get("book_id")
+        copy_id = form.get("copy_id")
+
+        # Basic validation (frontend handles most validation)
+        if borrower_id and book_id and copy_id:
+            # Another desk may have loaned the copy since the form was shown
+            loaned_copy = await checkout_copy(copy_id, borrower_id)
+            db.invalidate_cache("available_books")
+            if loaned_copy is None:
+                await flash("The selected copy has just been borrowed and no other copy in that "
+                            "format is available.", "warning")
+                return redirect(url_for("loan"))
+            await db_async.bump_version("loans")
+            if str(loaned_copy) != copy_id:
+                await flash(f"The selected copy has just been borrowed, so copy {loaned_copy} "
+                            "in the same format was loaned instead.", "info")
+            await flash("Book borrowed successfully!", "success")
+            return redirect(url_for("loan_by_borrower"))
+        else:
+            await flash("Please select all required fields.", "warning")
+
+    return await render_template("loan.html",
+                                 borrowers=borrowers,
+                                 books=books)
+
+
+@app.route("/loan_select_book", methods=["POST"])
+async def loan_select_book():
+    # Get form data
+    form = await request.form
+    borrower_id = form.get("borrower_id")
+    book_id = form.get("book_id")
+
+    selected_borrower = borrower_id
+    selected_book = book_id
+    available_copies = []
+    book_detail = None
+
+    # The dropdown lists, book details and available copies don't depend on each
+    # other, so fetch them all at the same time
+    lookups = [
+        db_async.cached_query("borrowers", BORROWER_OPTIONS_QSTR, tables=("borrowers",)),
+        db_async.cached_query("available_books", AVAILABLE_BOOKS_QSTR,
+                              tables=("books", "loans")),
+    ]
+    if book_id:
+        book_qstr = """
+        SELECT bookid, booktitle, author, bookcategory, yearofpublication, description, image
+        FROM books
+        WHERE bookid = %s
+        """
+        lookups.append(db_async.query_all(book_qstr, (book_id,)))
+        lookups.append(db_async.query_all(AVAILABLE_COPIES_QSTR, (book_id,)))
+    results = await asyncio.gather(*lookups)
+    borrowers, books = results[0], results[1]
+
+    if book_id:
+        book_detail = results[2][0] if results[2] else None
+        available_copies = results[3]
+
+        # If there are no available copies, flash a warning and reload loan page
+        # with only selected borrower (and no book selected)
+        if len(available_copies) == 0:
+            await flash("No available copies for the selected book. Please select a different book.",
+                        "warning")
+            return await render_template(
+                "loan.html",
+                borrowers=borrowers,
+                books=books,
+                selected_borrower=selected_borrower,
+            )
+
+    return await render_template(
+        "loan.html",
+        borrowers=borrowers,
+        books=books,
+        selected_borrower=selected_borrower,
+        selected_book=selected_book,
+        available_copies=available_copies,
+        book_detail=book_detail,
+    )
+
+
+# ========================================
+# 4. Borrower Management Routes
+# ========================================
+@app.route("/borrower_list", methods=["GET", "POST"])
+async def borrower_list():
+    """Display one page of borrowers with search functionality"""
+    values = await request.values
+    firstname_search = values.get("firstname", "").strip()
+    familyname_search = values.get("familyname", "").strip()
+
+    where_conditions = []
+    params = []
+    if firstname_search:
+        condition, param = name_search_condition("firstname", firstname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    if familyname_search:
+        condition, param = name_search_condition("familyname", familyname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    borrowers_qstr = """
+    SELECT borrowerid, firstname, familyname, dateofbirth, address, suburb, city, postcode
+    FROM borrowers
+    """
+    order_by = [
+        ("familyname", "familyname", False),
+        ("firstname", "firstname", False),
+        ("borrowerid", "borrowerid", False),
+    ]
+    link_args = {"firstname": firstname_search, "familyname": familyname_search}
+    link_args = {name: value for name, value in link_args.items() if value}
+    cursor = await db_async.get_cursor()
+    borrowers_list, pagination = await fetch_page(
+        cursor, borrowers_qstr, where_conditions, params, order_by, link_args)
+    await cursor.close()
+
+    return await render_template(
+        "borrower_list.html",
+        borrowers=borrowers_list,
+        pagination=pagination,
+        firstname_search=firstname_search,
+        familyname_search=familyname_search,
+    )
+
+
+@app.route("/borrower_search", methods=["GET"])
+async def borrower_search():
+    """Search-as-you-type: return the borrowers best matching ?q=... as JSON"""
+    search_query = name_search_query(request.args.get("q", ""))
+    if search_query is None:
+        return jsonify({"borrowers": []})
+
+    cursor = await db_async.get_cursor()
+    search_qstr = """
+    SELECT borrowerid, firstname, familyname,
+           MATCH(firstname, familyname) AGAINST (%s IN BOOLEAN MODE) AS score
+    FROM borrowers
+    WHERE MATCH(firstname, familyname) AGAINST (%s IN BOOLEAN MODE)
+    ORDER BY score DESC, familyname, firstname
+    LIMIT %s
+    """
+    await cursor.execute(search_qstr, (search_query, search_query, SEARCH_SUGGESTIONS))
+    borrowers = await cursor.fetchall()
+    await cursor.close()
+
+    return jsonify({"borrowers": borrowers})
+
+
+# ========================================
+# 5. Loans by Borrower Routes
+# ========================================
+async def group_loans_by_borrower(loans):
+    """Async version of app.group_loans_by_borrower() for rows streamed from the database"""
+    group = None
+    async for loan in loans:
+        if group is None or group["borrower"]["borrowerid"] != loan["borrowerid"]:
+            if group is not None:
+                yield group
+            group = {
+                "borrower": {
+                    "borrowerid": loan["borrowerid"],
+                    "firstname": loan["firstname"],
+                    "familyname": loan["familyname"],
+                },
+                "loans": [],
+            }
+
+        group["loans"].append(loan)
+
+    if group is not None:
+        yield group
+
+
+@app.route("/loan_by_borrower")
+async def loan_by_borrower():
+    """Display the loans of one page of borrowers (with archived loans if ?archived=1)"""
+    archived = request.args.get("archived") == "1"
+    tables = loans_tables(archived)
+    link_args = {"archived": 1} if archived else None
+    cursor = await db_async.get_cursor()
+    borrowers, pagination = await fetch_page(
+        cursor, LOAN_BORROWERS_QSTR, [has_loans_condition(tables)], [], LOAN_BORROWERS_ORDER,
+        link_args)
+    borrower_ids = [borrower["borrowerid"] for borrower in borrowers]
+    loans = []
+    if borrower_ids:
+        for table in tables:
+            await cursor.execute(borrower_loans_qstr(table, len(borrower_ids)), borrower_ids)
+            loans.extend(await cursor.fetchall())
+    await cursor.close()
+
+    borrower_groups = group_page_loans(borrowers, loans)
+
+    return await render_template("loan_by_borrower.html",
+                                 borrower_groups=borrower_groups,
+                                 pagination=pagination,
+                                 archived=archived)
+
+
+@app.route("/loan_by_borrower_all")
+async def loan_by_borrower_all():
+    """Stream the full loan history grouped by borrower"""
+    archived = request.args.get("archived") == "1"
+    loans_qstr = LOANS_WITH_ARCHIVE_BY_BORROWER_QSTR if archived else LOANS_BY_BORROWER_QSTR
+    order_qstr = order_by_qstr(LOANS_BY_BORROWER_ORDER)
+    loans = db_async.stream_rows(f"{loans_qstr} ORDER BY {order_qstr}")
+
+    return await stream_template("loan_by_borrower.html",
+                                 borrower_groups=group_loans_by_borrower(loans),
+                                 pagination=None,
+                                 streaming=True,
+                                 archived=archived)
+
+
+# ========================================
+# 6. Current Loans Routes
+# ========================================
+@app.route("/loan_current", methods=["GET", "POST"])
+async def loan_current():
+    """Display one page of current loans (not returned) with search functionality"""
+    values = await request.values
+    firstname_search = values.get("firstname", "").strip()
+    lastname_search = values.get("lastname", "").strip()
+
+    where_conditions = ["loans.returned IS NULL"]  # Only current loans
+    params = []
+
+    if firstname_search:
+        condition, param = name_search_condition("borrowers.firstname", firstname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    if lastname_search:
+        condition, param = name_search_condition("borrowers.familyname", lastname_search)
+        where_conditions.append(condition)
+        params.append(param)
+
+    link_args = {"firstname": firstname_search, "lastname": lastname_search}
+    link_args = {name: value for name, value in link_args.items() if value}
+    cursor = await db_async.get_cursor()
+    loans, pagination = await fetch_page(
+        cursor, CURRENT_LOANS_QSTR, where_conditions, params, CURRENT_LOANS_ORDER, link_args)
+    await cursor.close()
+
+    return await render_template(
+        "loan_current.html",
+        loans=loans,
+        pagination=pagination,
+        firstname_search=firstname_search,
+        lastname_search=lastname_search,
+    )
+
+
+# ========================================
+# ASGI Entry Point
+# ========================================
+# The Flask app runs in a thread pool for the requests not handled above
+_sync_application = AsyncioWSGIMiddleware(sync_app.app)
+
+
+async def application(scope, receive, send):
+    """ASGI application: send each request to the async route if there is one,
+    otherwise to the Flask app"""
+    if scope["type"] == "http":
+        adapter = app.url_map.bind("", url_scheme=scope.get("scheme", "http"))
+        try:
+            adapter.match(scope["path"], method=scope["method"])
+        except (NotFound, MethodNotAllowed):
+            await _sync_application(scope, receive, send)
+            return
+
+    await app(scope, receive, send)
@@ -0,0 +1,276 @@
+"""Load-testing benchmarks for every route of the library app.
+
+Loads library-local.sql into a separate benchmark database on a local MySQL
+server, scales it up with synthetic data (datagen.py), then times every route
+and reports p50/p95/p99 latency, throughput and queries per request.
+
+    # Build a fresh benchmark database and time each route with Flask's test client
+    python benchmarks/bench.py --load --borrowers 100000 --loans 1000000
+
+    # Hit a running server instead, with 20 concurrent clients
+    python benchmarks/bench.py --url http://127.0.0.1:5000 --concurrency 20
+
+    # Save the results as a baseline, then compare a later run against it
+    python benchmarks/bench.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench.py --compare benchmarks/baseline.json
+
+The database connection details come from connect.py; only the database name
+is replaced (by --database), so your normal `library` database is not touched.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Make the app modules (app.py, db.py, connect.py, ...) importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mysql.connector
+
+import connect
+import datagen
+
+
+# ========================================
+# Benchmark Database
+# ========================================
+def load_schema(args):
+    """Create the benchmark database from library-local.sql using the mysql client"""
+    with open(os.path.join(ROOT, "library-local.sql"), encoding="utf-8") as sql_file:
+        script = sql_file.read()
+    # The script creates and uses a schema called `library`; point it at ours instead
+    script = re.sub(r"\bSCHEMA IF EXISTS library;", f"SCHEMA IF EXISTS {args.database};", script)
+    script = re.sub(r"\bCREATE SCHEMA library;", f"CREATE SCHEMA {args.database};", script)
+    script = re.sub(r"\bUSE library;", f"USE {args.database};", script)
+
+    command = [args.mysql_client, f"--host={connect.dbhost}", f"--port={connect.dbport}",
+               f"--user={connect.dbuser}"]
+    environment = dict(os.environ, MYSQL_PWD=connect.dbpass)
+    subprocess.run(command, input=script, text=True, check=True, env=environment)
+
+
+def scale_data(args):
+    """Add synthetic rows to the benchmark database"""
+    connection = mysql.connector.connect(
+        user=connect.dbuser, password=connect.dbpass, host=connect.dbhost,
+        port=connect.dbport, database=args.database)
+    started = time.perf_counter()
+    added = datagen.generate(connection, borrowers=args.borrowers, books=args.books,
+                             copies_per_book=args.copies_per_book, loans=args.loans)
+    connection.close()
+    print(f"Generated {added} in {time.perf_counter() - started:.1f}s")
+
+
+def sample_ids(args):
+    """Pick existing ids to use in the benchmarked URLs"""
+    connection = mysql.connector.connect(
+        user=connect.dbuser, password=connect.dbpass, host=connect.dbhost,
+        port=connect.dbport, database=args.database)
+    cursor = connection.cursor()
+    ids = {}
+    for name, qstr in [
+        ("book_id", "SELECT MAX(bookid) FROM books"),
+        ("borrower_id", "SELECT MAX(borrowerid) FROM borrowers"),
+        ("familyname", "SELECT familyname FROM borrowers ORDER BY borrowerid DESC LIMIT 1"),
+    ]:
+        cursor.execute(qstr)
+        ids[name] = cursor.fetchone()[0]
+    cursor.close()
+    connection.close()
+    return ids
+
+
+def routes(ids):
+    """The requests to benchmark, as (name, method, path, form data)"""
+    book_id, borrower_id = ids["book_id"], ids["borrower_id"]
+    search = ids["familyname"][:4]
+    return [
+        ("home", "GET", "/", None),
+        ("book_list", "GET", "/book_list", None),
+        ("book_detail", "GET", f"/book?book_id={book_id}", None),
+        ("book_add", "GET", "/book_add", None),
+        ("book_edit", "GET", f"/book_manage?book_id={book_id}", None),
+        ("book_availability", "GET", f"/book_availability?book_id={book_id}", None),
+        ("loan", "GET", "/loan", None),
+        ("loan_select_book", "POST", "/loan_select_book",
+         {"borrower_id": borrower_id, "book_id": book_id}),
+        ("borrower_list", "GET", "/borrower_list", None),
+        ("borrower_list_search", "GET", f"/borrower_list?familyname={search}", None),
+        ("borrower_search", "GET", f"/borrower_search?q={search}", None),
+        ("borrower_manage", "GET", f"/borrower_manage?borrower_id={borrower_id}", None),
+        ("loan_by_borrower", "GET", "/loan_by_borrower", None),
+        ("loan_by_borrower_all", "GET", "/loan_by_borrower_all", None),
+        ("loan_current", "GET", "/loan_current", None),
+        ("loan_current_search", "GET", f"/loan_current?lastname={search}", None),
+        ("loan_overdue", "GET", "/loan_overdue", None),
+        ("loan_overdue_count", "GET", "/loan_overdue_count", None),
+        ("api_books", "GET", "/api/v1/books", None),
+        ("api_borrowers", "GET", "/api/v1/borrowers?fields=borrowerid,firstname,familyname", None),
+        ("api_current_loans", "GET", "/api/v1/current_loans", None),
+        ("api_book_copies", "GET", f"/api/v1/books/{book_id}/copies", None),
+    ]
+
+
+# ========================================
+# Request Drivers
+# ========================================
+def time_test_client(requests, concurrency):
+    """Send each request through Flask's test client, returning
+    (seconds, query count) per request"""
+    import app as library_app
+    client = library_app.app.test_client()
+
+    def send(request_info):
+        _name, method, path, data = request_info
+        started = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        response.get_data()  # read streamed responses to the end
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+        return elapsed, int(response.headers.get("X-DB-Query-Count", 0))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, requests))
+
+
+def time_http(base_url, requests, concurrency):
+    """Send each request to a running server over HTTP, returning
+    (seconds, query count) per request"""
+    def send(request_info):
+        _name, method, path, data = request_info
+        body = urllib.parse.urlencode(data).encode() if data else None
+        http_request = urllib.request.Request(base_url + path, data=body, method=method)
+        started = time.perf_counter()
+        with urllib.request.urlopen(http_request) as response:
+            response.read()
+            queries = int(response.headers.get("X-DB-Query-Count", 0))
+        return time.perf_counter() - started, queries
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, requests))
+
+
+# ========================================
+# Reporting
+# ========================================
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarise(timings, wall_seconds):
+    """Latency percentiles (ms), throughput and average queries for one route"""
+    latencies = sorted(seconds for seconds, _queries in timings)
+    return {
+        "requests": len(timings),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "throughput_rps": len(timings) / wall_seconds,
+        "queries_per_request": sum(queries for _seconds, queries in timings) / len(timings),
+    }
+
+
+def print_report(results):
+    print(f"{'route':<24}{'reqs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'req/s':>10}{'queries':>9}")
+    for name, stats in results.items():
+        print(f"{name:<24}{stats['requests']:>6}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['throughput_rps']:>10.1f}"
+              f"{stats['queries_per_request']:>9.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """Print the change from the baseline for each route; return the routes that
+    got slower (p95) or issue more queries than the tolerance allows"""
+    regressions = []
+    print(f"\n{'route':<24}{'p95 base':>10}{'p95 now':>10}{'change':>9}{'queries':>12}")
+    for name, stats in results.items():
+        if name not in baseline:
+            print(f"{name:<24}{'(new)':>10}")
+            continue
+        base = baseline[name]
+        change = (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        queries = f"{base['queries_per_request']:.1f}->{stats['queries_per_request']:.1f}"
+        flag = ""
+        if change > tolerance or stats["queries_per_request"] > base["queries_per_request"]:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<24}{base['p95_ms']:>10.1f}{stats['p95_ms']:>10.1f}{change:>+9.0%}"
+              f"{queries:>12}{flag}")
+    return regressions
+
+
+# ========================================
+# Main
+# ========================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default="library_bench",
+                        help="benchmark database name (default: library_bench)")
+    parser.add_argument("--load", action="store_true",
+                        help="recreate the database from library-local.sql and add synthetic data")
+    parser.add_argument("--mysql-client", default="mysql", help="path to the mysql command line client")
+    parser.add_argument("--borrowers", type=int, default=100_000)
+    parser.add_argument("--books", type=int, default=20_000)
+    parser.add_argument("--copies-per-book", type=int, default=3)
+    parser.add_argument("--loans", type=int, default=1_000_000)
+    parser.add_argument("--url", help="benchmark a running server at this URL instead of the test client")
+    parser.add_argument("--requests", type=int, default=50, help="requests per route (default: 50)")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--routes", help="comma separated route names to run (default: all)")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed p95 slowdown before a route counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    # Point the app at the benchmark database and report queries per request
+    connect.dbname = args.database
+    connect.dbprofileheaders = True
+
+    if args.load:
+        load_schema(args)
+        scale_data(args)
+
+    selected = args.routes.split(",") if args.routes else None
+    results = {}
+    for request_info in routes(sample_ids(args)):
+        name = request_info[0]
+        if selected and name not in selected:
+            continue
+        requests = [request_info] * args.requests
+        started = time.perf_counter()
+        if args.url:
+            timings = time_http(args.url.rstrip("/"), requests, args.concurrency)
+        else:
+            timings = time_test_client(requests, args.concurrency)
+        results[name] = summarise(timings, time.perf_counter() - started)
+
+    print_report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} route(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
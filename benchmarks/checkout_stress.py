@@ -0,0 +1,216 @@
+"""Concurrency stress test for checkouts.
+
+Many clerks post the loan form at once for the same few books, each picking a
+copy at random, so most of them race for a copy someone else is loaning. The
+test reports checkout throughput and latency, then checks the loans table:
+no copy may end up with more than one open loan, and no checkout may be
+turned away while a copy of its book in the same format was still free. So
+for each book and format, the loans made must equal the smaller of the
+checkouts asked for and the free copies there were.
+
+    # 20 clerks making 500 checkouts of the copies of 10 books, with the test client
+    python benchmarks/checkout_stress.py --clerks 20 --checkouts 500 --books 10
+
+    # The same against a running server
+    python benchmarks/checkout_stress.py --url http://127.0.0.1:5000
+
+Run it on the benchmark database built by bench.py (--database, default
+library_bench). The loans it makes are marked returned at the end unless
+--keep is given; the loan counts on the home page keep them.
+"""
+import argparse
+import collections
+import random
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import bench  # also makes the app modules importable
+
+import mysql.connector
+
+import connect
+
+
+def open_database(args):
+    return mysql.connector.connect(
+        user=connect.dbuser, password=connect.dbpass, host=connect.dbhost,
+        port=connect.dbport, database=args.database, autocommit=True)
+
+
+def free_copies(connection, book_count):
+    """The free copies of the `book_count` books with the most copies, as
+    (book id, format, copy id) tuples"""
+    cursor = connection.cursor()
+    cursor.execute("""
+    SELECT bc.bookid, bc.format, bc.bookcopyid
+    FROM bookcopies bc
+    JOIN (
+        SELECT bookid
+        FROM bookcopies
+        GROUP BY bookid
+        ORDER BY COUNT(*) DESC, bookid
+        LIMIT %s
+    ) hot ON hot.bookid = bc.bookid
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM loans l
+        WHERE l.bookcopyid = bc.bookcopyid
+        AND l.returned IS NULL
+    )
+    """, (book_count,))
+    copies = cursor.fetchall()
+    cursor.close()
+    return copies
+
+
+def checkout_sender(args):
+    """Returns a function that posts one checkout and returns (seconds, loaned)"""
+    if args.url:
+        base_url = args.url.rstrip("/")
+
+        class NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *_args, **_kwargs):
+                return None
+
+        opener = urllib.request.build_opener(NoRedirect)
+
+        def post(data):
+            body = urllib.parse.urlencode(data).encode()
+            try:
+                response = opener.open(base_url + "/loan", data=body)
+            except urllib.error.HTTPError as error:  # the 302 after the form
+                response = error
+            response.read()
+            return response.status, response.headers.get("Location", "")
+    else:
+        import app as library_app
+
+        def post(data):
+            # A new client each time, so the flashed messages don't pile up in one session
+            response = library_app.app.test_client().post("/loan", data=data)
+            return response.status_code, response.headers.get("Location", "")
+
+    def send(checkout):
+        started = time.perf_counter()
+        status, location = post(checkout)
+        elapsed = time.perf_counter() - started
+        if status != 302:
+            raise RuntimeError(f"POST /loan returned {status}")
+        # A checkout goes on to the loans page; a copy that's gone goes back to the form
+        return elapsed, "loan_by_borrower" in location
+
+    return send
+
+
+def check_loans(connection, copy_ids, first_loan_id):
+    """Returns (loans made, copies with more than one open loan)"""
+    cursor = connection.cursor()
+    placeholders = ", ".join(["%s"] * len(copy_ids))
+    cursor.execute("SELECT COUNT(*) FROM loans WHERE loanid >= %s", (first_loan_id,))
+    loans_made = cursor.fetchone()[0]
+    cursor.execute(f"""
+    SELECT bookcopyid, COUNT(*)
+    FROM loans
+    WHERE bookcopyid IN ({placeholders})
+    AND returned IS NULL
+    GROUP BY bookcopyid
+    HAVING COUNT(*) > 1
+    """, copy_ids)
+    double_loans = cursor.fetchall()
+    cursor.close()
+    return loans_made, double_loans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default="library_bench",
+                        help="benchmark database name (default: library_bench)")
+    parser.add_argument("--url", help="test a running server at this URL instead of the test client")
+    parser.add_argument("--clerks", type=int, default=20, help="checkouts in flight at once (default: 20)")
+    parser.add_argument("--checkouts", type=int, default=500, help="checkouts to attempt (default: 500)")
+    parser.add_argument("--books", type=int, default=10,
+                        help="books whose copies are fought over (default: 10)")
+    parser.add_argument("--keep", action="store_true", help="leave the new loans open afterwards")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Point the app at the benchmark database, with a connection for every clerk
+    connect.dbname = args.database
+    connect.dbpoolsize = max(getattr(connect, "dbpoolsize", 5), args.clerks)
+
+    connection = open_database(args)
+    copies = free_copies(connection, args.books)
+    if not copies:
+        sys.exit("No free copies to loan; load the benchmark database with bench.py --load first")
+    copy_ids = [copy_id for _book_id, _format, copy_id in copies]
+    cursor = connection.cursor()
+    # Existing borrowers only: an unknown one fails the checkout (borrower ids may have gaps)
+    cursor.execute("SELECT borrowerid FROM borrowers ORDER BY borrowerid DESC LIMIT 1000")
+    borrower_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT COALESCE(MAX(loanid), 0) + 1 FROM loans")
+    first_loan_id = cursor.fetchone()[0]
+    cursor.close()
+
+    randomiser = random.Random(args.seed)
+    checkouts = []
+    asked_for = collections.Counter()
+    for _checkout in range(args.checkouts):
+        book_id, copy_format, copy_id = randomiser.choice(copies)
+        checkouts.append({"borrower_id": randomiser.choice(borrower_ids),
+                          "book_id": book_id, "copy_id": copy_id})
+        asked_for[(book_id, copy_format)] += 1
+
+    # A checkout may only be turned away once every copy in its book's format is loaned
+    free_per_group = collections.Counter((book_id, copy_format)
+                                         for book_id, copy_format, _copy_id in copies)
+    expected = sum(min(count, free_per_group[group]) for group, count in asked_for.items())
+
+    send = checkout_sender(args)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clerks) as executor:
+        results = list(executor.map(send, checkouts))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = sorted(seconds for seconds, _loaned in results)
+    loaned = sum(1 for _seconds, was_loaned in results if was_loaned)
+    loans_made, double_loans = check_loans(connection, copy_ids, first_loan_id)
+
+    print(f"{len(copy_ids)} free copies of {args.books} books, {args.checkouts} checkouts "
+          f"by {args.clerks} clerks")
+    print(f"{len(results) / wall_seconds:.1f} checkouts/s, "
+          f"p50 {bench.percentile(latencies, 0.50) * 1000:.1f} ms, "
+          f"p95 {bench.percentile(latencies, 0.95) * 1000:.1f} ms, "
+          f"p99 {bench.percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"{loaned} loaned ({expected} expected), {len(results) - loaned} found no free copy, "
+          f"{loans_made} loans written")
+
+    failed = False
+    if double_loans:
+        print(f"FAILED: {len(double_loans)} copies are on loan more than once: "
+              + ", ".join(f"{copy_id} ({count}x)" for copy_id, count in double_loans))
+        failed = True
+    if loans_made > len(copy_ids) or loans_made != loaned:
+        print(f"FAILED: {loans_made} loans written for {loaned} checkouts of {len(copy_ids)} copies")
+        failed = True
+    if loaned != expected:
+        print(f"FAILED: {loaned} checkouts succeeded, but {expected} could have; "
+              f"{expected - loaned} were told no copy was free while one was")
+        failed = True
+
+    if not args.keep:
+        cursor = connection.cursor()
+        cursor.execute("UPDATE loans SET returned = CURDATE() WHERE loanid >= %s AND returned IS NULL",
+                       (first_loan_id,))
+        cursor.close()
+    connection.close()
+    if failed:
+        sys.exit(1)
+    print("OK: no copy was loaned twice")
+
+
+if __name__ == "__main__":
+    main()
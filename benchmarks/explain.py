@@ -0,0 +1,198 @@
+"""Index advisor and query plan regression checks for the library app.
+
+Requests every route that bench.py benchmarks, records the queries each one
+runs (with their real parameters), and EXPLAINs them against the benchmark
+database. Plans that read a whole table, read a whole index, sort rows with a
+filesort or build a temporary table are flagged, with the indexes MySQL
+could have used, so missing indexes show up before the pages get slow.
+
+    # Build and scale the benchmark database first (see bench.py), then
+    python benchmarks/explain.py
+
+    # Save the plans as a baseline, then fail if a later change makes one worse
+    python benchmarks/explain.py --save-baseline benchmarks/plans.json
+    python benchmarks/explain.py --compare benchmarks/plans.json
+
+--compare exits with status 1 when a route runs a query with a problem its
+baseline plan didn't have, so it can run alongside bench.py --compare in CI.
+The database connection details come from connect.py (see bench.py).
+"""
+import argparse
+import json
+import sys
+
+import bench  # also makes the app modules importable
+
+import mysql.connector
+from flask import g
+
+import connect
+import profiler
+
+
+# ========================================
+# Collecting Queries
+# ========================================
+def collect_queries(args):
+    """Request each route through Flask's test client and return the distinct
+    queries it ran, as {route: {sql: parameter values}}"""
+    import app as library_app
+
+    captured = []
+
+    def capture(exception=None):
+        captured.extend(g.get("query_log", []))
+
+    library_app.app.teardown_request(capture)
+    client = library_app.app.test_client()
+
+    selected = args.routes.split(",") if args.routes else None
+    queries = {}
+    for name, method, path, data in bench.routes(bench.sample_ids(args)):
+        if selected and name not in selected:
+            continue
+        captured.clear()
+        response = client.open(path, method=method, data=data)
+        response.get_data()  # streamed pages run their queries while being read
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}")
+        route_queries = queries.setdefault(name, {})
+        for entry in captured:
+            # Only the reads are checked; the writes update single rows by key
+            if entry["sql"].split(" ", 1)[0].upper() in ("SELECT", "WITH"):
+                route_queries.setdefault(entry["sql"], entry.get("values", ()))
+    return queries
+
+
+# ========================================
+# Explaining Plans
+# ========================================
+def explain(cursor, sql, values, min_rows):
+    """Return a query's plan (one "table:access type:index" step per table) and
+    the problems found in it"""
+    cursor.execute("EXPLAIN " + sql, values)
+    plan = []
+    problems = []
+    for row in cursor.fetchall():
+        table = row["table"] or "-"
+        access = row["type"] or "-"
+        key = row["key"] or "-"
+        extra = row["Extra"] or ""
+        rows = row["rows"] or 0
+        plan.append(f"{table}:{access}:{key}")
+        if rows < min_rows:
+            continue  # small enough that reading all of it is fine
+        hint = f" (possible keys: {row['possible_keys'] or 'none'})"
+        if access == "ALL":
+            problems.append(f"full table scan of {table}, ~{rows} rows{hint}")
+        elif access == "index":
+            problems.append(f"full index scan of {table} using {key}, ~{rows} rows")
+        if "Using filesort" in extra:
+            problems.append(f"filesort of {table}, ~{rows} rows{hint}")
+        if "Using temporary" in extra:
+            problems.append(f"temporary table for {table}, ~{rows} rows")
+    return {"plan": plan, "problems": problems}
+
+
+def explain_all(args, queries):
+    """EXPLAIN every collected query, returning {route: {sql: plan}}"""
+    connection = mysql.connector.connect(
+        user=connect.dbuser, password=connect.dbpass, host=connect.dbhost,
+        port=connect.dbport, database=args.database)
+    cursor = connection.cursor(dictionary=True)
+    plans = {route: {sql: explain(cursor, sql, values, args.min_rows)
+                     for sql, values in route_queries.items()}
+             for route, route_queries in queries.items()}
+    cursor.close()
+    connection.close()
+    return plans
+
+
+# ========================================
+# Reporting
+# ========================================
+def short_sql(sql, width=90):
+    return sql if len(sql) <= width else sql[:width - 3] + "..."
+
+
+def print_report(plans):
+    flagged = 0
+    for route, route_plans in plans.items():
+        print(f"{route}: {len(route_plans)} queries")
+        for sql, result in route_plans.items():
+            if result["problems"]:
+                flagged += 1
+                print(f"  {short_sql(sql)}")
+                print(f"    plan: {' > '.join(result['plan'])}")
+                for problem in result["problems"]:
+                    print(f"    ! {problem}")
+    print(f"\n{flagged} queries flagged")
+
+
+def problem_kind(problem):
+    """A problem without its row estimate (e.g. "filesort of loans"), which
+    changes with the data and shouldn't count as a regression"""
+    return problem.split(",")[0]
+
+
+def compare(plans, baseline):
+    """Print the plans that changed since the baseline; return the routes with a
+    query that has a problem its baseline plan didn't have"""
+    regressions = []
+    for route, route_plans in plans.items():
+        base_plans = baseline.get(route, {})
+        for sql, result in route_plans.items():
+            base = base_plans.get(sql)
+            known = {problem_kind(problem) for problem in base["problems"]} if base else set()
+            new_problems = [problem for problem in result["problems"]
+                            if problem_kind(problem) not in known]
+            if base and base["plan"] != result["plan"]:
+                print(f"{route}: plan changed for {short_sql(sql, 60)}")
+                print(f"    was: {' > '.join(base['plan'])}")
+                print(f"    now: {' > '.join(result['plan'])}")
+            if new_problems:
+                print(f"{route}: REGRESSION in {short_sql(sql, 60)}"
+                      + ("" if base else " (new query)"))
+                for problem in new_problems:
+                    print(f"    ! {problem}")
+                if route not in regressions:
+                    regressions.append(route)
+    return regressions
+
+
+# ========================================
+# Main
+# ========================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default="library_bench",
+                        help="benchmark database name (default: library_bench)")
+    parser.add_argument("--routes", help="comma separated route names to check (default: all)")
+    parser.add_argument("--min-rows", type=int, default=1000,
+                        help="ignore scans and sorts of fewer rows than this (default: 1000)")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the plans to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare the plans with a saved baseline")
+    args = parser.parse_args()
+
+    # Point the app at the benchmark database and keep the values of each query's parameters
+    connect.dbname = args.database
+    profiler.keep_params = True
+
+    plans = explain_all(args, collect_queries(args))
+    print_report(plans)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(plans, baseline_file, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            regressions = compare(plans, json.load(baseline_file))
+        if regressions:
+            print(f"\n{len(regressions)} route(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
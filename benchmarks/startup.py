@@ -0,0 +1,92 @@
+"""Startup-time benchmark for the library app.
+
+Starts fresh Python processes that import app.py and serve one request with
+Flask's test client, and reports how long a new worker takes to be ready:
+the import itself (building the app, which no longer opens the connection
+pool) and its first response (which compiles or loads the templates). Each
+run is made twice: with an empty template cache (cold) and with the compiled
+templates left on disk by an earlier run (warm).
+
+    # Median of 10 runs of the new-borrower form, which needs no database
+    python benchmarks/startup.py
+
+    # Another route, or open the connection pool at import time too
+    python benchmarks/startup.py --path /book_list --runs 20 --prewarm
+
+The database connection details come from connect.py, as for the app.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# The workers run here, so the app modules (app.py, db.py, connect.py, ...) are importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in each new process: settings come in as JSON in argv[1], timings go out as JSON
+CHILD_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+settings = json.loads(sys.argv[1])
+import connect
+connect.templatecachedir = settings["cache_dir"]
+connect.dbpoolprewarm = settings["prewarm"]
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get(settings["path"])
+response.get_data()
+served = time.perf_counter()
+print(json.dumps({"status": response.status_code,
+                  "import_ms": (imported - started) * 1000,
+                  "first_request_ms": (served - imported) * 1000}))
+"""
+
+
+def start_worker(path: str, cache_dir: str, prewarm: bool) -> dict:
+    """Starts a new Python process, imports the app and serves one request"""
+    settings = json.dumps({"path": path, "cache_dir": cache_dir, "prewarm": prewarm})
+    result = subprocess.run([sys.executable, "-c", CHILD_SCRIPT, settings], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    if timings["status"] >= 400:
+        raise SystemExit(f"{path} returned {timings['status']}")
+    timings["ready_ms"] = timings["import_ms"] + timings["first_request_ms"]
+    return timings
+
+
+def summarise(runs: "list[dict]") -> dict:
+    return {name: statistics.median(run[name] for run in runs)
+            for name in ("import_ms", "first_request_ms", "ready_ms")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--path", default="/borrower_manage",
+                        help="route requested by each new worker (default: /borrower_manage)")
+    parser.add_argument("--runs", type=int, default=10, help="workers started per case (default: 10)")
+    parser.add_argument("--prewarm", action="store_true", help="open the connection pool at import time")
+    args = parser.parse_args()
+
+    results = {"cold": [], "warm": []}
+    for _run in range(args.runs):
+        cache_dir = tempfile.mkdtemp(prefix="library-templates-")
+        try:
+            # The first worker compiles the templates into the empty cache, the second loads them
+            results["cold"].append(start_worker(args.path, cache_dir, args.prewarm))
+            results["warm"].append(start_worker(args.path, cache_dir, args.prewarm))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"{'template cache':<16}{'import ms':>12}{'first request ms':>18}{'ready ms':>12}")
+    for case, runs in results.items():
+        medians = summarise(runs)
+        print(f"{case:<16}{medians['import_ms']:>12.1f}{medians['first_request_ms']:>18.1f}"
+              f"{medians['ready_ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
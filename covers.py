@@ -0,0 +1,107 @@
+"""Serves book cover images as resized, content-hashed files.
+
+The covers in static/book-covers/ are full-size originals (often several
+hundred KB each), but the pages only ever show them about 300px wide. The
+first time a cover is shown, `cover_info()` writes WebP and JPEG thumbnails
+of it at each of `COVER_WIDTHS` into static/book-covers/cache/, named after a
+hash of the original's content. Because a file name changes whenever its
+content does, the /covers route can tell browsers to keep the files for a
+year without checking back, and the templates offer them through `srcset`
+so each browser downloads only the size it needs.
+
+Thumbnails need Pillow. Without it the original image is served (still with
+a content-hashed URL and the same long-lived caching).
+"""
+import hashlib
+import os
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow not installed: serve the originals only
+    Image = None
+
+# Folder holding the original covers, and the folder the thumbnails are written to.
+COVERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "book-covers")
+CACHE_DIR = os.path.join(COVERS_DIR, "cache")
+
+# Cover shown for books without an image of their own.
+NO_COVER_IMAGE = "no-cover-image.jpg"
+
+# Widths (in pixels) of the thumbnails made for each cover. The pages show covers
+# at up to 300px, so 600px covers high-DPI screens.
+COVER_WIDTHS = (150, 300, 600)
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+# How long browsers may keep a cover (it never changes under the same URL).
+COVER_MAX_AGE = 365 * 24 * 3600
+
+# Information about each cover already processed, keyed by file name. Each value
+# is a `((mtime, size), info)` tuple, so a replaced file is processed again.
+_covers: "dict[str, tuple[tuple, dict]]" = {}
+_covers_lock = threading.Lock()
+
+
+def content_hash(path: str) -> str:
+    """Returns a short hash of the file's content, used in its URLs."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(64 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def _make_thumbnails(path: str, stem: str, digest: str):
+    """Writes the WebP and JPEG thumbnails of one cover (if they don't exist yet)
+    and returns `{"jpeg": [(name, width), ...], "webp": [...]}`."""
+    thumbnails = {"jpeg": [], "webp": []}
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with Image.open(path) as original:
+        original = original.convert("RGB")
+        for width in COVER_WIDTHS:
+            # Never enlarge a cover; its own width is the biggest thumbnail
+            width = min(width, original.width)
+            if any(existing == width for _name, existing in thumbnails["jpeg"]):
+                continue
+            height = max(1, round(original.height * width / original.width))
+            resized = None
+            for image_format, extension, quality in (("jpeg", "jpg", JPEG_QUALITY),
+                                                     ("webp", "webp", WEBP_QUALITY)):
+                name = f"{stem}.{digest}.{width}w.{extension}"
+                target = os.path.join(CACHE_DIR, name)
+                if not os.path.exists(target):
+                    if resized is None:
+                        resized = original.resize((width, height), Image.LANCZOS)
+                    # Write under a temporary name so a half-written file is never served
+                    temp_target = f"{target}.{os.getpid()}.tmp"
+                    resized.save(temp_target, image_format.upper(), quality=quality)
+                    os.replace(temp_target, target)
+                thumbnails[image_format].append((name, width))
+    return thumbnails
+
+
+def cover_info(filename: str):
+    """Returns the hash and thumbnails of a cover file, making them the first
+    time it is asked for, or `None` if there is no such file."""
+    path = os.path.join(COVERS_DIR, filename)
+    # Only serve files directly inside the covers folder
+    if os.path.dirname(os.path.normpath(filename)) or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    with _covers_lock:
+        entry = _covers.get(filename)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+    digest = content_hash(path)
+    info = {"filename": filename, "hash": digest, "jpeg": [], "webp": []}
+    if Image is not None:
+        try:
+            info.update(_make_thumbnails(path, os.path.splitext(filename)[0], digest))
+        except OSError:
+            pass  # not an image Pillow can read: serve the original instead
+    with _covers_lock:
+        _covers[filename] = (key, info)
+    return info
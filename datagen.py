@@ -0,0 +1,272 @@
+"""Generates synthetic library data so the app can be profiled against realistic
+table sizes (the .sql scripts only create a handful of demo rows).
+
+The data is skewed the way real library data is: a few books are borrowed far
+more than the rest (Zipf distribution) and get more copies, a few borrowers
+borrow far more than others, borrowing has grown over time, and most loans are
+returned within a few weeks but some run late. Rows are added on top of
+whatever is already in the database, in batches, using either multi-row
+`executemany()` inserts or `LOAD DATA LOCAL INFILE` (fastest; needs
+local_infile enabled on the server).
+
+    python datagen.py --borrowers 100000 --books 20000 --loans 1000000
+    python datagen.py --loans 5000000 --method infile --database library_bench
+
+Database connection details come from connect.py.
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import db
+
+# Rows generated and sent to the server at a time
+BATCH_SIZE = 10000
+
+FIRST_NAMES = ["Aroha", "Ben", "Charlotte", "Di", "Ethan", "Fatima", "George", "Hana",
+               "Isla", "Jack", "Kahu", "Liam", "Mia", "Noah", "Olivia", "Priya",
+               "Quinn", "Ruby", "Sam", "Tama", "Uma", "Wiremu", "Xin", "Zhe"]
+# Family names are built from syllables so there are thousands of distinct ones
+NAME_SYLLABLES = ["an", "ba", "chen", "da", "el", "fo", "ga", "ha", "ing", "ka", "li",
+                  "ma", "ng", "o", "pa", "ri", "son", "ta", "u", "wa", "ton", "wang"]
+TITLE_WORDS = ["River", "Secret", "Garden", "Night", "Python", "Cat", "Phoenix", "Winter",
+               "Journey", "Island", "Code", "Caterpillar", "Shadow", "Carnival", "Star"]
+CITIES = [("Lincoln", "7608"), ("Christchurch", "8011"), ("Rolleston", "7615"),
+          ("Prebbleton", "7604"), ("Darfield", "7510")]
+FORMATS = ["Paperback", "Paperback", "Paperback", "Hardcover", "eBook", "Audio Book",
+           "Illustrated"]
+CATEGORIES = ["Fiction", "Picture Book", "Non-Fiction", "Magazine/Serial"]
+
+
+# ========================================
+# Distributions
+# ========================================
+def zipf_cum_weights(count, exponent):
+    """Cumulative weights giving item n (1-based) a weight of 1 / n**exponent, for use
+    with random.choices() or bisect"""
+    return list(itertools.accumulate(1 / n ** exponent for n in range(1, count + 1)))
+
+
+def family_name(rng):
+    return "".join(rng.choice(NAME_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+
+def loan_length(rng):
+    """Days until a loan is returned: usually 1-4 weeks, with a long tail of late returns"""
+    return max(1, int(rng.lognormvariate(2.7, 0.5)))
+
+
+def loan_age(rng, history_days):
+    """Days ago a loan was made. Borrowing has grown over time, so recent dates are
+    more likely (a triangular distribution peaking today)."""
+    return int(rng.triangular(0, history_days, 0))
+
+
+# ========================================
+# Row Generators
+# ========================================
+def borrower_rows(rng, first_id, count, today):
+    for borrower_id in range(first_id, first_id + count):
+        city, postcode = rng.choice(CITIES)
+        yield (borrower_id, rng.choice(FIRST_NAMES), family_name(rng),
+               today - timedelta(days=rng.randint(5 * 365, 90 * 365)),
+               f"{rng.randint(1, 300)} {family_name(rng)} Road", None, city, postcode)
+
+
+def book_rows(rng, first_id, count, today):
+    for book_id in range(first_id, first_id + count):
+        title = " ".join(rng.sample(TITLE_WORDS, rng.randint(2, 4)))
+        yield (book_id, f"{title} {book_id}"[:45],
+               f"{rng.choice(FIRST_NAMES)} {family_name(rng)}",
+               rng.choice(CATEGORIES), rng.randint(1900, today.year), None, None)
+
+
+def copy_counts(rng, book_count, average_copies):
+    """Number of copies of each book: popular (low rank) books get more copies"""
+    weights = [1 / rank ** 0.5 for rank in range(1, book_count + 1)]
+    scale = average_copies * book_count / sum(weights)
+    return [max(1, round(weight * scale * rng.uniform(0.7, 1.3))) for weight in weights]
+
+
+def loan_rows(rng, first_id, count, copies_by_book, book_cum_weights, borrower_ids,
+              borrower_cum_weights, history_days, open_ratio, today, open_copies=()):
+    """Loans of skewed books by skewed borrowers. Loans made within the last ~5 weeks are
+    left open with probability `open_ratio` (plus a few older, overdue ones), keeping
+    at most one open loan per copy, counting those already on loan (`open_copies`)."""
+    open_copies = set(open_copies)
+    book_total = book_cum_weights[-1]
+    borrower_total = borrower_cum_weights[-1]
+    for loan_id in range(first_id, first_id + count):
+        book_index = bisect.bisect(book_cum_weights, rng.random() * book_total)
+        copy_id = rng.choice(copies_by_book[book_index])
+        borrower_index = bisect.bisect(borrower_cum_weights, rng.random() * borrower_total)
+        loandate = today - timedelta(days=loan_age(rng, history_days))
+        returned = loandate + timedelta(days=loan_length(rng))
+
+        recent = (today - loandate).days < 36
+        if copy_id not in open_copies and rng.random() < (open_ratio if recent else open_ratio / 50):
+            open_copies.add(copy_id)
+            returned = None
+        elif returned > today:
+            returned = today
+        yield (loan_id, copy_id, borrower_ids[borrower_index], loandate, returned)
+
+
+# ========================================
+# Loaders
+# ========================================
+def insert_batches(cursor, qstr, rows):
+    """Insert rows with executemany(), which the connector sends as multi-row INSERTs"""
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        cursor.executemany(qstr, batch)
+
+
+def load_infile(cursor, table, columns, rows):
+    """Write rows to a temporary tab-separated file and bulk load it with LOAD DATA"""
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8") as data_file:
+        for row in rows:
+            data_file.write("\t".join(r"\N" if value is None else str(value) for value in row))
+            data_file.write("\n")
+    try:
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({', '.join(columns)})",
+            (data_file.name,))
+    finally:
+        os.remove(data_file.name)
+
+
+def load(cursor, method, table, columns, rows):
+    if method == "infile":
+        load_infile(cursor, table, columns, rows)
+    else:
+        placeholders = ", ".join(["%s"] * len(columns))
+        insert_batches(cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                       rows)
+
+
+def next_id(cursor, table, column):
+    cursor.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def copies_on_loan(cursor):
+    """Ids of the copies that already have an open loan"""
+    cursor.execute("SELECT DISTINCT bookcopyid FROM loans WHERE returned IS NULL")
+    return {row[0] for row in cursor.fetchall()}
+
+
+# ========================================
+# Generate
+# ========================================
+def generate(connection, borrowers=1000, books=500, copies_per_book=3, loans=10000,
+             open_loan_ratio=0.3, history_years=3, method="executemany", seed=636,
+             progress=None):
+    """Add synthetic borrowers, books, copies and loans to the database.
+
+    `copies_per_book` is the average number of copies. Ids are assigned here
+    (continuing from the current maximum) so loans can refer to the new rows.
+    Returns a dict with the number of rows added to each table."""
+    rng = random.Random(seed)
+    today = date.today()
+    cursor = connection.cursor()
+    report = progress or (lambda message: None)
+
+    # Every id is generated consistently here, so skip the foreign key and unique checks to load faster
+    cursor.execute("SET foreign_key_checks = 0, unique_checks = 0")
+
+    first_borrower = next_id(cursor, "borrowers", "borrowerid")
+    load(cursor, method, "borrowers",
+         ["borrowerid", "firstname", "familyname", "dateofbirth", "address", "suburb", "city", "postcode"],
+         borrower_rows(rng, first_borrower, borrowers, today))
+    report(f"borrowers: {borrowers}")
+
+    first_book = next_id(cursor, "books", "bookid")
+    load(cursor, method, "books",
+         ["bookid", "booktitle", "author", "bookcategory", "yearofpublication", "description", "image"],
+         book_rows(rng, first_book, books, today))
+    report(f"books: {books}")
+
+    # Copies, numbered consecutively per book so loans can pick a copy of a given book
+    next_copy = next_id(cursor, "bookcopies", "bookcopyid")
+    copies_by_book = []
+    copy_list = []
+    for offset, copies in enumerate(copy_counts(rng, books, copies_per_book)):
+        ids = list(range(next_copy, next_copy + copies))
+        next_copy += copies
+        copies_by_book.append(ids)
+        copy_list.extend((copy_id, first_book + offset, rng.choice(FORMATS)) for copy_id in ids)
+    load(cursor, method, "bookcopies", ["bookcopyid", "bookid", "format"], iter(copy_list))
+    report(f"bookcopies: {len(copy_list)}")
+
+    # Book rank 1 is the most popular; borrowers are shuffled so heavy readers are spread out
+    book_cum_weights = zipf_cum_weights(books, 1.1)
+    borrower_ids = list(range(first_borrower, first_borrower + borrowers))
+    rng.shuffle(borrower_ids)
+    borrower_cum_weights = zipf_cum_weights(borrowers, 0.8)
+    load(cursor, method, "loans", ["loanid", "bookcopyid", "borrowerid", "loandate", "returned"],
+         loan_rows(rng, next_id(cursor, "loans", "loanid"), loans, copies_by_book,
+                   book_cum_weights, borrower_ids, borrower_cum_weights,
+                   history_years * 365, open_loan_ratio, today, copies_on_loan(cursor)))
+    report(f"loans: {loans}")
+
+    cursor.execute("SET foreign_key_checks = 1, unique_checks = 1")
+    rebuild_loan_counts(cursor)
+    connection.commit()
+    cursor.close()
+    # Give the pages new ETags in every running app process (the copies and loan counts
+    # are shown on pages versioned by books and loans)
+    db.bump_version("borrowers", "books", "loans", connection=connection)
+
+    return {"borrowers": borrowers, "books": books,
+            "bookcopies": len(copy_list), "loans": loans}
+
+
+def rebuild_loan_counts(cursor):
+    """Recalculate the per-book loan totals used by the home page, counting the
+    archived loans too (the same query as  flask --app app rebuild-loan-counts)"""
+    cursor.execute("DELETE FROM bookloancounts")
+    cursor.execute(db.REBUILD_LOAN_COUNTS_QSTR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", help="database to add rows to (default: dbname in connect.py)")
+    parser.add_argument("--borrowers", type=int, default=100_000)
+    parser.add_argument("--books", type=int, default=20_000)
+    parser.add_argument("--copies-per-book", type=float, default=3, help="average copies per book")
+    parser.add_argument("--loans", type=int, default=1_000_000)
+    parser.add_argument("--open-loan-ratio", type=float, default=0.3,
+                        help="share of loans from the last 5 weeks still on loan (default: 0.3)")
+    parser.add_argument("--history-years", type=int, default=3)
+    parser.add_argument("--method", choices=["executemany", "infile"], default="executemany",
+                        help="batched INSERTs or LOAD DATA LOCAL INFILE (default: executemany)")
+    parser.add_argument("--seed", type=int, default=636)
+    args = parser.parse_args()
+
+    import mysql.connector
+    import connect
+
+    connection = mysql.connector.connect(
+        user=connect.dbuser, password=connect.dbpass, host=connect.dbhost, port=connect.dbport,
+        database=args.database or connect.dbname, allow_local_infile=args.method == "infile")
+    started = time.perf_counter()
+    added = generate(connection, borrowers=args.borrowers, books=args.books,
+                     copies_per_book=args.copies_per_book, loans=args.loans,
+                     open_loan_ratio=args.open_loan_ratio, history_years=args.history_years,
+                     method=args.method, seed=args.seed,
+                     progress=lambda message: print(f"{time.perf_counter() - started:8.1f}s  {message}"))
+    connection.close()
+    print(f"Added {added} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,156 @@
 """Implements simple MySQL database connectivity for a Flask web app.
 """
-from flask import Flask, g
+import functools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Flask, g, has_request_context, request, session
+from mysql.connector.errors import Error, PoolError, ProgrammingError
 from mysql.connector.pooling import MySQLConnectionPool
 
-# Pool of reusable database connections (created when calling `init_db`).
-connection_pool: MySQLConnectionPool
+from profiler import ProfilingCursor
+
+# Pool of reusable database connections. `init_db` only records the settings;
+# the pool (which opens all of its connections at once) is created by `get_pool()`
+# when the first connection is needed, so importing the app never waits for MySQL.
+connection_pool: MySQLConnectionPool = None
+_pool_settings: dict = {}
+_pool_create_lock = threading.Lock()
+
+# Optional pool of connections to a read replica (see `init_replica()`), opened on
+# first use like the primary's. Reads of the routes marked with `replica_reads` go
+# there, unless the replica lags too far behind or the session has just written.
+replica_pool: MySQLConnectionPool = None
+_replica_settings: dict = {}
+
+# Replica settings (set by `init_replica`): the most seconds the replica may be
+# behind the primary (None: don't check), and how long a session's reads stay on
+# the primary after it writes, so it sees its own changes.
+_max_replica_lag: float = 5.0
+_sticky_seconds: float = 10.0
+
+# How often (in seconds) the replica's lag is checked. In between, every request
+# uses the last answer. Read it with `replica_status()`.
+LAG_CHECK_INTERVAL = 1.0
+_replica_state = {"checked_at": float("-inf"), "lag": None, "usable": False}
+_replica_lock = threading.Lock()
+
+# Pool settings (set by `init_db`): how long `get_db()` waits for a connection to
+# be returned when all of them are in use, and the age (in seconds) after which a
+# connection is reopened before it is handed out again.
+_checkout_timeout: float = 5.0
+_recycle_after: float = 3600
+
+# Signalled whenever a connection is returned to the pool, to wake up waiting requests.
+_pool_released = threading.Condition()
+
+# When each open primary connection (by MySQL connection id) was first handed out.
+_connection_opened_at: "dict[int, float]" = {}
+
+# Counters describing how the pool is being used. Read them with `pool_stats()`.
+_pool_stats = {
+    "checkouts": 0,            # connections handed out
+    "in_use": 0,               # connections currently handed out
+    "peak_in_use": 0,          # most connections handed out at once
+    "exhaustion_events": 0,    # checkouts that found every connection in use
+    "timeouts": 0,             # checkouts that gave up waiting
+    "wait_seconds_total": 0.0, # time spent waiting for a free connection
+    "wait_seconds_max": 0.0,
+    "recycled": 0,             # connections reopened for being too old
+}
+
+# How long (in seconds) a cached query result stays fresh, and the most results kept
+# in memory at once. The least recently used result is evicted when the cache is full.
+# `invalidate_cache()` only reaches this process; results read from tables with version
+# stamps (see `cached_query()`) are also dropped when another process changes them, but
+# any others may be up to CACHE_TTL seconds out of date there.
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 64
+
+# Cached query results shared by every request in this process, keyed by name.
+# Each value is an `(expires_at, version, rows)` tuple, where `version` is the
+# ETag of the tables the rows were read from (see `cached_query()`).
+_query_cache: "OrderedDict[str, tuple[float, str, list]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+# Version stamps for the tables shown on the read-only pages, one row per table in
+# the table_versions table, so every worker process and the command line tools see
+# (and change) the same ones. Whatever changes a table calls `bump_version()` once
+# its change is committed. A table without a row yet has version 0, changed at
+# `NEVER_CHANGED`. The age of each change (in seconds) is worked out by the database,
+# on the same clock that set `modified`, so the app servers' clocks don't matter.
+TABLE_VERSIONS_QSTR = """
+    SELECT tablename, version, modified, TIMESTAMPDIFF(SECOND, modified, UTC_TIMESTAMP()) AS age
+    FROM table_versions
+    WHERE tablename IN ({})
+    """
+# UTC_TIMESTAMP() has whole-second precision, like HTTP dates
+BUMP_VERSION_QSTR = """
+    INSERT INTO table_versions (tablename, version, modified) VALUES (%s, 1, UTC_TIMESTAMP())
+    ON DUPLICATE KEY UPDATE version = version + 1, modified = UTC_TIMESTAMP()
+    """
+NEVER_CHANGED = datetime(2000, 1, 1, tzinfo=timezone.utc)
+# The tables the pages are built from (see `conditional_get()` in app.py)
+VERSIONED_TABLES = ("books", "borrowers", "loans")
+
+# Every loan, current and archived: returned loans are moved out of the loans table as
+# they age (see archive-loans in app.py), into loans_archive
+ALL_LOANS_QSTR = """(
+        SELECT loanid, bookcopyid, borrowerid, loandate, returned FROM loans
+        UNION ALL
+        SELECT loanid, bookcopyid, borrowerid, loandate, returned FROM loans_archive
+    )"""
+# Per-book loan totals counted from the loans and archived loans tables, used by the
+# rebuild-loan-counts command in app.py and by datagen.py after loading data
+REBUILD_LOAN_COUNTS_QSTR = f"""
+    INSERT INTO bookloancounts (bookid, loancount)
+    SELECT bc.bookid, COUNT(*)
+    FROM {ALL_LOANS_QSTR} l
+    JOIN bookcopies bc ON l.bookcopyid = bc.bookcopyid
+    GROUP BY bc.bookid
+    """
+
+# Named SQL statements (see `register_query()`), and the server-side prepared
+# cursors made for them, keyed by `(server, MySQL connection id)` (the primary and
+# the replica number their connections independently) and then statement name.
+# Each statement is prepared once per pooled connection and reused after that.
+_queries: "dict[str, str]" = {}
+_prepared_cursors: "dict[tuple[str, int], dict]" = {}
+# How often each statement was run and prepared. Read them with `query_stats()`.
+_query_stats: "dict[str, dict]" = {}
+_queries_lock = threading.Lock()
 
 
 def init_db(app: Flask, user: str, password: str, host: str, database: str,
             port: int = 3306, pool_name: str = "flask_db_pool",
-            autocommit: bool = True):
-    """Sets up a MySQL connection pool for the specified Flask app"""
-    # Create a pool of reusable database connections.
-    global connection_pool
-    connection_pool = MySQLConnectionPool(
+            autocommit: bool = True, pool_size: int = 5,
+            checkout_timeout: float = 5.0, recycle_after: float = 3600):
+    """Sets up a MySQL connection pool for the specified Flask app.
+
+    `pool_size` is the number of connections (at most 32). When they are all
+    in use, `get_db()` waits up to `checkout_timeout` seconds for one to be
+    returned. Connections older than `recycle_after` seconds are reopened.
+
+    The pool is opened on first use (or by `warm_pool()`). The pool's own session
+    reset is turned off, as it would drop the statements prepared on each
+    connection (see `register_query()`); `release_connection()` cleans up the
+    session instead."""
+    # Remember the settings for the pool of reusable database connections.
+    global _checkout_timeout, _recycle_after
+    _pool_settings.update(
         user=user,
         password=password,
         host=host,
         database=database,
         port=port,
         pool_name=pool_name,
+        pool_size=pool_size,
+        pool_reset_session=False,
         autocommit=autocommit)
+    _checkout_timeout = checkout_timeout
+    _recycle_after = recycle_after
 
     # Register `close_db()` to run every time the application context is torn
     # down at the end of a Flask request, ensuring that any database connection
@@ -28,19 +158,311 @@ def init_db(app: Flask, user: str, password: str, host: str, database: str,
     app.teardown_appcontext(close_db)
 
 
+def get_pool() -> MySQLConnectionPool:
+    """Returns the connection pool, opening it the first time it is needed."""
+    global connection_pool
+    if connection_pool is None:
+        with _pool_create_lock:
+            if connection_pool is None:
+                connection_pool = MySQLConnectionPool(**_pool_settings)
+    return connection_pool
+
+
+def warm_pool():
+    """Opens the connection pool now rather than on the first request, e.g. so a
+    new worker has its connections ready before it is sent traffic."""
+    get_pool()
+
+
+def init_replica(app: Flask, host: str, port: int = 3306, pool_size: int = 5,
+                 max_lag: float = 5.0, sticky_seconds: float = 10.0):
+    """Sends the reads of the routes marked with `replica_reads` to a read replica
+    at `host`, using the user, password and database given to `init_db()` (call
+    that first).
+
+    The replica is used while it is at most `max_lag` seconds behind the primary,
+    as reported by SHOW REPLICA STATUS (the user needs the REPLICATION CLIENT
+    privilege). With `max_lag=None` the lag isn't checked, e.g. to try the
+    splitting against a second local MySQL server holding a copy of the database.
+    After a request that wrote to the primary, that session reads from the
+    primary for `sticky_seconds`."""
+    global _max_replica_lag, _sticky_seconds
+    _replica_settings.update(
+        _pool_settings,
+        host=host,
+        port=port,
+        pool_name="flask_db_replica_pool",
+        pool_size=pool_size)
+    _max_replica_lag = max_lag
+    _sticky_seconds = sticky_seconds
+
+    app.after_request(stick_to_primary)
+
+
+def get_replica_pool() -> MySQLConnectionPool:
+    """Returns the read replica's connection pool, opening it the first time it
+    is needed."""
+    global replica_pool
+    if replica_pool is None:
+        with _pool_create_lock:
+            if replica_pool is None:
+                replica_pool = MySQLConnectionPool(**_replica_settings)
+    return replica_pool
+
+
+def replica_reads(view):
+    """Marks a read-only route, so `get_read_db()` may serve its queries from the
+    read replica."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def stick_to_primary(response):
+    """Keeps the session's reads on the primary for a while after a request that
+    changed a table (see `bump_version()`) or may have written to it (any request
+    other than GET/HEAD that used it), so e.g. the page shown after saving a book
+    doesn't miss the change."""
+    if g.get("db_wrote") or ("db" in g and request.method not in ("GET", "HEAD", "OPTIONS")):
+        session["db_primary_until"] = time.time() + _sticky_seconds
+    return response
+
+
+def replica_lag(connection):
+    """Returns how many seconds the replica is behind the primary, or `None` if
+    it isn't replicating."""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except ProgrammingError:  # MySQL before 8.0.22
+            cursor.execute("SHOW SLAVE STATUS")
+        status = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not status:
+        return None
+    return status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+
+
+def replica_status():
+    """Returns the result of the last replica lag check: `{"lag": seconds or
+    None, "usable": bool}`, or `None` if there is no replica."""
+    if not _replica_settings:
+        return None
+    with _replica_lock:
+        return {"lag": _replica_state["lag"], "usable": _replica_state["usable"]}
+
+
+def _checkout_replica():
+    """Takes a connection from the replica's pool if the replica is usable (checking
+    its lag if the last check is too old), or returns `None`."""
+    now = time.monotonic()
+    with _replica_lock:
+        check_due = now - _replica_state["checked_at"] >= LAG_CHECK_INTERVAL
+        if not check_due and not _replica_state["usable"]:
+            return None
+        if check_due:
+            # This request checks; the others go on using the last answer meanwhile
+            _replica_state["checked_at"] = now
+
+    try:
+        connection = get_replica_pool().get_connection()
+    except Error:  # the replica is down, or all of its connections are in use
+        if check_due:
+            with _replica_lock:
+                _replica_state.update(lag=None, usable=False)
+        return None
+    if not check_due or _max_replica_lag is None:
+        if check_due:
+            with _replica_lock:
+                _replica_state.update(usable=True)
+        return connection
+
+    try:
+        lag = replica_lag(connection)
+    except Error:
+        lag = None
+    usable = lag is not None and lag <= _max_replica_lag
+    with _replica_lock:
+        _replica_state.update(lag=lag, usable=usable)
+    if not usable:
+        connection.close()
+        return None
+    return connection
+
+
+def get_read_db():
+    """Gets the connection to read from while serving the current Flask request:
+    a read replica connection for routes marked with `replica_reads`, unless there
+    is no usable replica or the session has just written to the primary (see
+    `stick_to_primary()`). Otherwise the primary connection from `get_db()`."""
+    if "replica_db" in g:
+        return g.replica_db
+    if (not _replica_settings or not g.get("db_read_only")
+            or session.get("db_primary_until", 0) > time.time()):
+        return get_db()
+    connection = _checkout_replica()
+    if connection is None:
+        return get_db()
+    g.replica_db = connection
+    return connection
+
+
 def get_db():
     """Gets a MySQL database connection to use while serving the current Flask
     request."""
     if 'db' not in g:
-        g.db = connection_pool.get_connection()
+        started = time.perf_counter()
+        g.db = checkout_connection()
+        # Time taken to get a connection from the pool, for the metrics (see metrics.py)
+        g.pool_wait_seconds = time.perf_counter() - started
     
     return g.db
 
 
-def get_cursor():
+def checkout_connection(timeout: float = None):
+    """Takes a connection from the pool, waiting up to the checkout timeout (or
+    `timeout` seconds) for one to be returned if they are all in use. The pool
+    checks the connection is still alive (reconnecting if not); connections past
+    their recycle age are reopened. Raises `PoolError` if no connection becomes
+    free in time."""
+    timeout = _checkout_timeout if timeout is None else timeout
+    started = time.monotonic()
+    deadline = started + timeout
+    waited = False
+
+    with _pool_released:
+        while True:
+            try:
+                connection = get_pool().get_connection()
+                break
+            except PoolError:
+                if not waited:
+                    waited = True
+                    _pool_stats["exhaustion_events"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    _pool_stats["timeouts"] += 1
+                    raise PoolError(
+                        f"No database connection became free within "
+                        f"{timeout} seconds (pool size "
+                        f"{get_pool().pool_size})") from None
+                _pool_released.wait(remaining)
+
+        wait = time.monotonic() - started
+        _pool_stats["checkouts"] += 1
+        _pool_stats["in_use"] += 1
+        _pool_stats["peak_in_use"] = max(_pool_stats["peak_in_use"], _pool_stats["in_use"])
+        _pool_stats["wait_seconds_total"] += wait
+        _pool_stats["wait_seconds_max"] = max(_pool_stats["wait_seconds_max"], wait)
+
+    # Reopen long-lived connections so server-side state and timeouts don't build up
+    if len(_connection_opened_at) > 2 * get_pool().pool_size:
+        # Forget connections the pool has since replaced (e.g. after reconnecting)
+        _connection_opened_at.clear()
+    opened_at = _connection_opened_at.setdefault(connection.connection_id, time.monotonic())
+    if time.monotonic() - opened_at > _recycle_after:
+        _connection_opened_at.pop(connection.connection_id, None)
+        with _queries_lock:
+            _prepared_cursors.pop(("primary", connection.connection_id), None)
+        try:
+            connection.reconnect()
+        except Error:
+            # Give the slot back (the pool reconnects the connection next time)
+            release_connection(connection)
+            raise
+        _connection_opened_at[connection.connection_id] = time.monotonic()
+        with _pool_released:
+            _pool_stats["recycled"] += 1
+
+    return connection
+
+
+def reset_session(connection, server: str = "primary"):
+    """Puts a connection's session back the way the next request expects it
+    before it goes back to the pool: reads any unread rows, rolls back a
+    transaction left open (e.g. by a route that failed half-way, which would
+    otherwise keep its row locks) and restores autocommit. The app changes no
+    other session state (its isolation levels apply to one transaction only, and
+    it makes no temporary tables or session variables). If the connection is
+    broken it is reopened, dropping its prepared statements."""
+    try:
+        connection.consume_results()
+        if connection.in_transaction:
+            connection.rollback()
+        # Setting autocommit on the pool's PooledMySQLConnection wrapper would only
+        # give the wrapper an attribute, so set it on the connection it wraps
+        session = getattr(connection, "_cnx", connection)
+        if session.autocommit != _pool_settings.get("autocommit", True):
+            session.autocommit = _pool_settings.get("autocommit", True)
+    except Error:
+        with _queries_lock:
+            _prepared_cursors.pop((server, connection.connection_id), None)
+        try:
+            connection.reconnect()
+        except Error:
+            pass  # the pool reconnects it when it is next handed out
+
+
+def release_connection(connection):
+    """Returns a connection taken with `checkout_connection()` to the pool,
+    after cleaning up its session (see `reset_session()`)."""
+    try:
+        reset_session(connection)
+        connection.close()
+    finally:
+        with _pool_released:
+            _pool_stats["in_use"] -= 1
+            _pool_released.notify()
+
+
+def pool_stats():
+    """Returns a snapshot of the connection pool's usage counters, for tuning
+    the pool size and checkout timeout."""
+    with _pool_released:
+        stats = dict(_pool_stats)
+    stats["pool_size"] = _pool_settings.get("pool_size", 0)
+    stats["wait_seconds_avg"] = (
+        stats["wait_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0)
+    return stats
+
+
+def get_cursor(dictionary: bool = True, primary: bool = False):
     """Gets a new MySQL dictionary cursor to use while serving the current
-    Flask request."""
-    return get_db().cursor(dictionary=True)
+    Flask request. Its queries are timed by the profiler (see profiler.py).
+    With `dictionary=False` rows are plain tuples, which are cheaper to build
+    when the column names aren't needed for every row.
+
+    In routes marked with `replica_reads` the cursor reads from the replica (see
+    `get_read_db()`); `primary=True` always uses the primary, e.g. for a read
+    that must see the latest writes."""
+    connection = get_db() if primary else get_read_db()
+    return ProfilingCursor(connection.cursor(dictionary=dictionary))
+
+
+def stream_rows(query: str, params: tuple = (), batch_size: int = 500):
+    """Yields the rows of `query` one at a time (as dictionaries) while reading
+    them from the server in batches, instead of loading the whole result set
+    into memory. The connection is busy until the generator is finished, so
+    don't run other queries in the same request while iterating."""
+    connection = get_read_db()
+    cursor = ProfilingCursor(connection.cursor(dictionary=True, buffered=False))
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        # If the caller stopped early (e.g. the browser disconnected), read and
+        # discard the remaining rows so the connection can go back to the pool.
+        connection.consume_results()
+        cursor.close()
 
 
 def close_db(exception = None):
@@ -51,4 +473,207 @@ def close_db(exception = None):
     db = g.pop('db', None)
     
     if db is not None:
-        db.close()
\ No newline at end of file
+        release_connection(db)
+
+    replica_db = g.pop('replica_db', None)
+    if replica_db is not None:
+        try:
+            reset_session(replica_db, "replica")
+        finally:
+            replica_db.close()
+
+
+def get_cached(key: str, version: str = None):
+    """Returns the cached rows stored under `key`, or `None` if there are none,
+    they have expired or they were read at another `version`."""
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is None or entry[0] <= time.monotonic() or entry[1] != version:
+            return None
+        _query_cache.move_to_end(key)
+        return entry[2]
+
+
+def set_cached(key: str, rows: list, version: str = None):
+    """Stores `rows`, read at `version`, in the cache under `key`, evicting the
+    least recently used results if the cache is full."""
+    with _query_cache_lock:
+        _query_cache[key] = (time.monotonic() + CACHE_TTL, version, rows)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > CACHE_MAX_ENTRIES:
+            _query_cache.popitem(last=False)
+
+
+def cached_query(key: str, query: str, params: tuple = (), tables: tuple = ()):
+    """Returns all rows for `query`, reusing the result stored under `key` if it
+    is still fresh, otherwise running the query and caching the rows.
+
+    Intended for small reference lists (e.g. dropdown data). Routes that change
+    the underlying table must call `invalidate_cache(key)` afterwards. If the
+    query reads `tables` with version stamps, a change made by another process
+    (see `bump_version()`) also makes the next call read fresh rows; this costs
+    one primary key lookup of table_versions per request."""
+    version = table_versions(*tables)[0] if tables else None
+    rows = get_cached(key, version)
+    if rows is None:
+        # Always from the primary: a stale replica row would stay cached long after
+        # the replica caught up
+        cursor = get_cursor(primary=True)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        set_cached(key, rows, version)
+
+    return rows
+
+
+def invalidate_cache(*keys: str):
+    """Removes the cached results stored under `keys` so the next
+    `cached_query()` call reads fresh rows from the database."""
+    with _query_cache_lock:
+        for key in keys:
+            _query_cache.pop(key, None)
+
+
+def bump_version(*tables: str, connection=None):
+    """Records that the rows of `tables` have changed, so pages built from them
+    get a new ETag and Last-Modified date in every process (and the session's
+    next reads come from the primary, see `stick_to_primary()`). Call it after
+    the change is committed: a page read in between then only gets an ETag that
+    is about to change, never a new ETag for old rows. Uses the request's
+    primary connection, or `connection` (e.g. in a command line tool)."""
+    if has_request_context():
+        g.db_wrote = True
+        g.pop("table_stamps", None)
+    if connection is None:
+        connection = get_db()
+    cursor = connection.cursor()
+    try:
+        for table in tables:
+            cursor.execute(BUMP_VERSION_QSTR, (table,))
+        if not connection.autocommit:
+            connection.commit()
+    finally:
+        cursor.close()
+
+
+def version_stamps(tables, rows) -> "dict[str, tuple[int, datetime, int]]":
+    """Returns `{table: (version, last_modified, age in seconds)}` for `tables`
+    from the rows of `TABLE_VERSIONS_QSTR` (dictionaries). A table that has never
+    changed has no age (`None`)."""
+    stamps = {table: (0, NEVER_CHANGED, None) for table in tables}
+    for row in rows:
+        # DATETIME columns come back without a time zone; these are in UTC
+        stamps[row["tablename"]] = (
+            row["version"], row["modified"].replace(tzinfo=timezone.utc), row["age"])
+    return stamps
+
+
+def versions_etag(tables, stamps):
+    """Returns `(etag, last_modified)` for a page built from `tables`: the ETag
+    changes whenever any of them does, and `last_modified` is the latest change."""
+    etag = "-".join(str(stamps[table][0]) for table in tables)
+    return etag, max(stamps[table][1] for table in tables)
+
+
+def _table_stamps(tables):
+    """Reads the version stamps of `tables` from the primary, once per request."""
+    known = g.setdefault("table_stamps", {})
+    missing = [table for table in tables if table not in known]
+    if missing:
+        cursor = get_cursor(primary=True)
+        cursor.execute(TABLE_VERSIONS_QSTR.format(", ".join(["%s"] * len(missing))), missing)
+        known.update(version_stamps(missing, cursor.fetchall()))
+        cursor.close()
+    return known
+
+
+def table_versions(*tables: str):
+    """Returns `(etag, last_modified)` for a page built from `tables` (see
+    `versions_etag()`)."""
+    return versions_etag(tables, _table_stamps(tables))
+
+
+def stamps_may_be_stale(tables, stamps) -> bool:
+    """Returns whether `tables`, with these version stamps, changed too recently
+    for the replica to be sure to have the change."""
+    ages = [stamps[table][2] for table in tables if stamps[table][2] is not None]
+    # Ages are rounded down to whole seconds
+    return bool(ages) and min(ages) < _sticky_seconds + 1
+
+
+def read_may_be_stale(*tables: str) -> bool:
+    """Returns whether the current request read from the replica while `tables`
+    changed too recently for the replica to be sure to have the change, in which
+    case what was built from the rows shouldn't be cached under the new versions."""
+    if "replica_db" not in g:
+        return False
+    return stamps_may_be_stale(tables, _table_stamps(tables))
+
+
+def register_query(name: str, query: str) -> str:
+    """Gives `query` a name to run it by with `run_query()`, `run_query_one()`
+    or `run_statement()`, and returns the name. Registering the same name again
+    with different SQL raises `ValueError`."""
+    with _queries_lock:
+        if _queries.setdefault(name, query) != query:
+            raise ValueError(f"A different query is already registered as {name!r}")
+        _query_stats.setdefault(name, {"executions": 0, "prepares": 0})
+    return name
+
+
+def prepared_cursor(name: str):
+    """Gets the prepared dictionary cursor for the named statement on the current
+    request's connection (the replica's in routes marked with `replica_reads`),
+    creating it the first time the statement is run on that connection. Its
+    queries are timed by the profiler like any other."""
+    connection = get_read_db()
+    if connection is g.get("replica_db"):
+        server, pool = "replica", replica_pool
+    else:
+        server, pool = "primary", connection_pool
+    with _queries_lock:
+        server_keys = [key for key in _prepared_cursors if key[0] == server]
+        if len(server_keys) > 2 * pool.pool_size:
+            # Forget connections the pool has since replaced (e.g. after reconnecting)
+            for key in server_keys:
+                del _prepared_cursors[key]
+        cursors = _prepared_cursors.setdefault((server, connection.connection_id), {})
+        cursor = cursors.get(name)
+        if cursor is None:
+            cursor = connection.cursor(prepared=True, dictionary=True)
+            cursors[name] = cursor
+            _query_stats[name]["prepares"] += 1
+        _query_stats[name]["executions"] += 1
+    return ProfilingCursor(cursor)
+
+
+def run_statement(name: str, params: tuple = ()):
+    """Runs the named statement with `params` and returns its cursor, e.g. for
+    `rowcount` or `lastrowid` after an INSERT or UPDATE. Don't close it: it is
+    reused by later calls on the same connection."""
+    cursor = prepared_cursor(name)
+    cursor.execute(_queries[name], params)
+    return cursor
+
+
+def run_query(name: str, params: tuple = ()) -> list:
+    """Runs the named query with `params` and returns all of its rows."""
+    return run_statement(name, params).fetchall()
+
+
+def run_query_one(name: str, params: tuple = ()):
+    """Runs the named query with `params` and returns its first row, or `None`."""
+    rows = run_query(name, params)
+    return rows[0] if rows else None
+
+
+def query_stats():
+    """Returns how many times each named statement has run and how many times it
+    had to be prepared; every other run reused an already prepared statement."""
+    with _queries_lock:
+        stats = {name: dict(counts, sql=" ".join(_queries[name].split()))
+                 for name, counts in _query_stats.items()}
+    for counts in stats.values():
+        counts["reuses"] = counts["executions"] - counts["prepares"]
+    return stats
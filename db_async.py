@@ -0,0 +1,149 @@
+"""Implements non-blocking MySQL database connectivity for the async (ASGI)
+version of the web app, with the same `get_db()`/`get_cursor()`/`close_db()`
+contract as db.py (except that they must be awaited).
+"""
+import aiomysql
+from quart import Quart, g
+
+import db
+
+# Pool of reusable database connections (created when the app starts serving).
+connection_pool: aiomysql.Pool
+
+
+def init_db(app: Quart, user: str, password: str, host: str, database: str,
+            port: int = 3306, pool_size: int = 5, recycle_after: float = 3600,
+            autocommit: bool = True):
+    """Sets up an async MySQL connection pool for the specified Quart app, with
+    the same settings as `db.init_db()`."""
+
+    # The pool must be created inside the server's event loop, so open it when
+    # the app starts serving and close it when the app shuts down.
+    @app.before_serving
+    async def open_pool():
+        global connection_pool
+        connection_pool = await aiomysql.create_pool(
+            user=user,
+            password=password,
+            host=host,
+            db=database,
+            port=port,
+            maxsize=pool_size,
+            pool_recycle=recycle_after,
+            autocommit=autocommit)
+
+    @app.after_serving
+    async def close_pool():
+        connection_pool.close()
+        await connection_pool.wait_closed()
+
+    # Release the request's connection (if any) back into the pool at the end
+    # of every request.
+    app.teardown_appcontext(close_db)
+
+
+async def get_db():
+    """Gets a MySQL database connection to use while serving the current
+    request."""
+    if 'db' not in g:
+        g.db = await connection_pool.acquire()
+
+    return g.db
+
+
+async def get_cursor():
+    """Gets a new MySQL dictionary cursor to use while serving the current
+    request."""
+    return await (await get_db()).cursor(aiomysql.DictCursor)
+
+
+async def close_db(exception = None):
+    """Releases the MySQL database connection associated with the current
+    request (if any) back into the pool, rolling back any transaction it left
+    open (as `db.reset_session()` does), so its row locks are released and the
+    pool keeps the connection instead of closing it."""
+    db_connection = g.pop('db', None)
+
+    if db_connection is not None:
+        try:
+            if db_connection.get_transaction_status():
+                await db_connection.rollback()
+        except aiomysql.Error:
+            db_connection.close()  # the pool drops closed connections
+        connection_pool.release(db_connection)
+
+
+async def query_all(query: str, params: tuple = ()):
+    """Returns all rows for `query` using a connection of its own, so several
+    independent queries can run at the same time with `asyncio.gather()`."""
+    async with connection_pool.acquire() as connection:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+
+async def cached_query(key: str, query: str, params: tuple = (), tables: tuple = ()):
+    """Async version of `db.cached_query()`, sharing the same in-process cache
+    (and so the same invalidations) as the synchronous routes."""
+    version = (await table_versions(*tables))[0] if tables else None
+    rows = db.get_cached(key, version)
+    if rows is None:
+        rows = await query_all(query, params)
+        db.set_cached(key, rows, version)
+    return rows
+
+
+async def _table_stamps(tables):
+    """Async version of `db._table_stamps()`: reads the version stamps of
+    `tables` once per request."""
+    known = g.setdefault("table_stamps", {})
+    missing = [table for table in tables if table not in known]
+    if missing:
+        placeholders = ", ".join(["%s"] * len(missing))
+        rows = await query_all(db.TABLE_VERSIONS_QSTR.format(placeholders), missing)
+        known.update(db.version_stamps(missing, rows))
+    return known
+
+
+async def table_versions(*tables: str):
+    """Async version of `db.table_versions()`, reading the same table_versions
+    rows (so the Flask app's writes change these pages' ETags too)."""
+    return db.versions_etag(tables, await _table_stamps(tables))
+
+
+async def read_may_be_stale(*tables: str) -> bool:
+    """Async version of `db.read_may_be_stale()`. The async routes read from the
+    primary, so this is only true once they read from a replica too."""
+    if "replica_db" not in g:
+        return False
+    return db.stamps_may_be_stale(tables, await _table_stamps(tables))
+
+
+async def bump_version(*tables: str):
+    """Async version of `db.bump_version()`, on the request's connection."""
+    g.pop("table_stamps", None)
+    connection = await get_db()
+    async with connection.cursor() as cursor:
+        for table in tables:
+            await cursor.execute(db.BUMP_VERSION_QSTR, (table,))
+    if not connection.get_autocommit():
+        await connection.commit()
+
+
+async def stream_rows(query: str, params: tuple = (), batch_size: int = 500):
+    """Async version of `db.stream_rows()`: yields the rows of `query` one at a
+    time while reading them from the server in batches."""
+    connection = await get_db()
+    cursor = await connection.cursor(aiomysql.SSDictCursor)
+    try:
+        await cursor.execute(query, params)
+        while True:
+            rows = await cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        # Closing an unbuffered cursor reads and discards any remaining rows,
+        # so the connection can go back to the pool.
+        await cursor.close()
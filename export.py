@@ -0,0 +1,83 @@
+"""Writes query results as CSV or NDJSON, one row at a time.
+
+The functions here take an iterator of rows (dictionaries, e.g. from
+`db.stream_rows()`) and yield the encoded output in chunks, optionally gzip
+compressed, so an export of any size is produced in constant memory. They are
+used by the /export routes and the `flask export` command in app.py.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+# Output formats: name -> (file extension, content type)
+FORMATS = {
+    "csv": ("csv", "text/csv; charset=utf-8"),
+    "ndjson": ("ndjson", "application/x-ndjson"),
+}
+
+# Encoded output is collected into chunks of about this many bytes before being
+# sent on, so the response isn't written one tiny row at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+def _plain_value(value):
+    """Converts the values MySQL returns into text (CSV) or JSON-friendly values."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def csv_lines(rows):
+    """Yields CSV text for `rows`: a header line taken from the first row's
+    keys, then one line per row. Yields nothing if there are no rows."""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow({key: _plain_value(value) for key, value in row.items()})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def ndjson_lines(rows):
+    """Yields one line of JSON per row."""
+    for row in rows:
+        yield json.dumps({key: _plain_value(value) for key, value in row.items()}) + "\n"
+
+
+def encode(lines, compress: bool = False):
+    """Encodes `lines` as UTF-8 (gzip compressed if `compress`) and yields the
+    result in chunks of about `CHUNK_SIZE` bytes."""
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending = []
+    pending_size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= CHUNK_SIZE:
+            yield b"".join(pending)
+            pending = []
+            pending_size = 0
+    if compressor:
+        pending.append(compressor.flush())
+    if pending:
+        yield b"".join(pending)
+
+
+def export_rows(rows, output_format: str, compress: bool = False):
+    """Yields `rows` encoded in `output_format` ("csv" or "ndjson")."""
+    lines = csv_lines(rows) if output_format == "csv" else ndjson_lines(rows)
+    return encode(lines, compress)
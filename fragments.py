@@ -0,0 +1,105 @@
+"""Caches rendered pieces of HTML (fragments) that many pages repeat.
+
+The book cards on the home page and the details table on the book page are
+rendered from the same book row over and over, so the rendered HTML is kept
+in an in-process LRU cache. Each fragment is stored under the name of its
+template, the object it shows (e.g. book 12) and the version of the table
+the object comes from. That version is the one in the database's
+table_versions table (see db.bump_version()), which also gives the pages
+their ETags, so once a book changes no worker process uses the old HTML,
+whichever process made the change.
+
+With a shared directory (see `init_fragment_cache()`) the fragments are also
+kept as files, so every worker process can reuse HTML rendered by the others.
+Each object has one file per template, which is overwritten when it is
+rendered for a newer version.
+"""
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Most fragments kept in memory at once. The least recently used one is evicted
+# when the cache is full.
+FRAGMENT_CACHE_MAX_ENTRIES = 256
+
+# Directory shared by all worker processes, or None to keep fragments in memory only.
+shared_dir: str = None
+
+# Rendered HTML, keyed by `fragment_key()`.
+_fragments: "OrderedDict[str, str]" = OrderedDict()
+_fragments_lock = threading.Lock()
+
+
+def init_fragment_cache(max_entries: int = 256, directory: str = None):
+    """Sets the size of the in-memory cache and, if `directory` is given, also
+    stores fragments there so that other worker processes can reuse them."""
+    global FRAGMENT_CACHE_MAX_ENTRIES, shared_dir
+    FRAGMENT_CACHE_MAX_ENTRIES = max_entries
+    shared_dir = directory
+    if shared_dir:
+        os.makedirs(shared_dir, exist_ok=True)
+
+
+def fragment_key(template: str, kind: str, object_id, version) -> str:
+    """Returns the cache key for `template` rendered for an object (e.g. a book)
+    when its table is at `version`."""
+    template_name = os.path.splitext(template)[0].replace("/", "_")
+    return f"{kind}-{int(object_id)}-{template_name}@{version}"
+
+
+def _fragment_path(key: str) -> str:
+    """File holding the latest fragment rendered for the object and template of
+    `key`. Its first line is the key, so a file for an older version is ignored."""
+    return os.path.join(shared_dir, key.rsplit("@", 1)[0] + ".html")
+
+
+def _write_file(path: str, text: str):
+    """Writes `text` to `path` so other processes never see a half-written file."""
+    fd, temp_path = tempfile.mkstemp(dir=shared_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, path)
+    except OSError:
+        os.unlink(temp_path)
+        raise
+
+
+def _read_file(path: str):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def get_fragment(key: str):
+    """Returns the HTML stored under `key`, or `None` if it isn't cached."""
+    with _fragments_lock:
+        html = _fragments.get(key)
+        if html is not None:
+            _fragments.move_to_end(key)
+            return html
+
+    if shared_dir:
+        stored_key, _newline, html = (_read_file(_fragment_path(key)) or "").partition("\n")
+        if stored_key == key:
+            _remember(key, html)
+            return html
+    return None
+
+
+def set_fragment(key: str, html: str):
+    """Stores rendered `html` under `key`."""
+    _remember(key, html)
+    if shared_dir:
+        _write_file(_fragment_path(key), f"{key}\n{html}")
+
+
+def _remember(key: str, html: str):
+    with _fragments_lock:
+        _fragments[key] = html
+        _fragments.move_to_end(key)
+        while len(_fragments) > FRAGMENT_CACHE_MAX_ENTRIES:
+            _fragments.popitem(last=False)
@@ -10,6 +10,10 @@ CREATE SCHEMA library;
 
 USE library;
 
+-- The ngram parser leaves out every ngram holding a stopword (e.g. the "an" of Dan), so
+-- the borrowers FULLTEXT indexes are made without the stopword list (see migration 0004)
+SET SESSION innodb_ft_enable_stopword = OFF;
+
 CREATE TABLE borrowers (
   borrowerid int NOT NULL AUTO_INCREMENT,
   firstname varchar(45) NOT NULL,
@@ -19,7 +23,12 @@ CREATE TABLE borrowers (
   suburb varchar(25) DEFAULT NULL,
   city varchar(25) DEFAULT NULL,
   postcode varchar(4) DEFAULT NULL,
-  PRIMARY KEY (borrowerid)
+  PRIMARY KEY (borrowerid),
+  KEY borrowername_idx (familyname, firstname),
+  -- ngram FULLTEXT indexes let name searches match anywhere in a name without a full table scan
+  FULLTEXT KEY firstname_ft (firstname) WITH PARSER ngram,
+  FULLTEXT KEY familyname_ft (familyname) WITH PARSER ngram,
+  FULLTEXT KEY borrowername_ft (firstname, familyname) WITH PARSER ngram
 );
 
 CREATE TABLE categories (
@@ -36,6 +45,7 @@ CREATE TABLE books (
   description longtext,
   image varchar(50) DEFAULT NULL,
   PRIMARY KEY (bookid),
+  KEY booktitle_idx (booktitle),
   CONSTRAINT FK_Category FOREIGN KEY (bookcategory) REFERENCES categories (category)
 );
 
@@ -44,7 +54,8 @@ CREATE TABLE bookcopies (
   bookid int NOT NULL,
   format varchar(12) NOT NULL,
   PRIMARY KEY (bookcopyid),
-  KEY bookid_idx (bookid),
+  -- A checkout takes the first free copy of a book in the wanted format from this index
+  KEY bookformat_idx (bookid, format, bookcopyid),
   CONSTRAINT bookid FOREIGN KEY (bookid) REFERENCES books (bookid) ON DELETE CASCADE
 );
 
@@ -55,12 +66,60 @@ CREATE TABLE loans (
   loandate date NOT NULL,
   returned date DEFAULT NULL,
   PRIMARY KEY (loanid),
-  KEY borrowedbook_idx (bookcopyid),
-  KEY borrower_idx (borrowerid),
+  KEY borrowedbook_idx (bookcopyid, returned),
+  -- A borrower's loans newest first, for the loans-by-borrower page
+  KEY borrowerloans_idx (borrowerid, loandate),
+  -- Open loans by loan date, so the overdue loans are one range of this index
+  KEY openloans_idx (returned, loandate),
   CONSTRAINT borrowedbook FOREIGN KEY (bookcopyid) REFERENCES bookcopies (bookcopyid),
   CONSTRAINT borrower FOREIGN KEY (borrowerid) REFERENCES borrowers (borrowerid)
 );
 
+-- Returned loans moved out of the loans table once they are old, so the pages and the
+-- open-loan lookups only read recent rows. Same columns as loans, so the two can be read
+-- together with UNION ALL. Move loans here with:  flask --app app archive-loans
+CREATE TABLE loans_archive (
+  loanid int NOT NULL,
+  bookcopyid int NOT NULL,
+  borrowerid int NOT NULL,
+  loandate date NOT NULL,
+  returned date NOT NULL,
+  PRIMARY KEY (loanid),
+  KEY archivedbook_idx (bookcopyid),
+  KEY archivedborrowerloans_idx (borrowerid, loandate),
+  CONSTRAINT archivedbook FOREIGN KEY (bookcopyid) REFERENCES bookcopies (bookcopyid),
+  CONSTRAINT archivedborrower FOREIGN KEY (borrowerid) REFERENCES borrowers (borrowerid)
+);
+
+-- Running total of loans per book, kept up to date by the loan() route so the home page
+-- can read the most popular books from an index instead of counting the whole loans table.
+-- Rebuild it at any time with:  flask --app app rebuild-loan-counts
+CREATE TABLE bookloancounts (
+  bookid int NOT NULL,
+  loancount int NOT NULL DEFAULT 0,
+  PRIMARY KEY (bookid),
+  KEY loancount_idx (loancount),
+  CONSTRAINT loancountbook FOREIGN KEY (bookid) REFERENCES books (bookid) ON DELETE CASCADE
+);
+
+-- Version stamps of the tables the pages are built from, shared by every worker process
+-- and command (see db.bump_version()); they make the pages' ETags and Last-Modified dates
+CREATE TABLE table_versions (
+  tablename varchar(64) NOT NULL,
+  version bigint NOT NULL DEFAULT 0,
+  modified datetime NOT NULL,
+  PRIMARY KEY (tablename)
+);
+
+-- Schema changes already applied to this database (see migrations.py). Bring a database
+-- made from an older copy of this script up to date with:  flask --app app migrate
+CREATE TABLE schema_migrations (
+  version int NOT NULL,
+  name varchar(100) NOT NULL,
+  applied_at datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (version)
+);
+
 INSERT INTO categories (category) VALUES 
   ('Fiction'),
   ('Picture Book'),
@@ -177,3 +236,22 @@ INSERT INTO loans VALUES(53678, 402,  7523, @mid_semester_date - INTERVAL 14 DAY
 INSERT INTO loans VALUES(53679, 93,   7523, @mid_semester_date - INTERVAL 12 DAY,  NULL);         -- 2025-08-01
 
 
+-- Backfill the per-book loan totals from the loans inserted above
+INSERT INTO bookloancounts (bookid, loancount)
+SELECT bc.bookid, COUNT(*)
+FROM loans l
+JOIN bookcopies bc ON l.bookcopyid = bc.bookcopyid
+GROUP BY bc.bookid;
+
+-- Every migration in migrations/ is already part of the tables above
+INSERT INTO schema_migrations (version, name) VALUES
+(1, 'book_loan_counts'),
+(2, 'list_sort_indexes'),
+(3, 'open_loans_by_copy_index'),
+(4, 'borrower_name_fulltext'),
+(5, 'open_loans_by_date_index'),
+(6, 'loans_archive'),
+(7, 'copies_by_format_index'),
+(8, 'borrower_loans_index'),
+(9, 'table_versions'),
+(10, 'name_fulltext_without_stopwords');
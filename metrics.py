@@ -0,0 +1,193 @@
+"""Collects per-route request metrics and writes them in Prometheus text format.
+
+Each request's total time is split into phases: waiting for a database
+connection from the pool (see `db.get_db()`), running queries (summed by the
+profiler, see profiler.py) and rendering templates (timed with Flask's
+template signals). Every phase is counted in a latency histogram per route,
+along with request counts by status and error counts. The registry lives in
+this process, like the other caches and counters in the app.
+"""
+import threading
+import time
+
+from flask import Flask, g, request
+from flask import before_render_template, template_rendered
+
+import db
+import profiler
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Histograms keyed by `(route, phase)`. Each value is a `[bucket counts, sum, count]`
+# list, where bucket i counts the requests no slower than BUCKETS[i] (not cumulative).
+_histograms: "dict[tuple[str, str], list]" = {}
+# Requests keyed by `(route, method, status)`, and failed requests keyed by route.
+_requests: "dict[tuple[str, str, str], int]" = {}
+_errors: "dict[str, int]" = {}
+_metrics_lock = threading.Lock()
+
+
+def init_metrics(app: Flask):
+    """Starts recording request metrics for the specified Flask app."""
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(record_request)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+
+
+def start_request():
+    g.metrics_started = time.perf_counter()
+    g.render_seconds = 0.0
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def start_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def finish_render(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        g.render_seconds = g.get("render_seconds", 0.0) + time.perf_counter() - started
+
+
+def _observe(route: str, phase: str, seconds: float):
+    histogram = _histograms.setdefault((route, phase), [[0] * len(BUCKETS), 0.0, 0])
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram[0][i] += 1
+            break
+    histogram[1] += seconds
+    histogram[2] += 1
+
+
+def record_request(exception=None):
+    """Adds the finished request to its route's counters and histograms"""
+    started = g.get("metrics_started")
+    if started is None:
+        return
+    total = time.perf_counter() - started
+    _count, db_seconds = profiler.request_totals()
+    route = request.endpoint or "<unknown>"
+    status = "500" if exception is not None else str(g.get("metrics_status", 500))
+
+    with _metrics_lock:
+        key = (route, request.method, status)
+        _requests[key] = _requests.get(key, 0) + 1
+        if status.startswith("5"):
+            _errors[route] = _errors.get(route, 0) + 1
+        _observe(route, "total", total)
+        _observe(route, "pool", g.get("pool_wait_seconds", 0.0))
+        _observe(route, "db", db_seconds)
+        _observe(route, "render", g.get("render_seconds", 0.0))
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+def render_metrics() -> str:
+    """Returns every metric in the Prometheus text exposition format."""
+    with _metrics_lock:
+        requests = dict(_requests)
+        errors = dict(_errors)
+        histograms = {key: [list(counts), total, count]
+                      for key, (counts, total, count) in _histograms.items()}
+    pool = db.pool_stats()
+
+    lines = [
+        "# HELP library_requests_total Requests served, by route, method and status.",
+        "# TYPE library_requests_total counter",
+    ]
+    for (route, method, status), value in sorted(requests.items()):
+        lines.append(f"library_requests_total{_labels(route=route, method=method, status=status)} {value}")
+
+    lines += [
+        "# HELP library_request_errors_total Requests that failed with a server error, by route.",
+        "# TYPE library_request_errors_total counter",
+    ]
+    for route, value in sorted(errors.items()):
+        lines.append(f"library_request_errors_total{_labels(route=route)} {value}")
+
+    lines += [
+        "# HELP library_request_duration_seconds Request latency by route and phase "
+        "(total, pool wait, db queries, template rendering).",
+        "# TYPE library_request_duration_seconds histogram",
+    ]
+    for (route, phase), (counts, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f"library_request_duration_seconds_bucket"
+                         f"{_labels(route=route, phase=phase, le=bound)} {cumulative}")
+        lines.append(f"library_request_duration_seconds_bucket"
+                     f"{_labels(route=route, phase=phase, le='+Inf')} {count}")
+        lines.append(f"library_request_duration_seconds_sum{_labels(route=route, phase=phase)} {total}")
+        lines.append(f"library_request_duration_seconds_count{_labels(route=route, phase=phase)} {count}")
+
+    # Queries run by each route, as summed by the profiler (see profiler.route_stats())
+    routes = profiler.route_stats()
+    for name, metric, help_text in [
+        ("queries", "library_route_db_queries_total", "Database queries run, by route."),
+        ("db_seconds", "library_route_db_seconds_total", "Time spent on database queries, by route."),
+        ("slow_queries", "library_route_slow_queries_total",
+         "Queries that reached the slow-query threshold, by route."),
+    ]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for route, stats in sorted(routes.items()):
+            lines.append(f"{metric}{_labels(route=route)} {stats[name]}")
+
+    # Connection pool usage (see db.pool_stats())
+    for name, kind, help_text in [
+        ("pool_size", "gauge", "Connections in the pool."),
+        ("in_use", "gauge", "Connections currently handed out."),
+        ("peak_in_use", "gauge", "Most connections handed out at once."),
+        ("checkouts", "counter", "Connections handed out."),
+        ("exhaustion_events", "counter", "Checkouts that found every connection in use."),
+        ("timeouts", "counter", "Checkouts that gave up waiting for a connection."),
+        ("wait_seconds_total", "counter", "Time spent waiting for a free connection."),
+        ("recycled", "counter", "Connections reopened for being too old."),
+    ]:
+        metric = f"library_db_pool_{name}"
+        if kind == "counter" and not metric.endswith("_total"):
+            metric += "_total"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}", f"{metric} {pool[name]}"]
+
+    # Whether reads go to the read replica, and how far behind it was at the last check
+    # (see db.replica_status())
+    replica = db.replica_status()
+    if replica is not None:
+        lines += [
+            "# HELP library_db_replica_usable Whether read-only routes are reading from the replica.",
+            "# TYPE library_db_replica_usable gauge",
+            f"library_db_replica_usable {int(replica['usable'])}",
+        ]
+        if replica["lag"] is not None:
+            lines += [
+                "# HELP library_db_replica_lag_seconds Replica lag behind the primary at the last check.",
+                "# TYPE library_db_replica_lag_seconds gauge",
+                f"library_db_replica_lag_seconds {replica['lag']}",
+            ]
+
+    # Named statements and how often their prepared statements were reused (see db.query_stats())
+    statements = db.query_stats()
+    for name, help_text in [
+        ("executions", "Runs of each named statement."),
+        ("prepares", "Times each named statement was prepared on a connection."),
+    ]:
+        metric = f"library_prepared_statement_{name}_total"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for statement, counts in sorted(statements.items()):
+            lines.append(f"{metric}{_labels(statement=statement)} {counts[name]}")
+
+    return "\n".join(lines) + "\n"
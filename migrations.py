@@ -0,0 +1,89 @@
+"""Applies versioned schema changes to an existing library database.
+
+library-local.sql and library-pa.sql create the current schema from scratch,
+which loses the data in it. A database made from an older copy of them is
+brought up to date instead by the numbered scripts in migrations/, named
+`NNNN_description.sql` and applied in order. Each applied version is recorded
+in the schema_migrations table, so `flask --app app migrate` only runs the
+new ones and can be run on every deploy, locally and on PythonAnywhere alike.
+The two .sql files record every migration they already include as applied.
+
+MySQL commits each schema change as it runs, so a migration can't be rolled
+back half-way. Statements whose change is already there (a table or index
+that exists, an index already dropped) are skipped instead, so a migration
+that stopped part of the way through can simply be run again.
+"""
+import os
+import re
+
+from mysql.connector import errorcode
+from mysql.connector.errors import DatabaseError
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Errors meaning a statement's change has already been made
+ALREADY_APPLIED_ERRORS = {
+    errorcode.ER_TABLE_EXISTS_ERROR,
+    errorcode.ER_DUP_FIELDNAME,
+    errorcode.ER_DUP_KEYNAME,
+    errorcode.ER_CANT_DROP_FIELD_OR_KEY,
+}
+
+CREATE_MIGRATIONS_TABLE_QSTR = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+      version int NOT NULL,
+      name varchar(100) NOT NULL,
+      applied_at datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (version)
+    )
+    """
+
+
+def available_migrations():
+    """Returns the migration scripts as (version, name, path) tuples, in order."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2),
+                               os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def applied_versions(cursor) -> "set[int]":
+    """Returns the versions already applied to the database."""
+    cursor.execute(CREATE_MIGRATIONS_TABLE_QSTR)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row["version"] for row in cursor.fetchall()}
+
+
+def pending_migrations(cursor):
+    """Returns the migrations not yet applied, in order."""
+    applied = applied_versions(cursor)
+    return [migration for migration in available_migrations() if migration[0] not in applied]
+
+
+def statements(script: str):
+    """Splits a migration script into statements (separated by a `;` at the end
+    of a line), leaving out `--` comment lines."""
+    lines = [line for line in script.splitlines() if not line.lstrip().startswith("--")]
+    for statement in re.split(r";\s*$", "\n".join(lines), flags=re.MULTILINE):
+        if statement.strip():
+            yield statement.strip()
+
+
+def apply_migration(cursor, version: int, name: str, path: str) -> int:
+    """Runs one migration script and records it as applied. Returns how many
+    statements were skipped because their change was already there."""
+    with open(path, encoding="utf-8") as script_file:
+        script = script_file.read()
+    skipped = 0
+    for statement in statements(script):
+        try:
+            cursor.execute(statement)
+        except DatabaseError as error:
+            if error.errno not in ALREADY_APPLIED_ERRORS:
+                raise
+            skipped += 1
+    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+    return skipped
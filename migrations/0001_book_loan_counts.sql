@@ -0,0 +1,20 @@
+-- Running total of loans per book for the home page's most popular books
+-- (kept up to date by the loan routes; see rebuild-loan-counts)
+CREATE TABLE bookloancounts (
+  bookid int NOT NULL,
+  loancount int NOT NULL DEFAULT 0,
+  PRIMARY KEY (bookid),
+  KEY loancount_idx (loancount),
+  CONSTRAINT loancountbook FOREIGN KEY (bookid) REFERENCES books (bookid) ON DELETE CASCADE
+);
+
+-- Backfill the totals from the existing loans
+INSERT INTO bookloancounts (bookid, loancount)
+SELECT bookid, total
+FROM (
+  SELECT bc.bookid, COUNT(*) AS total
+  FROM loans l
+  JOIN bookcopies bc ON l.bookcopyid = bc.bookcopyid
+  GROUP BY bc.bookid
+) counted
+ON DUPLICATE KEY UPDATE loancount = counted.total;
@@ -0,0 +1,4 @@
+-- The book and borrower lists are sorted (and paged) by title and by name
+ALTER TABLE books ADD KEY booktitle_idx (booktitle);
+
+ALTER TABLE borrowers ADD KEY borrowername_idx (familyname, firstname);
@@ -0,0 +1,6 @@
+-- Finding a copy's open loan (is it available?) reads one entry of this index
+ALTER TABLE loans ADD KEY borrowedbook_open_idx (bookcopyid, returned);
+
+ALTER TABLE loans DROP KEY borrowedbook_idx;
+
+ALTER TABLE loans RENAME KEY borrowedbook_open_idx TO borrowedbook_idx;
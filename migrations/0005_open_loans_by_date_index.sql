@@ -0,0 +1,2 @@
+-- Open loans by loan date, so the overdue loans are one range of this index
+ALTER TABLE loans ADD KEY openloans_idx (returned, loandate);
@@ -0,0 +1,13 @@
+-- Returned loans moved out of the loans table once they are old (see archive-loans)
+CREATE TABLE loans_archive (
+  loanid int NOT NULL,
+  bookcopyid int NOT NULL,
+  borrowerid int NOT NULL,
+  loandate date NOT NULL,
+  returned date NOT NULL,
+  PRIMARY KEY (loanid),
+  KEY archivedbook_idx (bookcopyid),
+  KEY archivedborrower_idx (borrowerid),
+  CONSTRAINT archivedbook FOREIGN KEY (bookcopyid) REFERENCES bookcopies (bookcopyid),
+  CONSTRAINT archivedborrower FOREIGN KEY (borrowerid) REFERENCES borrowers (borrowerid)
+);
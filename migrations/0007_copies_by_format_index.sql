@@ -0,0 +1,5 @@
+-- A checkout takes the first free copy of a book in the wanted format from this index
+-- (it also serves the bookid foreign key, so the old bookid index goes)
+ALTER TABLE bookcopies ADD KEY bookformat_idx (bookid, format, bookcopyid);
+
+ALTER TABLE bookcopies DROP KEY bookid_idx;
@@ -0,0 +1,10 @@
+-- The loans-by-borrower page reads the loans of one page of borrowers, newest first,
+-- from these indexes (they also serve the borrowerid foreign keys, so the old borrowerid
+-- indexes go)
+ALTER TABLE loans ADD KEY borrowerloans_idx (borrowerid, loandate);
+
+ALTER TABLE loans DROP KEY borrower_idx;
+
+ALTER TABLE loans_archive ADD KEY archivedborrowerloans_idx (borrowerid, loandate);
+
+ALTER TABLE loans_archive DROP KEY archivedborrower_idx;
@@ -0,0 +1,8 @@
+-- Version stamps of the tables the pages are built from, shared by every worker process
+-- and command (see db.bump_version()); they make the pages' ETags and Last-Modified dates
+CREATE TABLE table_versions (
+  tablename varchar(64) NOT NULL,
+  version bigint NOT NULL DEFAULT 0,
+  modified datetime NOT NULL,
+  PRIMARY KEY (tablename)
+);
@@ -0,0 +1,15 @@
+-- Rebuild the borrower name FULLTEXT indexes made by 0004 with the stopword list, which
+-- left out the ngrams holding a stopword, so e.g. "Dan", "Jones" or "Quinn" weren't found
+SET SESSION innodb_ft_enable_stopword = OFF;
+
+ALTER TABLE borrowers DROP KEY firstname_ft;
+
+ALTER TABLE borrowers ADD FULLTEXT KEY firstname_ft (firstname) WITH PARSER ngram;
+
+ALTER TABLE borrowers DROP KEY familyname_ft;
+
+ALTER TABLE borrowers ADD FULLTEXT KEY familyname_ft (familyname) WITH PARSER ngram;
+
+ALTER TABLE borrowers DROP KEY borrowername_ft;
+
+ALTER TABLE borrowers ADD FULLTEXT KEY borrowername_ft (firstname, familyname) WITH PARSER ngram;
@@ -0,0 +1,182 @@
+"""Records how long each database query takes while serving a Flask request.
+
+Every cursor returned by `db.get_cursor()` is wrapped in a `ProfilingCursor`,
+which times its queries (including fetching their rows) and counts the rows
+they return. The queries are summed per route (see `route_stats()`, reported
+at /metrics), queries whose execution takes longer than a threshold are written
+to a slow-query log once their rows have been read, and the per-request totals can optionally be sent back in X-DB-Query-Count /
+X-DB-Time-Ms response headers for debugging.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from flask import Flask, g, has_app_context, has_request_context, request
+
+# Queries taking at least this many seconds are written to the slow-query log.
+slow_query_threshold: float = 0.5
+
+# Logger for slow queries (by default only warnings and above reach the app log).
+slow_query_log = logging.getLogger("library.slow_queries")
+
+# Keep each query's parameter values in the request's query log (off by default, as
+# they may be personal data). benchmarks/explain.py uses them to EXPLAIN the queries.
+keep_params: bool = False
+
+# Per-route totals, keyed by endpoint name. Read them with `route_stats()`.
+_route_stats: "dict[str, dict]" = {}
+_route_stats_lock = threading.Lock()
+
+
+def init_profiler(app: Flask, threshold: float = 0.5, log_file: str = None,
+                  debug_headers: bool = False):
+    """Turns on query profiling for the specified Flask app.
+
+    Queries taking `threshold` seconds or more are logged as warnings to the
+    "library.slow_queries" logger, and also to `log_file` if given. With
+    `debug_headers`, every response reports its query count and total DB time."""
+    global slow_query_threshold
+    slow_query_threshold = threshold
+
+    if log_file:
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_log.addHandler(handler)
+
+    if debug_headers:
+        app.after_request(add_debug_headers)
+    app.teardown_request(record_route_stats)
+
+
+def fingerprint(params):
+    """Returns a short hash identifying a set of query parameters, so repeated
+    queries can be spotted in the log without writing out the values."""
+    return hashlib.sha1(repr(params).encode()).hexdigest()[:12]
+
+
+class ProfilingCursor:
+    """Wraps a MySQL cursor, timing each query and counting the rows fetched.
+    Everything else (rowcount, lastrowid, close, ...) goes to the real cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._entry = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def execute(self, operation, params=()):
+        self._finish()
+        started = time.perf_counter()
+        result = self._cursor.execute(operation, params)
+        self._record(operation, params, time.perf_counter() - started)
+        return result
+
+    def executemany(self, operation, seq_params):
+        self._finish()
+        started = time.perf_counter()
+        result = self._cursor.executemany(operation, seq_params)
+        self._record(operation, seq_params, time.perf_counter() - started)
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone, single=True)
+
+    def fetchmany(self, size=1):
+        return self._timed_fetch(lambda: self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._timed_fetch(self._cursor.fetchall)
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def _record(self, operation, params, duration):
+        """Adds a query to the current request's log"""
+        self._entry = {
+            "sql": " ".join(operation.split()),
+            "params": fingerprint(params),
+            "seconds": duration,
+            # Statements that don't return rows report how many rows they changed
+            "rows": max(self._cursor.rowcount, 0) if not self._cursor.with_rows else 0,
+            "slow": duration >= slow_query_threshold,
+        }
+        if self._entry["slow"]:
+            # Logged by _finish() (or at the end of the request), once the rows are counted
+            self._entry["log_pending"] = True
+        if keep_params:
+            self._entry["values"] = params
+        if has_app_context():
+            g.setdefault("query_log", []).append(self._entry)
+
+    def _finish(self):
+        """Writes the last query to the slow-query log if it was slow; its rows
+        have all been read by the time the cursor runs another query or closes"""
+        if self._entry is not None:
+            log_slow_query(self._entry)
+
+    def _timed_fetch(self, fetch, single=False):
+        """Runs a fetch, adding its time and row count to the last query"""
+        started = time.perf_counter()
+        rows = fetch()
+        if self._entry is not None:
+            self._entry["seconds"] += time.perf_counter() - started
+            self._entry["rows"] += (rows is not None) if single else len(rows)
+        return rows
+
+
+def log_slow_query(entry):
+    """Writes a slow query to the slow-query log, unless it has been already"""
+    if entry.pop("log_pending", False):
+        route = request.endpoint if has_request_context() else None
+        slow_query_log.warning(
+            "slow query: %.3fs rows=%d route=%s params=%s sql=%s",
+            entry["seconds"], entry["rows"], route, entry["params"], entry["sql"])
+
+
+def request_totals():
+    """Returns (query count, total seconds) for the queries run by the current
+    request so far."""
+    query_log = g.get("query_log", [])
+    return len(query_log), sum(entry["seconds"] for entry in query_log)
+
+
+def add_debug_headers(response):
+    """Reports the request's query count and DB time in response headers"""
+    count, seconds = request_totals()
+    response.headers["X-DB-Query-Count"] = str(count)
+    response.headers["X-DB-Time-Ms"] = f"{seconds * 1000:.1f}"
+    return response
+
+
+def record_route_stats(exception=None):
+    """Adds the finished request's queries to its route's totals, and logs the
+    slow queries of cursors that were never closed (e.g. the prepared ones)"""
+    for entry in g.get("query_log", []):
+        log_slow_query(entry)
+    count, seconds = request_totals()
+    endpoint = request.endpoint or "<unknown>"
+    with _route_stats_lock:
+        stats = _route_stats.setdefault(endpoint, {
+            "requests": 0, "queries": 0, "db_seconds": 0.0, "slow_queries": 0,
+        })
+        stats["requests"] += 1
+        stats["queries"] += count
+        stats["db_seconds"] += seconds
+        stats["slow_queries"] += sum(1 for entry in g.get("query_log", []) if entry["slow"])
+
+
+def route_stats():
+    """Returns a snapshot of the per-route query totals, including the average
+    number of queries and DB time per request."""
+    with _route_stats_lock:
+        snapshot = {endpoint: dict(stats) for endpoint, stats in _route_stats.items()}
+    for stats in snapshot.values():
+        stats["queries_per_request"] = stats["queries"] / stats["requests"]
+        stats["db_seconds_per_request"] = stats["db_seconds"] / stats["requests"]
+    return snapshot
@@ -0,0 +1,47 @@
+"""Shared test setup.
+
+The app modules live in the repository root, and app.py reads its settings
+from connect.py, which each installation writes for itself. When there isn't
+one, the tests use the settings below. The app never connects to them, as
+the connection pool only opens on first use and the tests that reach the
+database replace it (see test_batch_routes.py). The tests that need real
+query results or plans use the `db_cursor` fixture, which skips them when
+there is no database there.
+"""
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import connect  # noqa: F401
+except ImportError:
+    connect = types.ModuleType("connect")
+    connect.dbuser = "library"
+    connect.dbpass = "library"
+    connect.dbhost = "127.0.0.1"
+    connect.dbport = 3306
+    connect.dbname = "library_test"
+    connect.templatecachedir = None
+    sys.modules["connect"] = connect
+
+
+@pytest.fixture(scope="session")
+def db_cursor():
+    """A dictionary cursor on the test database named in connect.py (made from
+    library-local.sql and brought up to date with migrations.py)."""
+    mysql_connector = pytest.importorskip("mysql.connector")
+    try:
+        connection = mysql_connector.connect(
+            user=connect.dbuser, password=connect.dbpass, host=connect.dbhost,
+            port=connect.dbport, database=connect.dbname)
+    except mysql_connector.Error as error:
+        pytest.skip(f"test database not available: {error}")
+    cursor = connection.cursor(dictionary=True)
+    yield cursor
+    cursor.close()
+    connection.close()
@@ -0,0 +1,85 @@
+"""The batch loan/return endpoints must roll back when a statement fails part
+of the way through, so no locks or half-made changes stay on the pooled
+connection. The database is replaced by a recording fake."""
+import types
+
+import pytest
+
+pytest.importorskip("flask")
+mysql_errors = pytest.importorskip("mysql.connector.errors")
+
+import app as library_app  # noqa: E402
+import db  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self):
+        self.calls = []
+
+    def start_transaction(self, **options):
+        self.calls.append("start")
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+class FakeCursor:
+    """Answers SELECTs with `rows` and fails the first write."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = False
+
+    def execute(self, operation, params=()):
+        if not operation.lstrip().startswith("SELECT"):
+            raise mysql_errors.IntegrityError("write failed")
+
+    def executemany(self, operation, seq_params):
+        raise mysql_errors.IntegrityError("write failed")
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = types.SimpleNamespace(connection=FakeConnection(), cursors=[], rows=[])
+
+    def get_cursor(*args, **kwargs):
+        fake.cursors.append(FakeCursor(fake.rows))
+        return fake.cursors[-1]
+
+    monkeypatch.setattr(db, "get_db", lambda: fake.connection)
+    monkeypatch.setattr(db, "get_cursor", get_cursor)
+    monkeypatch.setattr(db, "run_query_one", lambda name, params=(): {"borrowerid": params[0]})
+    monkeypatch.setitem(library_app.app.config, "TESTING", True)
+    return fake
+
+
+def test_loan_batch_rolls_back_when_an_insert_fails(fake_db):
+    fake_db.rows = [{"bookcopyid": 1, "bookid": 10}, {"bookcopyid": 2, "bookid": 10}]
+    client = library_app.app.test_client()
+
+    with pytest.raises(mysql_errors.IntegrityError):
+        client.post("/loan_batch", json={"borrower_id": 5, "copy_ids": [1, 2]})
+
+    assert fake_db.connection.calls == ["start", "rollback"]
+    assert all(cursor.closed for cursor in fake_db.cursors)
+
+
+def test_return_batch_rolls_back_when_the_update_fails(fake_db):
+    fake_db.rows = [{"loanid": 7}, {"loanid": 8}]
+    client = library_app.app.test_client()
+
+    with pytest.raises(mysql_errors.IntegrityError):
+        client.post("/return_batch", json={"loan_ids": [7, 8]})
+
+    assert fake_db.connection.calls == ["start", "rollback"]
+    assert all(cursor.closed for cursor in fake_db.cursors)
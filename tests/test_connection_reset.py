@@ -0,0 +1,42 @@
+"""Connections go back to the pool with their session as the next request
+expects it (see db.reset_session())."""
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+from mysql.connector.pooling import PooledMySQLConnection  # noqa: E402
+
+import db  # noqa: E402
+
+
+class FakeMySQLConnection:
+    """The connection a PooledMySQLConnection wraps, left mid-transaction with
+    autocommit off by a route that failed half-way"""
+    connection_id = 1
+
+    def __init__(self):
+        self.autocommit = False
+        self.in_transaction = True
+
+    def consume_results(self):
+        pass
+
+    def rollback(self):
+        self.in_transaction = False
+
+
+def pooled(connection):
+    # The pool hands out wrappers made by MySQLConnectionPool.get_connection()
+    wrapper = object.__new__(PooledMySQLConnection)
+    wrapper._cnx = connection
+    return wrapper
+
+
+def test_pooled_connection_comes_back_with_autocommit_reset(monkeypatch):
+    monkeypatch.setattr(db, "_pool_settings", {"autocommit": True})
+    connection = FakeMySQLConnection()
+
+    db.reset_session(pooled(connection))
+
+    assert connection.autocommit is True
+    assert not connection.in_transaction
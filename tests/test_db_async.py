@@ -0,0 +1,51 @@
+"""The async app's connections go back to the pool the way db.py returns them."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("quart")
+pytest.importorskip("aiomysql")
+from quart import Quart, g  # noqa: E402
+
+import db_async  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self, in_transaction):
+        self.in_transaction = in_transaction
+        self.closed = False
+
+    def get_transaction_status(self):
+        return self.in_transaction
+
+    async def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self):
+        self.released = []
+
+    def release(self, connection):
+        self.released.append(connection)
+
+
+@pytest.mark.parametrize("in_transaction", [False, True])
+def test_teardown_rolls_back_before_releasing(monkeypatch, in_transaction):
+    pool = FakePool()
+    monkeypatch.setattr(db_async, "connection_pool", pool, raising=False)
+    connection = FakeConnection(in_transaction)
+
+    async def request():
+        async with Quart(__name__).app_context():
+            g.db = connection
+            await db_async.close_db()
+
+    asyncio.run(request())
+
+    assert pool.released == [connection]
+    assert not connection.in_transaction
+    assert not connection.closed
@@ -0,0 +1,51 @@
+"""CSV and NDJSON export encoding."""
+import gzip
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import export
+
+ROWS = [
+    {"loanid": 1, "loandate": date(2026, 3, 1), "fine": Decimal("2.50"), "title": "Cat, the"},
+    {"loanid": 2, "loandate": datetime(2026, 3, 2, 9, 30), "fine": None, "title": 'Say "hi"'},
+]
+
+
+def test_csv_has_a_header_then_one_line_per_row():
+    text = "".join(export.csv_lines(iter(ROWS)))
+
+    assert text.splitlines() == [
+        "loanid,loandate,fine,title",
+        '1,2026-03-01,2.50,"Cat, the"',
+        '2,2026-03-02T09:30:00,,"Say ""hi"""',
+    ]
+
+
+def test_csv_of_no_rows_is_empty():
+    assert list(export.csv_lines(iter([]))) == []
+
+
+def test_ndjson_has_one_object_per_line():
+    lines = list(export.ndjson_lines(iter(ROWS)))
+
+    assert [json.loads(line) for line in lines] == [
+        {"loanid": 1, "loandate": "2026-03-01", "fine": "2.50", "title": "Cat, the"},
+        {"loanid": 2, "loandate": "2026-03-02T09:30:00", "fine": None, "title": 'Say "hi"'},
+    ]
+    assert all(line.endswith("\n") for line in lines)
+
+
+def test_encode_collects_lines_into_chunks(monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_SIZE", 10)
+
+    chunks = list(export.encode(iter(["abcdef\n", "ghijkl\n", "mn\n"])))
+
+    assert chunks == [b"abcdef\nghijkl\n", b"mn\n"]
+
+
+def test_gzip_output_decompresses_to_the_plain_output():
+    plain = b"".join(export.export_rows(iter(ROWS), "ndjson"))
+    compressed = b"".join(export.export_rows(iter(ROWS), "ndjson", compress=True))
+
+    assert gzip.decompress(compressed) == plain
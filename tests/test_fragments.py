@@ -0,0 +1,70 @@
+"""The fragment cache must never hand out HTML for an old version of a book,
+in this process or in another one."""
+import pytest
+
+import fragments
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(fragments, "_fragments", fragments.OrderedDict())
+    monkeypatch.setattr(fragments, "shared_dir", None)
+    return fragments
+
+
+@pytest.fixture
+def shared_cache(cache, tmp_path):
+    cache.init_fragment_cache(directory=str(tmp_path))
+    return cache
+
+
+def test_a_new_version_changes_the_key(cache):
+    key = cache.fragment_key("book_card.html", "book", 12, "1")
+    cache.set_fragment(key, "<p>old</p>")
+
+    assert cache.fragment_key("book_card.html", "book", 12, "2") != key
+    assert cache.get_fragment(cache.fragment_key("book_card.html", "book", 12, "2")) is None
+
+
+def test_shared_fragments_are_read_by_other_processes(shared_cache):
+    key = shared_cache.fragment_key("book_info.html", "book", 5, "3")
+    shared_cache.set_fragment(key, "<p>info</p>")
+    shared_cache._fragments.clear()  # as seen from a process that didn't render it
+
+    assert shared_cache.get_fragment(key) == "<p>info</p>"
+
+
+def test_shared_file_for_an_older_version_is_ignored(shared_cache):
+    shared_cache.set_fragment(shared_cache.fragment_key("book_info.html", "book", 5, "3"), "<p>old</p>")
+    shared_cache._fragments.clear()
+
+    assert shared_cache.get_fragment(shared_cache.fragment_key("book_info.html", "book", 5, "4")) is None
+
+
+def test_a_change_made_by_another_process_is_seen(cache, monkeypatch):
+    """Two processes, each with its own in-memory fragments, reading the books
+    version from the same database"""
+    pytest.importorskip("flask")
+    pytest.importorskip("mysql.connector")
+    import app as library_app
+    import db
+
+    database = {"books": 1}
+    monkeypatch.setattr(db, "table_versions", lambda *tables: (str(database["books"]), None))
+    monkeypatch.setattr(db, "read_may_be_stale", lambda *tables: False)
+    monkeypatch.setattr(library_app, "render_template",
+                        lambda template, book: f"<p>{book['booktitle']}</p>")
+    first_store, second_store = fragments.OrderedDict(), fragments.OrderedDict()
+
+    def render(store, book):
+        monkeypatch.setattr(fragments, "_fragments", store)
+        with library_app.app.test_request_context():
+            return str(library_app.render_fragment("book_card.html", book))
+
+    assert render(first_store, {"bookid": 12, "booktitle": "Old"}) == "<p>Old</p>"
+    assert render(second_store, {"bookid": 12, "booktitle": "Old"}) == "<p>Old</p>"
+
+    # The second process saves the book, and bumps the version in the database
+    database["books"] += 1
+
+    assert render(first_store, {"bookid": 12, "booktitle": "New"}) == "<p>New</p>"
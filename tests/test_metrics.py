@@ -0,0 +1,84 @@
+"""Prometheus text rendering of the request metrics."""
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+
+import db  # noqa: E402
+import metrics  # noqa: E402
+import profiler  # noqa: E402
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "_histograms", {})
+    monkeypatch.setattr(metrics, "_requests", {})
+    monkeypatch.setattr(metrics, "_errors", {})
+    monkeypatch.setattr(profiler, "_route_stats", {})
+    monkeypatch.setattr(db, "pool_stats", lambda: {
+        "pool_size": 5, "in_use": 1, "peak_in_use": 3, "checkouts": 40, "exhaustion_events": 2,
+        "timeouts": 0, "wait_seconds_total": 0.25, "recycled": 1})
+    monkeypatch.setattr(db, "replica_status", lambda: None)
+    monkeypatch.setattr(db, "query_stats", lambda: {"book_by_id": {"executions": 9, "prepares": 2}})
+    return metrics
+
+
+def test_request_counters(registry):
+    registry._requests[("book_detail", "GET", "200")] = 3
+    registry._errors['say "hi"'] = 1
+
+    text = registry.render_metrics()
+
+    assert 'library_requests_total{route="book_detail",method="GET",status="200"} 3\n' in text
+    # Label values are escaped
+    assert 'library_request_errors_total{route="say \\"hi\\""} 1\n' in text
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    for seconds in (0.003, 0.02, 0.02, 20.0):
+        registry._observe("home", "total", seconds)
+
+    lines = registry.render_metrics().splitlines()
+
+    def bucket(le):
+        return next(line for line in lines if f'phase="total",le="{le}"}}' in line).split()[-1]
+
+    assert bucket(0.005) == "1"
+    assert bucket(0.01) == "1"
+    assert bucket(0.025) == "3"
+    assert bucket(10.0) == "3"
+    assert bucket("+Inf") == "4"
+    assert 'library_request_duration_seconds_count{route="home",phase="total"} 4' in lines
+    assert 'library_request_duration_seconds_sum{route="home",phase="total"} 20.043' in lines
+
+
+def test_pool_and_statement_metrics(registry):
+    lines = registry.render_metrics().splitlines()
+
+    assert "# TYPE library_db_pool_in_use gauge" in lines
+    assert "library_db_pool_checkouts_total 40" in lines
+    assert "library_db_pool_wait_seconds_total 0.25" in lines
+    assert 'library_prepared_statement_executions_total{statement="book_by_id"} 9' in lines
+    # No replica, so no replica metrics
+    assert not any(line.startswith("library_db_replica") for line in lines)
+
+
+def test_replica_metrics(registry, monkeypatch):
+    monkeypatch.setattr(db, "replica_status", lambda: {"usable": True, "lag": 1.5})
+
+    lines = registry.render_metrics().splitlines()
+
+    assert "library_db_replica_usable 1" in lines
+    assert "library_db_replica_lag_seconds 1.5" in lines
+
+
+def test_route_query_metrics(registry):
+    profiler._route_stats["loan_current"] = {
+        "requests": 4, "queries": 12, "db_seconds": 0.5, "slow_queries": 1}
+
+    lines = registry.render_metrics().splitlines()
+
+    assert "# TYPE library_route_db_queries_total counter" in lines
+    assert 'library_route_db_queries_total{route="loan_current"} 12' in lines
+    assert 'library_route_db_seconds_total{route="loan_current"} 0.5' in lines
+    assert 'library_route_slow_queries_total{route="loan_current"} 1' in lines
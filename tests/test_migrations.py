@@ -0,0 +1,52 @@
+"""Migration scripts: splitting them into statements, and keeping the .sql
+scripts in step with migrations/."""
+import os
+import re
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+import migrations  # noqa: E402
+
+ROOT = os.path.dirname(migrations.MIGRATIONS_DIR)
+
+
+def test_statements_split_at_semicolons_ending_a_line():
+    script = """
+    -- Add an index
+    ALTER TABLE loans ADD KEY a_idx (a);
+
+    ALTER TABLE loans
+      DROP KEY b_idx;
+    """
+
+    assert list(migrations.statements(script)) == [
+        "ALTER TABLE loans ADD KEY a_idx (a)",
+        "ALTER TABLE loans\n      DROP KEY b_idx",
+    ]
+
+
+def test_statements_keep_semicolons_inside_a_line():
+    script = "INSERT INTO notes (text) VALUES ('a; b');\n"
+
+    assert list(migrations.statements(script)) == ["INSERT INTO notes (text) VALUES ('a; b')"]
+
+
+def test_statements_of_a_comment_only_script():
+    assert list(migrations.statements("-- nothing to do\n")) == []
+
+
+def test_migrations_are_numbered_without_gaps():
+    versions = [version for version, _name, _path in migrations.available_migrations()]
+
+    assert versions == list(range(1, len(versions) + 1))
+
+
+@pytest.mark.parametrize("script", ["library-local.sql", "library-pa.sql"])
+def test_sql_scripts_record_every_migration(script):
+    with open(os.path.join(ROOT, script), encoding="utf-8") as sql_file:
+        recorded = set(re.findall(r"\((\d+), '(\w+)'\)", sql_file.read()))
+
+    available = {(str(version), name) for version, name, _path in migrations.available_migrations()}
+    assert available <= recorded
@@ -0,0 +1,42 @@
+"""Borrower name searches use the ngram FULLTEXT indexes instead of LIKE
+'%term%'. They must find the same borrowers, including names whose ngrams are
+stopwords (the "an" of Dan, "on" of Jones, "in" of Quinn). These need the test
+database (see the `db_cursor` fixture) and are skipped when it can't be reached."""
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+
+import app as library_app  # noqa: E402
+
+TERMS = ["Dan", "Jones", "Quinn", "an", "on", "in", "is", "the", "Di", "wa", "son", "Olivia"]
+
+
+def borrower_ids(cursor, condition, param):
+    cursor.execute(f"SELECT borrowerid FROM borrowers WHERE {condition}", (param,))
+    return {row["borrowerid"] for row in cursor.fetchall()}
+
+
+@pytest.fixture(scope="module")
+def borrowers(db_cursor):
+    """Adds borrowers with the names searched for, and removes them afterwards"""
+    names = [("Dan", "Jones"), ("Quinn", "Anderson"), ("Isla", "Thein"), ("Olivia", "Watson")]
+    added = []
+    for firstname, familyname in names:
+        db_cursor.execute("INSERT INTO borrowers (firstname, familyname) VALUES (%s, %s)",
+                          (firstname, familyname))
+        added.append(db_cursor.lastrowid)
+    db_cursor.execute("COMMIT")
+    yield added
+    db_cursor.execute(f"DELETE FROM borrowers WHERE borrowerid IN ({', '.join(['%s'] * len(added))})",
+                      added)
+    db_cursor.execute("COMMIT")
+
+
+@pytest.mark.parametrize("column", ["firstname", "familyname"])
+@pytest.mark.parametrize("term", TERMS)
+def test_fulltext_search_matches_like_search(db_cursor, borrowers, column, term):
+    like_ids = borrower_ids(db_cursor, f"{column} LIKE %s", f"%{term}%")
+    condition, param = library_app.name_search_condition(column, term)
+
+    assert borrower_ids(db_cursor, condition, param) == like_ids
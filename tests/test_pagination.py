@@ -0,0 +1,178 @@
+"""Keyset pagination helpers: page tokens, seek conditions, page queries and
+the next/previous links."""
+from datetime import date
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+from werkzeug.datastructures import MultiDict  # noqa: E402
+
+import app as library_app  # noqa: E402
+
+NAME_ORDER = [
+    ("familyname", "familyname", False),
+    ("firstname", "firstname", False),
+    ("borrowerid", "borrowerid", False),
+]
+MIXED_ORDER = [
+    ("br.borrowerid", "borrowerid", False),
+    ("l.loandate", "loandate", True),
+    ("l.loanid", "loanid", True),
+]
+
+
+def page_url(**args):
+    return "/page?" + "&".join(f"{name}={value}" for name, value in sorted(args.items()))
+
+
+# ========================================
+# Page tokens
+# ========================================
+def test_page_token_round_trip():
+    row = {"loandate": date(2026, 3, 1), "loanid": 42, "borrowerid": 7}
+
+    token = library_app.encode_page_token(row, MIXED_ORDER)
+
+    # Dates come back as ISO strings, which MySQL compares with date columns
+    assert library_app.decode_page_token(token, MIXED_ORDER) == [7, "2026-03-01", 42]
+
+
+@pytest.mark.parametrize("token", [None, "", "not base64!", "bm90IGpzb24=",
+                                   # ["Smith", [1], 3] and ["Smith", {}, 3]: not sort key values
+                                   "WyJTbWl0aCIsIFsxXSwgM10=", "WyJTbWl0aCIsIHt9LCAzXQ=="])
+def test_invalid_page_token_is_ignored(token):
+    assert library_app.decode_page_token(token, NAME_ORDER) is None
+
+
+def test_page_token_for_another_order_is_ignored():
+    token = library_app.encode_page_token({"loandate": "2026-03-01", "loanid": 1},
+                                          library_app.CURRENT_LOANS_ORDER)
+
+    assert library_app.decode_page_token(token, NAME_ORDER) is None
+
+
+# ========================================
+# Seek conditions
+# ========================================
+def test_seek_condition_uses_a_row_comparison_when_keys_sort_the_same_way():
+    condition, params = library_app.seek_condition(NAME_ORDER, ["Smith", "Ann", 3], False)
+
+    assert condition == "familyname >= %s AND (familyname, firstname, borrowerid) > (%s, %s, %s)"
+    assert params == ["Smith", "Smith", "Ann", 3]
+
+
+def test_seek_condition_backwards_flips_the_comparison():
+    condition, _params = library_app.seek_condition(NAME_ORDER, ["Smith", "Ann", 3], True)
+
+    assert condition == "familyname <= %s AND (familyname, firstname, borrowerid) < (%s, %s, %s)"
+
+
+def test_seek_condition_expands_mixed_directions():
+    condition, params = library_app.seek_condition(MIXED_ORDER, [7, "2026-03-01", 42], False)
+
+    assert condition == ("br.borrowerid >= %s AND ((br.borrowerid > %s) OR (br.borrowerid = %s AND l.loandate < %s)"
+                         " OR (br.borrowerid = %s AND l.loandate = %s AND l.loanid < %s))")
+    assert params == [7, 7, 7, "2026-03-01", 7, "2026-03-01", 42]
+
+
+# ========================================
+# Page queries
+# ========================================
+def test_first_page_query():
+    query, params, page = library_app.build_page_query(
+        MultiDict(), "SELECT * FROM borrowers", [], [], NAME_ORDER)
+
+    assert query == ("SELECT * FROM borrowers  "
+                     "ORDER BY familyname ASC, firstname ASC, borrowerid ASC LIMIT %s")
+    # One extra row tells whether there is a next page
+    assert params == [library_app.PAGE_SIZE + 1]
+    assert page == {"size": library_app.PAGE_SIZE, "after": None, "backwards": False,
+                    "order_by": NAME_ORDER}
+
+
+def test_page_after_a_token_seeks_past_it():
+    token = library_app.encode_page_token(
+        {"familyname": "Smith", "firstname": "Ann", "borrowerid": 3}, NAME_ORDER)
+
+    query, params, page = library_app.build_page_query(
+        MultiDict({"after": token, "per_page": "10"}), "SELECT * FROM borrowers",
+        ["city = %s"], ["Lincoln"], NAME_ORDER)
+
+    assert ("WHERE city = %s AND familyname >= %s AND "
+            "(familyname, firstname, borrowerid) > (%s, %s, %s)") in query
+    assert params == ["Lincoln", "Smith", "Smith", "Ann", 3, 11]
+    assert page["after"] == ["Smith", "Ann", 3]
+
+
+def test_page_before_a_token_reads_backwards():
+    token = library_app.encode_page_token(
+        {"familyname": "Smith", "firstname": "Ann", "borrowerid": 3}, NAME_ORDER)
+
+    query, _params, page = library_app.build_page_query(
+        MultiDict({"before": token}), "SELECT * FROM borrowers", [], [], NAME_ORDER)
+
+    assert "familyname <= %s AND (familyname, firstname, borrowerid) < (%s, %s, %s)" in query
+    assert "ORDER BY familyname DESC, firstname DESC, borrowerid DESC" in query
+    assert page["backwards"]
+
+
+@pytest.mark.parametrize("per_page, size", [("0", 1), ("5", 5), ("1000", library_app.MAX_PAGE_SIZE),
+                                            ("lots", library_app.PAGE_SIZE)])
+def test_page_size_is_kept_in_range(per_page, size):
+    _query, params, page = library_app.build_page_query(
+        MultiDict({"per_page": per_page}), "SELECT * FROM borrowers", [], [], NAME_ORDER)
+
+    assert page["size"] == size
+    assert params == [size + 1]
+
+
+# ========================================
+# Finishing pages
+# ========================================
+def rows(*ids):
+    return [{"familyname": f"Name{i}", "firstname": "A", "borrowerid": i} for i in ids]
+
+
+def page(size=2, after=None, backwards=False):
+    return {"size": size, "after": after, "backwards": backwards, "order_by": NAME_ORDER}
+
+
+def token(row_id):
+    return library_app.encode_page_token(rows(row_id)[0], NAME_ORDER)
+
+
+def test_first_page_with_more_rows_links_to_the_next_page():
+    page_rows, pagination = library_app.finish_page(rows(1, 2, 3), page(), page_url)
+
+    assert [row["borrowerid"] for row in page_rows] == [1, 2]
+    assert pagination == {"next_url": page_url(after=token(2), per_page=2), "prev_url": None}
+
+
+def test_last_page_has_no_next_link():
+    page_rows, pagination = library_app.finish_page(
+        rows(5, 6), page(after=["Name4", "A", 4]), page_url)
+
+    assert [row["borrowerid"] for row in page_rows] == [5, 6]
+    assert pagination == {"next_url": None, "prev_url": page_url(before=token(5), per_page=2)}
+
+
+def test_backwards_page_is_put_back_in_order():
+    # Read in reverse order, with one extra row meaning there are earlier pages
+    page_rows, pagination = library_app.finish_page(
+        rows(4, 3, 2), page(backwards=True), page_url)
+
+    assert [row["borrowerid"] for row in page_rows] == [3, 4]
+    assert pagination == {"next_url": page_url(after=token(4), per_page=2),
+                          "prev_url": page_url(before=token(3), per_page=2)}
+
+
+def test_default_page_size_is_left_out_of_the_links():
+    _rows, pagination = library_app.finish_page(
+        rows(*range(1, library_app.PAGE_SIZE + 2)), page(size=library_app.PAGE_SIZE), page_url)
+
+    assert pagination["next_url"] == page_url(after=token(library_app.PAGE_SIZE))
+
+
+def test_empty_page_has_no_links():
+    assert library_app.finish_page([], page(), page_url) == ([], {"next_url": None, "prev_url": None})
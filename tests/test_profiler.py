@@ -0,0 +1,69 @@
+"""The profiler's slow-query log and per-route query totals."""
+import logging
+
+import pytest
+
+pytest.importorskip("flask")
+from flask import Flask  # noqa: E402
+
+import profiler  # noqa: E402
+
+
+class FakeCursor:
+    """A MySQL cursor whose query returns three rows"""
+    rowcount = -1
+    with_rows = True
+
+    def execute(self, operation, params=()):
+        pass
+
+    def fetchall(self):
+        return [{"bookid": 1}, {"bookid": 2}, {"bookid": 3}]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(profiler, "slow_query_threshold", 0.0)  # every query is slow
+    monkeypatch.setattr(profiler, "_route_stats", {})
+    app = Flask(__name__)
+
+    @app.route("/books")
+    def books():
+        return "books"
+
+    app.teardown_request(profiler.record_route_stats)
+    return app
+
+
+def slow_log_lines(caplog):
+    return [record.getMessage() for record in caplog.records if record.name == "library.slow_queries"]
+
+
+def test_slow_query_is_logged_with_its_rows_once_fetched(app, caplog):
+    caplog.set_level(logging.WARNING, logger="library.slow_queries")
+    with app.test_request_context("/books"):
+        cursor = profiler.ProfilingCursor(FakeCursor())
+        cursor.execute("SELECT bookid FROM books")
+        assert slow_log_lines(caplog) == []
+        cursor.fetchall()
+        cursor.close()
+
+    [line] = slow_log_lines(caplog)
+    assert " rows=3 route=books " in line
+
+
+def test_slow_query_of_an_unclosed_cursor_is_logged_at_teardown(app, caplog):
+    caplog.set_level(logging.WARNING, logger="library.slow_queries")
+    with app.test_request_context("/books"):
+        cursor = profiler.ProfilingCursor(FakeCursor())
+        cursor.execute("SELECT bookid FROM books")
+        cursor.fetchall()
+        assert slow_log_lines(caplog) == []
+    # Leaving the request context ran the teardown functions
+
+    [line] = slow_log_lines(caplog)
+    assert " rows=3 " in line
+    assert profiler.route_stats()["books"]["slow_queries"] == 1
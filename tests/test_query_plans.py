@@ -0,0 +1,90 @@
+"""The routes must read their rows in index order: EXPLAIN shows no temporary
+table or filesort for the queries they run. The routes are the ones timed by
+benchmarks/bench.py, so a route added there is checked here too. These need
+the test database (see the `db_cursor` fixture) and are skipped when it can't
+be reached."""
+import os
+import sys
+import types
+from datetime import date
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+from werkzeug.datastructures import MultiDict  # noqa: E402
+
+import app as library_app  # noqa: E402
+import connect  # noqa: E402
+import profiler  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "benchmarks"))
+import bench  # noqa: E402
+import explain  # noqa: E402
+
+# Routes that sort by design: search results are ordered by relevance, and the
+# full loan history streams every loan
+SORTING_ROUTES = {"borrower_search", "loan_by_borrower_all"}
+# bench.routes() only needs ids to build its URLs, so any will do for the route names
+ROUTE_NAMES = [name for name, _method, _path, _data in
+               bench.routes({"book_id": 1, "borrower_id": 1, "familyname": "Name"})]
+
+
+@pytest.fixture(scope="module")
+def route_queries(db_cursor):
+    """The read queries each route runs, as {route: {sql: parameter values}}"""
+    keep_params = profiler.keep_params
+    profiler.keep_params = True
+    try:
+        return explain.collect_queries(types.SimpleNamespace(database=connect.dbname, routes=None))
+    finally:
+        profiler.keep_params = keep_params
+
+
+def page_args(order_by, row=None):
+    """Request arguments for the first page, or the page after `row`"""
+    args = MultiDict()
+    if row is not None:
+        args["after"] = library_app.encode_page_token(row, order_by)
+    return args
+
+
+def assert_no_sort(cursor, sql, params):
+    cursor.execute("EXPLAIN " + sql, params)
+    for step in cursor.fetchall():
+        extra = step["Extra"] or ""
+        assert "Using temporary" not in extra, step
+        assert "Using filesort" not in extra, step
+
+
+def assert_range_read(cursor, sql, params, table):
+    """A page after the first must start at its token: `table` is read by index range"""
+    cursor.execute("EXPLAIN " + sql, params)
+    steps = [step for step in cursor.fetchall() if step["table"] == table]
+    assert steps and all(step["type"] == "range" for step in steps), steps
+
+
+@pytest.mark.parametrize("route", [name for name in ROUTE_NAMES if name not in SORTING_ROUTES])
+def test_route_reads_rows_in_index_order(db_cursor, route_queries, route):
+    for sql, values in route_queries[route].items():
+        assert_no_sort(db_cursor, sql, values)
+
+
+@pytest.mark.parametrize("backwards", [False, True])
+def test_loan_borrowers_later_page_reads_an_index_range(db_cursor, backwards):
+    order_by = library_app.LOAN_BORROWERS_ORDER
+    args = MultiDict({"before" if backwards else "after": library_app.encode_page_token(
+        {"familyname": "M", "firstname": "A", "borrowerid": 1}, order_by)})
+    sql, params, _page = library_app.build_page_query(
+        args, library_app.LOAN_BORROWERS_QSTR,
+        [library_app.has_loans_condition(library_app.loans_tables(False))], [], order_by)
+    assert_range_read(db_cursor, sql, params, "borrowers")
+
+
+def test_current_loans_later_page_reads_an_index_range(db_cursor):
+    order_by = library_app.CURRENT_LOANS_ORDER
+    sql, params, _page = library_app.build_page_query(
+        page_args(order_by, {"loandate": date(2024, 1, 1), "loanid": 1}),
+        library_app.CURRENT_LOANS_QSTR, ["loans.returned IS NULL"], [], order_by)
+    assert_range_read(db_cursor, sql, params, "loans")
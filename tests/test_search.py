@@ -0,0 +1,40 @@
+"""Borrower name search conditions and the search-as-you-type query."""
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+
+import app as library_app  # noqa: E402
+
+
+def test_name_search_uses_the_fulltext_index_as_a_phrase():
+    condition, param = library_app.name_search_condition("borrowers.familyname", "Jones")
+
+    assert condition == "MATCH(borrowers.familyname) AGAINST (%s IN BOOLEAN MODE)"
+    assert param == '"Jones"'
+
+
+def test_name_search_drops_double_quotes_from_the_phrase():
+    _condition, param = library_app.name_search_condition("firstname", 'O"Neil')
+
+    assert param == '"ONeil"'
+
+
+def test_term_shorter_than_an_ngram_uses_a_prefix_match():
+    condition, param = library_app.name_search_condition("firstname", "D")
+
+    assert condition == "firstname LIKE %s"
+    assert param == "D%"
+
+
+@pytest.mark.parametrize("term, pattern", [("%", "\\%%"), ("_", "\\_%"), ("\\", "\\\\%")])
+def test_prefix_match_escapes_like_wildcards(term, pattern):
+    assert library_app.name_search_condition("firstname", term) == ("firstname LIKE %s", pattern)
+
+
+def test_search_query_requires_every_word():
+    assert library_app.name_search_query('di  "wa" x') == '+"di" +"wa"'
+
+
+def test_search_query_without_searchable_words():
+    assert library_app.name_search_query(" a ") is None
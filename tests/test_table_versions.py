@@ -0,0 +1,49 @@
+"""Page ETags come from the table_versions rows every process shares."""
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("mysql.connector")
+
+import db  # noqa: E402
+
+
+def test_etag_combines_the_versions_of_each_table():
+    rows = [
+        {"tablename": "books", "version": 4, "modified": datetime(2026, 3, 1, 9, 30), "age": 90000},
+        {"tablename": "loans", "version": 12, "modified": datetime(2026, 3, 2, 14, 0), "age": 600},
+    ]
+    stamps = db.version_stamps(["books", "loans"], rows)
+
+    etag, last_modified = db.versions_etag(["books", "loans"], stamps)
+
+    assert etag == "4-12"
+    assert last_modified == datetime(2026, 3, 2, 14, 0, tzinfo=timezone.utc)
+
+
+def test_table_without_a_row_has_version_zero():
+    stamps = db.version_stamps(["borrowers"], [])
+
+    assert db.versions_etag(["borrowers"], stamps) == ("0", db.NEVER_CHANGED)
+
+
+@pytest.mark.parametrize("age, stale", [(None, False), (0, True), (10, True), (11, False)])
+def test_recent_changes_may_be_missing_from_the_replica(monkeypatch, age, stale):
+    monkeypatch.setattr(db, "_sticky_seconds", 10.0)
+    rows = [{"tablename": "books", "version": 4, "modified": datetime(2026, 3, 1, 9, 30), "age": 90000}]
+    if age is not None:
+        rows.append({"tablename": "loans", "version": 12, "modified": datetime(2026, 3, 2, 14, 0), "age": age})
+    stamps = db.version_stamps(["books", "loans"], rows)
+
+    # The ages come from the database's clock, so the app server's clock isn't read
+    assert db.stamps_may_be_stale(["books", "loans"], stamps) is stale
+
+
+def test_cached_rows_are_only_reused_at_the_same_version(monkeypatch):
+    monkeypatch.setattr(db, "_query_cache", db.OrderedDict())
+    db.set_cached("borrowers", [{"borrowerid": 1}], version="3")
+
+    assert db.get_cached("borrowers", "3") == [{"borrowerid": 1}]
+    # Another process changed borrowers and bumped its version
+    assert db.get_cached("borrowers", "4") is None